@@ -1,9 +1,10 @@
 import streamlit as st
-import cv2
-import numpy as np
-from PIL import Image
-import io
-import base64
+import streamlit.components.v1 as components
+import hashlib
+import json
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), 'sketch_too_krl'))
 
 # Set page configuration
 st.set_page_config(
@@ -24,167 +25,42 @@ st.sidebar.title("Navigation")
 app_mode = st.sidebar.selectbox("Choose the app mode", 
                                 ["Upload Sketch", "Draw Sketch", "Generate KRL"])
 
-# Utility functions
-def process_image(image):
-    """Process image to extract paths"""
-    # Convert PIL image to OpenCV format
-    opencv_image = np.array(image)
-    opencv_image = cv2.cvtColor(opencv_image, cv2.COLOR_RGB2BGR)
-    
-    # Convert to grayscale
-    gray = cv2.cvtColor(opencv_image, cv2.COLOR_BGR2GRAY)
-    
-    # Apply threshold to get binary image
-    _, binary = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY_INV)
-    
-    # Find contours
-    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    # Draw contours on a black background
-    contour_img = np.zeros_like(opencv_image)
-    cv2.drawContours(contour_img, contours, -1, (0, 255, 0), 2)
-    
-    return contour_img, contours
+# Shared sketch -> KRL pipeline (same processing and code generation as the Flask app)
+@st.cache_resource
+def get_pipeline():
+    """Create the pipeline once per server process instead of on every rerun.
+    OpenCV and NumPy are only imported here, so pages that process nothing load fast;
+    with WARM_PIPELINE=1 a synthetic sketch is also run through every stage."""
+    from utils.pipeline import SketchPipeline
+    pipeline = SketchPipeline(output_dir=None)
+    if os.environ.get('WARM_PIPELINE') == '1':
+        pipeline.warm_up()
+    return pipeline
 
-def extract_paths(contours):
-    """Extract path information from contours"""
-    paths = []
-    
-    for i, contour in enumerate(contours):
-        # Simplify contour using Ramer-Douglas-Peucker algorithm
-        epsilon = 0.02 * cv2.arcLength(contour, True)
-        simplified = cv2.approxPolyDP(contour, epsilon, True)
-        
-        # Extract points
-        points = []
-        for point in simplified:
-            points.append({
-                'x': int(point[0][0]),
-                'y': int(point[0][1])
-            })
-        
-        paths.append({
-            'id': i,
-            'points': points,
-            'length': len(points)
-        })
-    
-    return paths
+@st.cache_data(max_entries=32)
+def process_sketch(image_bytes, filename, params):
+    """Decode the sketch and extract its paths, memoized on the image bytes and pipeline parameters"""
+    _, paths, preview_bytes = get_pipeline().process_bytes(image_bytes, filename)
+    return paths, preview_bytes
 
-def paths_to_coordinates(paths, canvas_size=(400, 300)):
-    """Convert path points to KRL coordinates"""
-    krl_coordinates = []
-    
-    for path in paths:
-        coords = []
-        for point in path['points']:
-            # Convert canvas coordinates to KRL coordinates with realistic robot workspace values
-            # Assuming the robot workspace is 1000mm x 1000mm x 1000mm
-            x = (point['x'] / canvas_size[0]) * 800 + 100  # Scale to 100-900mm range
-            y = (point['y'] / canvas_size[1]) * 800 + 100  # Scale to 100-900mm range
-            z = 300  # Default Z height for a consistent plane
-            
-            coords.append({
-                'x': round(x, 2),
-                'y': round(y, 2),
-                'z': round(z, 2)
-            })
-        
-        krl_coordinates.append(coords)
-    
-    return krl_coordinates
+@st.cache_data(max_entries=64)
+def generate_krl_code(start_position, motion_types, interpretation, clarifications, sketch_key, _paths):
+    """Generate the KRL program, memoized on the answers and the sketch (paths are keyed by sketch_key)"""
+    return get_pipeline().generate(start_position, motion_types, interpretation, clarifications, _paths)
 
-def generate_krl_code(start_position, motion_types, interpretation, clarifications, paths):
-    """Generate KRL code based on user inputs and detected paths"""
-    # Basic KRL program structure
-    krl_code = "DEF sketch_program()\n"
-    krl_code += "  INI\n"
-    krl_code += "  \n"
-    
-    # Add global declarations
-    krl_code += "  DECL E6POS home_position = {X 0, Y 0, Z 0, A 0, B 0, C 0, S 6, T 27}\n"
-    krl_code += "  \n"
-    
-    # Add start position
-    if start_position == "HOME":
-        krl_code += "  ; Move to home position\n"
-        krl_code += "  PTP home_position\n"
-        krl_code += "  \n"
-    
-    # Convert paths to coordinates if needed
-    if interpretation == "coordinates":
-        coordinates = paths_to_coordinates(paths)
-    else:
-        coordinates = []
-    
-    # Add motion commands based on detected paths
-    if paths:
-        krl_code += "  ; Process detected paths from sketch\n"
-        for i, path in enumerate(paths):
-            if i < len(motion_types):
-                motion_type = motion_types[i]
-            else:
-                motion_type = "PTP"  # Default motion type
-            
-            krl_code += f"  ; Path {i+1} motion\n"
-            if motion_type == "PTP":
-                if interpretation == "coordinates" and i < len(coordinates):
-                    coord = coordinates[i][0] if coordinates[i] else {'x': 100, 'y': 200, 'z': 300}
-                    krl_code += f"  PTP {{X {coord['x']}, Y {coord['y']}, Z {coord['z']}, A 0, B 0, C 0, S 6, T 27}}\n"
-                else:
-                    krl_code += f"  PTP {{X 100, Y 200, Z 300, A 0, B 0, C 0, S 6, T 27}} ; Default coordinates\n"
-            elif motion_type == "LIN":
-                if interpretation == "coordinates" and i < len(coordinates):
-                    coord = coordinates[i][0] if coordinates[i] else {'x': 100, 'y': 200, 'z': 300}
-                    krl_code += f"  LIN {{X {coord['x']}, Y {coord['y']}, Z {coord['z']}, A 0, B 0, C 0, S 6, T 27}} C_VEL\n"
-                else:
-                    krl_code += f"  LIN {{X 100, Y 200, Z 300, A 0, B 0, C 0, S 6, T 27}} C_VEL ; Default coordinates\n"
-            elif motion_type == "CIRC":
-                if interpretation == "coordinates" and i < len(coordinates) and len(coordinates[i]) >= 2:
-                    coord1 = coordinates[i][0]
-                    coord2 = coordinates[i][1]
-                    krl_code += f"  CIRC {{X {coord1['x']}, Y {coord1['y']}, Z {coord1['z']}, A 0, B 0, C 0, S 6, T 27}}, {{X {coord2['x']}, Y {coord2['y']}, Z {coord2['z']}, A 0, B 0, C 0, S 6, T 27}} C_VEL\n"
-                else:
-                    krl_code += f"  CIRC {{X 150, Y 250, Z 350, A 0, B 0, C 0, S 6, T 27}}, {{X 200, Y 300, Z 400, A 0, B 0, C 0, S 6, T 27}} C_VEL ; Default coordinates\n"
-            elif motion_type == "SPLINE":
-                krl_code += f"  SPLINE\n"
-                if interpretation == "coordinates" and i < len(coordinates):
-                    for j, coord in enumerate(coordinates[i][:5]):  # Limit to first 5 points
-                        krl_code += f"    SPL {{X {coord['x']}, Y {coord['y']}, Z {coord['z']}, A 0, B 0, C 0, S 6, T 27}}\n"
-                else:
-                    # Default spline points
-                    krl_code += f"    SPL {{X 100, Y 200, Z 300, A 0, B 0, C 0, S 6, T 27}}\n"
-                    krl_code += f"    SPL {{X 150, Y 250, Z 350, A 0, B 0, C 0, S 6, T 27}}\n"
-                    krl_code += f"    SPL {{X 200, Y 300, Z 400, A 0, B 0, C 0, S 6, T 27}}\n"
-                    krl_code += f"    SPL {{X 250, Y 350, Z 450, A 0, B 0, C 0, S 6, T 27}}\n"
-                    krl_code += f"    SPL {{X 300, Y 400, Z 500, A 0, B 0, C 0, S 6, T 27}}\n"
-                krl_code += f"  ENDSPLINE\n"
-            krl_code += "  \n"
-    else:
-        # If no paths were detected, generate sample code
-        krl_code += "  ; No paths detected in sketch, generating sample motions\n"
-        for i, motion_type in enumerate(motion_types):
-            if motion_type == "PTP":
-                krl_code += f"  PTP {{X {100*(i+1)}, Y {200*(i+1)}, Z {300*(i+1)}, A 0, B 0, C 0, S 6, T 27}} ; Sample point {i+1}\n"
-            elif motion_type == "LIN":
-                krl_code += f"  LIN {{X {100*(i+1)}, Y {200*(i+1)}, Z {300*(i+1)}, A 0, B 0, C 0, S 6, T 27}} C_VEL ; Sample point {i+1}\n"
-            elif motion_type == "CIRC":
-                krl_code += f"  CIRC {{X {150*(i+1)}, Y {250*(i+1)}, Z {350*(i+1)}, A 0, B 0, C 0, S 6, T 27}}, {{X {200*(i+1)}, Y {300*(i+1)}, Z {400*(i+1)}, A 0, B 0, C 0, S 6, T 27}} C_VEL ; Sample points {i+1}\n"
-            elif motion_type == "SPLINE":
-                krl_code += f"  SPLINE\n"
-                krl_code += f"    SPL {{X {100*(i+1)}, Y {200*(i+1)}, Z {300*(i+1)}, A 0, B 0, C 0, S 6, T 27}} ; Sample point {i+1}a\n"
-                krl_code += f"    SPL {{X {150*(i+1)}, Y {250*(i+1)}, Z {350*(i+1)}, A 0, B 0, C 0, S 6, T 27}} ; Sample point {i+1}b\n"
-                krl_code += f"    SPL {{X {200*(i+1)}, Y {300*(i+1)}, Z {400*(i+1)}, A 0, B 0, C 0, S 6, T 27}} ; Sample point {i+1}c\n"
-                krl_code += f"  ENDSPLINE\n"
-            krl_code += "  \n"
-    
-    # Add program end
-    if start_position == "HOME":
-        krl_code += "  ; Return to home position\n"
-        krl_code += "  PTP home_position\n"
-    krl_code += "END\n"
-    
-    return krl_code
+def sketch_key(image_bytes, params):
+    """Identify an uploaded sketch and the parameters it was processed with"""
+    digest = hashlib.sha256(image_bytes)
+    digest.update(repr(sorted(params.items())).encode('utf-8'))
+    return digest.hexdigest()
+
+# Drawing canvas sending its strokes back as timestamped [x, y, t] point lists
+_stroke_canvas = components.declare_component(
+    "stroke_canvas", path=os.path.join(os.path.dirname(__file__), 'components', 'stroke_canvas'))
+
+def stroke_canvas(width=400, height=300, key=None):
+    """Show the drawing canvas; returns {'width', 'height', 'strokes'} once something is drawn"""
+    return _stroke_canvas(width=width, height=height, key=key, default=None)
 
 # Main app logic
 if app_mode == "Upload Sketch":
@@ -195,21 +71,22 @@ if app_mode == "Upload Sketch":
     
     if uploaded_file is not None:
         # Process the uploaded image
-        image = Image.open(uploaded_file)
-        processed_image, contours = process_image(image)
-        paths = extract_paths(contours)
+        image_bytes = uploaded_file.getvalue()
+        params = get_pipeline().processor.pipeline_params()
+        paths, preview_bytes = process_sketch(image_bytes, uploaded_file.name, params)
         
         # Store paths in session state
         st.session_state.paths = paths
+        st.session_state.sketch_key = sketch_key(image_bytes, params)
         
         # Display images
         col1, col2 = st.columns(2)
         with col1:
             st.subheader("Original Sketch")
-            st.image(image, use_column_width=True)
+            st.image(image_bytes, use_column_width=True)
         with col2:
             st.subheader("Processed Sketch")
-            st.image(processed_image, channels="BGR", use_column_width=True)
+            st.image(preview_bytes, use_column_width=True)
         
         st.success(f"Detected {len(paths)} path(s) in your sketch!")
         if st.button("Generate KRL Code"):
@@ -220,82 +97,25 @@ elif app_mode == "Draw Sketch":
     st.header("Draw Sketch")
     st.markdown("Draw your robot path directly in the browser:")
     
-    # Drawing canvas using Streamlit components
-    st.markdown("""
-    <style>
-    .canvas-container {
-        border: 1px solid #ccc;
-        border-radius: 4px;
-        margin-bottom: 10px;
-    }
-    </style>
-    
-    <div class="canvas-container">
-        <canvas id="drawingCanvas" width="400" height="300"></canvas>
-    </div>
-    
-    <button id="clearCanvas">Clear Canvas</button>
-    
-    <script>
-    // Canvas drawing functionality
-    const canvas = document.getElementById('drawingCanvas');
-    const ctx = canvas.getContext('2d');
-    const clearBtn = document.getElementById('clearCanvas');
+    # Strokes go straight into the pipeline as paths, in the order they were drawn,
+    # instead of being rendered to an image and traced back
+    drawing = stroke_canvas(key="stroke_canvas")
     
-    // Set up canvas
-    ctx.fillStyle = 'white';
-    ctx.fillRect(0, 0, canvas.width, canvas.height);
-    ctx.strokeStyle = '#000000';
-    ctx.lineWidth = 2;
-    ctx.lineJoin = 'round';
-    ctx.lineCap = 'round';
-    
-    // Drawing variables
-    let isDrawing = false;
-    let lastX = 0;
-    let lastY = 0;
-    
-    function startDrawing(e) {
-        isDrawing = true;
-        [lastX, lastY] = [e.offsetX, e.offsetY];
-    }
-    
-    function draw(e) {
-        if (!isDrawing) return;
+    if drawing and drawing['strokes']:
+        canvas_size = (drawing['width'], drawing['height'])
+        paths = get_pipeline().process_strokes(drawing['strokes'], canvas_size)
         
-        ctx.beginPath();
-        ctx.moveTo(lastX, lastY);
-        ctx.lineTo(e.offsetX, e.offsetY);
-        ctx.stroke();
+        # Store paths in session state
+        st.session_state.paths = paths
+        st.session_state.sketch_key = sketch_key(json.dumps(drawing, sort_keys=True).encode('utf-8'),
+                                                 get_pipeline().processor.pipeline_params())
         
-        [lastX, lastY] = [e.offsetX, e.offsetY];
-    }
-    
-    function stopDrawing() {
-        isDrawing = false;
-    }
-    
-    // Add event listeners
-    canvas.addEventListener('mousedown', startDrawing);
-    canvas.addEventListener('mousemove', draw);
-    canvas.addEventListener('mouseup', stopDrawing);
-    canvas.addEventListener('mouseout', stopDrawing);
-    
-    // Clear canvas
-    clearBtn.addEventListener('click', function() {
-        ctx.fillStyle = 'white';
-        ctx.fillRect(0, 0, canvas.width, canvas.height);
-    });
-    
-    // Save canvas data to Streamlit
-    function saveCanvas() {
-        const dataURL = canvas.toDataURL('image/png');
-        // In a real implementation, we would send this to Streamlit
-    }
-    </script>
-    """, unsafe_allow_html=True)
-    
-    st.info("Note: The drawing functionality is currently limited in this Streamlit version. For best results, please upload an image of your sketch.")
+        st.success(f"Captured {len(drawing['strokes'])} stroke(s) as {len(paths)} path(s)!")
+        if st.button("Generate KRL Code"):
+            st.session_state.app_mode = "Generate KRL"
+            st.experimental_rerun()
+    else:
+        st.info("Each stroke becomes one robot path, in the order you draw them.")
 
 elif app_mode == "Generate KRL":
     st.header("Generate KRL Code")
@@ -322,7 +142,8 @@ elif app_mode == "Generate KRL":
                                    ["PTP (Point-to-Point)", 
                                     "LIN (Linear)", 
                                     "CIRC (Circular)", 
-                                    "SPLINE (Smooth path)"], 
+                                    "SPLINE (Smooth path)",
+                                    "AUTO (Fit lines and arcs)"], 
                                    key=f"path_{i}")
             motion_type = motion_type.split(" ")[0]  # Extract motion type
             motion_types.append(motion_type)
@@ -339,8 +160,14 @@ elif app_mode == "Generate KRL":
     # Interpretation method
     interpretation = st.radio("Interpretation Method:", 
                              ["Direct sketch interpretation (use path shapes directly)", 
-                              "With coordinates (convert sketch to specific coordinates)"])
-    interpretation = "coordinates" if "With coordinates" in interpretation else "direct"
+                              "With coordinates (convert sketch to specific coordinates)",
+                              "Full trajectory (follow every point of each path)"])
+    if "With coordinates" in interpretation:
+        interpretation = "coordinates"
+    elif "Full trajectory" in interpretation:
+        interpretation = "trajectory"
+    else:
+        interpretation = "direct"
     
     # Clarifications
     clarifications = st.radio("Clarifications:", 
@@ -350,7 +177,8 @@ elif app_mode == "Generate KRL":
     
     # Generate KRL code
     if st.button("Generate KRL Code"):
-        krl_code = generate_krl_code(start_position, motion_types, interpretation, clarifications, paths)
+        krl_code = generate_krl_code(start_position, motion_types, interpretation, clarifications,
+                                     st.session_state.get('sketch_key'), paths)
         
         st.subheader("Generated KRL Code")
         st.code(krl_code, language="python")
@@ -1,12 +1,29 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+import time
+STARTUP_BEGAN = time.perf_counter()
+from flask import (Flask, render_template, request, redirect, url_for, flash, session, Response, jsonify,
+                   stream_with_context)
 import os
-import cv2
-import numpy as np
+import uuid
+import mimetypes
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
 import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), 'utils'))
-from utils.image_processor import SketchProcessor
-from utils.krl_generator import KRLGenerator
+from utils.archive_export import archive_stems, stream_archive
+from utils.krl_modules import DEFAULT_CHUNK_SIZE
+from utils.result_cache import ResultCache
+from utils.job_queue import JobQueue, DONE, FAILED
+from utils.metrics import MetricsRegistry, PipelineMetrics
+from utils.session_store import create_session_store, ServerSideSessionInterface
+from utils.upload_store import UploadStore
+
+# Startup phases (imports, pipeline, warm-up stages) reported by /metrics; OpenCV and NumPy
+# are only imported with the pipeline
+startup_metrics = PipelineMetrics()
+startup_metrics.stages['imports'] = time.perf_counter() - STARTUP_BEGAN
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -15,19 +32,121 @@ app.secret_key = 'your_secret_key_here'
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+# Uploads and previews are kept in memory; set PERSIST_UPLOADS=1 to also write them
+# to UPLOAD_FOLDER, which is then pruned to UPLOAD_MAX_FILES files of at most UPLOAD_MAX_AGE seconds
+PERSIST_UPLOADS = os.environ.get('PERSIST_UPLOADS') == '1'
+UPLOAD_MAX_FILES = 500
+UPLOAD_MAX_AGE = 24 * 3600
+# Uploaded and processed images served to the browser from memory
+IMAGE_CACHE_SIZE = 128
+# Processed sketch results kept in memory; set RESULT_CACHE_DIR to also keep them on disk
+RESULT_CACHE_SIZE = 64
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR')
+# Background workers processing uploaded sketches
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', os.cpu_count() or 1))
+# Longest time a /jobs/<job_id> request may block waiting for a job to finish
+MAX_JOB_WAIT = 30
+# Session data (paths, KRL code, ...) is kept server-side: 'memory' or 'sqlite'
+SESSION_STORE = os.environ.get('SESSION_STORE', 'memory')
+SESSION_DB = os.environ.get('SESSION_DB', 'sessions.db')
+SESSION_TTL = 3600
+# Large scans: decode at 1/PROCESS_REDUCE_FACTOR resolution (1, 2, 4, 8) and/or process in tiles
+PROCESS_REDUCE_FACTOR = int(os.environ.get('PROCESS_REDUCE_FACTOR', 1))
+PROCESS_TILE_SIZE = int(os.environ.get('PROCESS_TILE_SIZE', 0)) or None
+# Contour simplification accuracy in pixels (default: 2% of each contour's perimeter) and the
+# maximum deviation in mm of the "trajectory" interpretation from the sketch
+PROCESS_SIMPLIFY_TOLERANCE = float(os.environ.get('PROCESS_SIMPLIFY_TOLERANCE', 0)) or None
+TRAJECTORY_TOLERANCE = float(os.environ.get('TRAJECTORY_TOLERANCE', 0.5))
+# Set ORDER_PATHS=1 to reorder paths to reduce robot travel between them
+ORDER_PATHS = os.environ.get('ORDER_PATHS') == '1'
+# Join broken strokes whose ends are within this many pixels (default: off)
+MERGE_TOLERANCE = float(os.environ.get('MERGE_TOLERANCE', 0)) or None
+# Set CENTERLINE=1 to trace the middle of pen strokes instead of their outlines
+CENTERLINE = os.environ.get('CENTERLINE') == '1'
+# Workspace calibration file (written by `cli.py calibrate`) mapping pixels onto the robot
+# base frame; by default the canvas is scaled onto the 100-900 mm range at Z 300
+CALIBRATION_FILE = os.environ.get('CALIBRATION_FILE')
+# /export converts many sketches per request on its own workers; at most EXPORT_MAX_PENDING
+# sketches are loaded or converting at once while the ZIP is streamed
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', JOB_WORKERS))
+EXPORT_MAX_PENDING = 2 * EXPORT_WORKERS
+# Uploads up to this size are held in memory until their turn, larger ones spill to disk
+EXPORT_SPOOL_SIZE = 1024 * 1024
+# Set PROFILE_PIPELINE=1 to attach a cProfile report of the latest run to /metrics
+PROFILE_PIPELINE = os.environ.get('PROFILE_PIPELINE') == '1'
+# The pipeline (with OpenCV and NumPy) is created on first use, so routes that do not process
+# sketches start fast. Set WARM_PIPELINE=1 to create it at startup and run a synthetic sketch
+# through every stage, so the first request of this (single) process does not pay for it.
+WARM_PIPELINE = os.environ.get('WARM_PIPELINE') == '1'
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-
-# Ensure upload directory exists
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+app.session_interface = ServerSideSessionInterface(
+    create_session_store(SESSION_STORE, path=SESSION_DB, ttl=SESSION_TTL))
 
 # Initialize modules
-sketch_processor = SketchProcessor()
-krl_generator = KRLGenerator()
+result_cache = ResultCache(max_entries=RESULT_CACHE_SIZE, cache_dir=RESULT_CACHE_DIR)
+metrics_registry = MetricsRegistry()
+_pipeline = None
+_pipeline_lock = threading.Lock()
+job_queue = JobQueue(workers=JOB_WORKERS)
+export_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix='sketch-export')
+image_cache = ResultCache(max_entries=IMAGE_CACHE_SIZE)
+upload_store = UploadStore(UPLOAD_FOLDER, UPLOAD_MAX_FILES, UPLOAD_MAX_AGE) if PERSIST_UPLOADS else None
+
+def get_pipeline():
+    """
+    The shared sketch pipeline, created (and OpenCV/NumPy imported) on first use
+    """
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                with startup_metrics.stage('pipeline_imports'):
+                    from utils.calibration import WorkspaceCalibration
+                    from utils.pipeline import SketchPipeline
+                with startup_metrics.stage('pipeline'):
+                    calibration = WorkspaceCalibration.load(CALIBRATION_FILE) if CALIBRATION_FILE else None
+                    _pipeline = SketchPipeline(output_dir=UPLOAD_FOLDER, cache=result_cache,
+                                               metrics_registry=metrics_registry, profile=PROFILE_PIPELINE,
+                                               reduce_factor=PROCESS_REDUCE_FACTOR, tile_size=PROCESS_TILE_SIZE,
+                                               simplify_tolerance=PROCESS_SIMPLIFY_TOLERANCE,
+                                               tolerance=TRAJECTORY_TOLERANCE,
+                                               optimize_order=ORDER_PATHS, merge_tolerance=MERGE_TOLERANCE,
+                                               centerline=CENTERLINE, calibration=calibration)
+    return _pipeline
+
+if WARM_PIPELINE:
+    get_pipeline().warm_up(startup_metrics)
+startup_metrics.count('warm', WARM_PIPELINE)
+startup_metrics.count('seconds_to_ready', time.perf_counter() - STARTUP_BEGAN)
+if WARM_PIPELINE:
+    app.logger.info("Started in %.0f ms (%s)", startup_metrics.counts['seconds_to_ready'] * 1000,
+                    ', '.join(f'{name} {seconds * 1000:.0f} ms' for name, seconds in startup_metrics.stages.items()))
+
+@app.before_request
+def require_single_process():
+    # Jobs, images and the memory session store live in this process, so a request served
+    # by another worker process would not find the sketch it refers to
+    if request.environ.get('wsgi.multiprocess'):
+        app.logger.error("Serve app.py from a single worker process (use threads for concurrency)")
+        return 'This app must run in a single worker process', 500
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def image_mimetype(filename):
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+def process_upload(image_id, image_bytes, filename):
+    """
+    Background job: process an uploaded sketch in memory and cache its preview
+    """
+    processed_filename, paths, preview_bytes = get_pipeline().process_bytes(image_bytes, filename)
+    image_cache.put(image_id + '/processed', (preview_bytes, image_mimetype(processed_filename)))
+    if upload_store is not None:
+        upload_store.save(processed_filename, preview_bytes)
+    return processed_filename, paths
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -46,10 +165,19 @@ def upload_file():
     
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        session['filepath'] = filepath
+        
+        # Read straight from the request stream; nothing touches the disk unless configured
+        image_bytes = file.read()
+        image_id = uuid.uuid4().hex
+        image_cache.put(image_id + '/original', (image_bytes, image_mimetype(filename)))
+        if upload_store is not None:
+            session['filepath'] = upload_store.save(filename, image_bytes)
         session['filename'] = filename
+        session['image_id'] = image_id
+        session.pop('krl_program', None)
+        
+        # Process the sketch in the background and return immediately
+        session['job_id'] = job_queue.submit(process_upload, image_id, image_bytes, filename)
         return redirect(url_for('process_sketch'))
     
     flash('Invalid file type. Please upload PNG or JPG images.')
@@ -57,23 +185,104 @@ def upload_file():
 
 @app.route('/process')
 def process_sketch():
-    filepath = session.get('filepath')
-    if not filepath:
+    image_id = session.get('image_id')
+    if not image_id:
         flash('No file uploaded')
         return redirect(url_for('index'))
     
-    try:
-        # Process the sketch to extract paths
-        processed_image_path, paths = sketch_processor.process_sketch(filepath)
-        session['processed_image_path'] = processed_image_path
-        session['paths'] = paths
-        
-        return render_template('process.html', 
-                              filename=session.get('filename'),
-                              processed_image=processed_image_path)
-    except Exception as e:
-        flash(f'Error processing sketch: {str(e)}')
+    job_id = session.get('job_id')
+    status = job_queue.status(job_id) if job_id else None
+    if status is None:
+        # Unknown or expired job: queue the sketch again if it is still around
+        image_bytes = load_upload(image_id)
+        if image_bytes is None:
+            flash('The uploaded sketch has expired, please upload it again')
+            return redirect(url_for('index'))
+        job_id = job_queue.submit(process_upload, image_id, image_bytes, session.get('filename'))
+        session['job_id'] = job_id
+        status = job_queue.status(job_id)
+    
+    if status['status'] == FAILED:
+        session.pop('job_id', None)
+        flash(f"Error processing sketch: {status['error']}")
         return redirect(url_for('index'))
+    
+    if status['status'] != DONE:
+        # Still processing, the page polls the job status and reloads when done
+        return render_template('process.html',
+                              filename=session.get('filename'),
+                              image_id=image_id,
+                              job_id=job_id,
+                              pending=True)
+    
+    # Extracted paths and preview from the finished job
+    processed_image_path, paths = job_queue.result(job_id)
+    session['processed_image_path'] = processed_image_path
+    session['paths'] = paths
+    
+    return render_template('process.html', 
+                          filename=session.get('filename'),
+                          image_id=image_id,
+                          processed_image=processed_image_path,
+                          travel=getattr(paths, 'travel', None))
+
+def load_upload(image_id):
+    """
+    Original bytes of an upload, from the image cache or the persisted copy
+    """
+    cached = image_cache.get(image_id + '/original')
+    if cached is not None:
+        return cached[0]
+    filepath = session.get('filepath')
+    if filepath and os.path.exists(filepath):
+        with open(filepath, 'rb') as f:
+            return f.read()
+    return None
+
+@app.route('/images/<image_id>/<kind>')
+def sketch_image(image_id, kind):
+    # Original upload or processed preview, served from memory
+    if kind not in ('original', 'processed'):
+        return 'Unknown image', 404
+    cached = image_cache.get(f"{image_id}/{kind}")
+    if cached is None:
+        return 'Image expired', 404
+    image_bytes, mimetype = cached
+    return Response(image_bytes, mimetype=mimetype)
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    # Optional long-poll: ?wait=<seconds> blocks until the job finishes
+    wait = min(request.args.get('wait', 0, type=float), MAX_JOB_WAIT)
+    if wait > 0:
+        status = job_queue.wait(job_id, timeout=wait)
+    else:
+        status = job_queue.status(job_id)
+    
+    if status is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(status)
+
+@app.route('/paths')
+def select_paths():
+    # Path under a pixel (?x=&y=[&radius=]) or paths in a rectangle (?x0=&y0=&x1=&y1=[&contained=1])
+    paths = session.get('paths')
+    if paths is None:
+        return jsonify({'error': 'No processed sketch'}), 404
+    
+    # The index is built once per sketch and kept next to its images
+    index_key = session.get('image_id', '') + '/index'
+    index = image_cache.get(index_key)
+    if index is None:
+        index = get_pipeline().index_paths(paths)
+        image_cache.put(index_key, index)
+    
+    args = request.args
+    if 'x0' in args:
+        rect = [args.get(name, 0, type=float) for name in ('x0', 'y0', 'x1', 'y1')]
+        return jsonify({'paths': index.select(rect, contained=args.get('contained') == '1')})
+    point = (args.get('x', 0, type=float), args.get('y', 0, type=float))
+    return jsonify({'path': index.path_at(point, radius=args.get('radius', 3, type=float))})
 
 @app.route('/generate', methods=['GET', 'POST'])
 def generate_krl():
@@ -92,14 +301,112 @@ def generate_krl():
         
         # Generate KRL code
         paths = session.get('paths', [])
-        krl_code = krl_generator.generate_program(start_position, motion_types, interpretation, clarifications, paths)
+        previous = session.get('krl_program')
+        program = get_pipeline().build_program(start_position, motion_types, interpretation, clarifications, paths,
+                                         previous=previous)
+        changes = program.diff(previous) if previous is not None else None
+        krl_code = program.text()
+        session['krl_program'] = program
         session['krl_code'] = krl_code
         
-        return render_template('result.html', krl_code=krl_code)
+        return render_template('result.html', krl_code=krl_code, changes=changes)
     
     # For GET request, we need to determine how many paths we have to create appropriate form
     paths = session.get('paths', [])
     return render_template('generate.html', paths=paths)
 
+@app.route('/download')
+def download_krl():
+    motion_types = session.get('motion_types')
+    if motion_types is None:
+        flash('No KRL program generated yet')
+        return redirect(url_for('index'))
+    
+    # Stream the program line by line instead of building it in memory
+    lines = get_pipeline().iter_program(session.get('start_position'),
+                                  motion_types,
+                                  session.get('interpretation'),
+                                  session.get('clarifications'),
+                                  session.get('paths', []))
+    return Response(lines,
+                    mimetype='text/plain',
+                    headers={'Content-Disposition': 'attachment; filename=sketch_program.src'})
+
+def export_sketch(filename, image_bytes, options):
+    """
+    Export worker: process one sketch and generate its program, returning the archive entries
+    """
+    stem = os.path.splitext(filename)[0]  # Final program name, see export_sources
+    processed_filename, paths, preview_bytes = get_pipeline().process_bytes(image_bytes, filename)
+    motion_types = [options['motion_type']] * max(len(paths), 1)
+    args = (options['start_position'], motion_types, options['interpretation'], 'no', paths)
+    if options['modules']:
+        modules = get_pipeline().build_modules(stem, *args, chunk_size=options['chunk_size'])
+        entries = [(name, text.encode()) for name, text in modules.items()]
+    else:
+        entries = [(stem + '.src', get_pipeline().generate(*args).encode())]
+    if options['previews']:
+        entries.append(('previews/' + stem + os.path.splitext(processed_filename)[1], preview_bytes))
+    return entries, {'paths': len(paths), 'travel': getattr(paths, 'travel', None)}
+
+def export_sources(files, modules=False):
+    """
+    (file name, loader) per uploaded sketch, the file name renamed to the distinct program
+    name it is exported under (see archive_stems). Werkzeug closes the uploads once the view
+    returns, before the archive is streamed, so each is first spooled into a temporary file of
+    our own (kept in memory up to EXPORT_SPOOL_SIZE bytes) that its loader reads and closes.
+    """
+    sources = []
+    filenames = [secure_filename(file.filename or '') for file in files]
+    stems = iter(archive_stems([filename for filename in filenames if allowed_file(filename)], modules))
+    for file, filename in zip(files, filenames):
+        if not allowed_file(filename):
+            def reject(name=file.filename):
+                raise ValueError(f"{name!r} is not a PNG or JPG image")
+            sources.append((file.filename or '(unnamed)', reject))
+            continue
+        spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+        shutil.copyfileobj(file.stream, spool)
+        spool.seek(0)
+        def load(spool=spool):
+            with spool:
+                return spool.read()
+        sources.append((next(stems) + os.path.splitext(filename)[1], load))
+    return sources
+
+@app.route('/export', methods=['POST'])
+def export_archive():
+    # Many sketches in one request: a ZIP of their programs (and previews with previews=1)
+    # streamed while the sketches are converted in parallel
+    files = [file for file in request.files.getlist('files') if file.filename]
+    if not files:
+        return jsonify({'error': 'No sketches uploaded (use the "files" field)'}), 400
+    
+    form = request.form
+    options = {
+        'motion_type': form.get('motion_type', 'PTP'),
+        'interpretation': form.get('interpretation', 'coordinates'),
+        'start_position': form.get('start_position', 'HOME'),
+        'previews': form.get('previews') == '1',
+        'modules': form.get('modules') == '1',
+        'chunk_size': form.get('chunk_size', DEFAULT_CHUNK_SIZE, type=int),
+    }
+    chunks = stream_archive(export_sources(files, options['modules']),
+                            lambda filename, image_bytes: export_sketch(filename, image_bytes, options),
+                            export_executor, max_pending=EXPORT_MAX_PENDING)
+    return Response(stream_with_context(chunks),
+                    mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename=sketches.zip'})
+
+@app.route('/metrics')
+def metrics():
+    # Aggregated per-stage timings and counts of every processed sketch
+    return jsonify({
+        'pipeline': metrics_registry.snapshot(),
+        'result_cache': result_cache.stats(),
+        'krl_blocks': _pipeline.generator.block_cache_stats() if _pipeline is not None else None,
+        'startup': startup_metrics.to_dict(),
+    })
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.pipeline_benchmark import environment
+from utils.krl_format import MOTION_TEMPLATES, PositionFormat
+from utils.krl_generator import KRLGenerator
+from utils.path_data import SketchPath, SketchPaths
+
+MOTION_TYPES = ['PTP', 'LIN', 'CIRC', 'SPLINE']
+
+
+def legacy_lines(coords, motion_type, orientation="A 0, B 0, C 0"):
+    """
+    Motion lines as the generator emitted them before the template table: a formatted
+    position string per point, then an f-string per line
+    """
+    positions = [f"{{X {x}, Y {y}, Z {z}, {orientation}, S 6, T 27}}" for x, y, z in coords.tolist()]
+    if motion_type == "PTP":
+        return [f"  PTP {position}\n" for position in positions]
+    if motion_type == "LIN":
+        return [f"  LIN {position} C_VEL\n" for position in positions]
+    if motion_type == "CIRC":
+        return [f"  CIRC {positions[k]}, {positions[k + 1]} C_VEL\n" for k in range(0, len(positions) - 1, 2)]
+    return [f"    SPL {position}\n" for position in positions]
+
+
+def template_lines(coords, motion_type, position_format):
+    template = MOTION_TEMPLATES['SPL' if motion_type == 'SPLINE' else motion_type]
+    if motion_type == 'CIRC':
+        coords = coords[:len(coords) // 2 * 2]
+    return position_format.lines(template, coords)
+
+
+def random_walk(points, seed=0):
+    """
+    A wiggly (points, 2) pixel path on a 4K canvas that decimation barely thins out
+    """
+    rng = np.random.default_rng(seed)
+    steps = rng.integers(-3, 4, size=(points, 2))
+    return np.clip(np.cumsum(steps, axis=0) + (1920, 1080), 0, (3839, 2159))
+
+
+def timed(func, *args, repeats=3):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        value = func(*args)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), value
+
+
+def benchmark_case(points, motion_type, precision, repeats):
+    rng = np.random.default_rng(points)
+    # Coordinates as the calibration produces them: mm rounded to 2 decimals
+    coords = np.round(rng.uniform(100, 900, size=(points, 3)), 2)
+    position_format = PositionFormat(precision=precision)
+
+    legacy, old = timed(legacy_lines, coords, motion_type, repeats=repeats)
+    templated, new = timed(template_lines, coords, motion_type, position_format, repeats=repeats)
+    if precision is None and old != new:
+        raise AssertionError(f"{motion_type}: template output differs from the legacy lines")
+
+    # The whole generator: a trajectory through every point of one long path
+    path = SketchPaths([SketchPath(0, random_walk(points), closed=False)], image_size=(3840, 2160))
+    generator = KRLGenerator(tolerance=0, position_format=position_format)
+    program, _ = timed(generator.generate_program, 'HOME', [motion_type], 'trajectory', 'no', path,
+                       repeats=repeats)
+    return {
+        'case': f"{motion_type}-{points}-p{precision}",
+        'points': points,
+        'motion_type': motion_type,
+        'precision': precision,
+        'legacy_seconds': legacy,
+        'template_seconds': templated,
+        'speedup': legacy / templated if templated > 0 else 0.0,
+        'program_seconds': program,
+        'program_points_per_second': points / program if program > 0 else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark KRL motion line emission against per-point f-strings')
+    parser.add_argument('--points', nargs='+', type=int, default=[100000, 1000000])
+    parser.add_argument('--motion-types', nargs='+', default=MOTION_TYPES, choices=MOTION_TYPES)
+    parser.add_argument('--precision', type=int, default=None,
+                        help='Decimals of X/Y/Z (default: plain float repr, checked against the legacy output)')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('-o', '--output', default=None, help='JSON results file')
+    args = parser.parse_args(argv)
+
+    results = {'environment': environment(), 'results': []}
+    for points in args.points:
+        for motion_type in args.motion_types:
+            case = benchmark_case(points, motion_type, args.precision, args.repeats)
+            results['results'].append(case)
+            print(f"{case['case']:>22}: legacy {case['legacy_seconds'] * 1000:8.1f} ms, "
+                  f"templates {case['template_seconds'] * 1000:8.1f} ms ({case['speedup']:.1f}x), "
+                  f"full program {case['program_points_per_second'] / 1000:.0f}k points/s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.synthetic_sketches import SKETCH_SIZES, generate_sketch, encode_sketch
+from utils.metrics import PipelineMetrics
+from utils.pipeline import SketchPipeline
+
+MOTION_TYPES = ['PTP', 'LIN', 'CIRC', 'SPLINE', 'AUTO']
+# Path extraction modes: outlines around strokes, or their centerlines (--centerline)
+MODES = ['outline', 'centerline']
+
+
+def run_stages(image_bytes, pipeline, motion_type='LIN'):
+    """
+    Run the sketch -> KRL pipeline once through SketchPipeline, returning the stage timings
+    and counts its PipelineMetrics collected, plus coordinate conversion and KRL emission.
+    The program is a trajectory through every path point, so emission scales with the
+    sketch instead of a few positions per path.
+    """
+    metrics = PipelineMetrics()
+    _, paths, _ = pipeline.process_bytes(image_bytes, 'sketch.png', metrics)
+    with metrics.stage('coordinates'):
+        pipeline.to_coordinates(paths)
+    with metrics.stage('krl_emission'):
+        program = pipeline.generate('HOME', [motion_type] * len(paths), 'trajectory', 'no', paths)
+
+    counts = {
+        'pixels': metrics.counts.get('pixels', 0),
+        'contours': metrics.counts.get('contours', 0),
+        'paths': len(paths),
+        'points': int(sum(path.length for path in paths)),
+        'program_lines': program.count('\n'),
+    }
+    return metrics.stages, counts
+
+
+def benchmark_case(size_name, strokes, noise, repeats, seed=0, motion_type='LIN', mode='outline'):
+    width, height = SKETCH_SIZES[size_name]
+    image_bytes = encode_sketch(generate_sketch(width, height, strokes=strokes, noise=noise, seed=seed))
+    pipeline = SketchPipeline(centerline=mode == 'centerline')
+
+    samples = {}
+    counts = None
+    for _ in range(repeats):
+        timings, counts = run_stages(image_bytes, pipeline, motion_type)
+        for stage, seconds in timings.items():
+            samples.setdefault(stage, []).append(seconds)
+
+    stages = {stage: {'median': statistics.median(values), 'min': min(values)}
+              for stage, values in samples.items()}
+    # Outline cases keep their original names so older baselines still line up
+    suffix = '' if mode == 'outline' else f"-{mode}"
+    return {
+        'case': f"{size_name}-s{strokes}-n{noise}{suffix}",
+        'base_case': f"{size_name}-s{strokes}-n{noise}",
+        'mode': mode,
+        'size': size_name,
+        'width': width,
+        'height': height,
+        'strokes': strokes,
+        'noise': noise,
+        'repeats': repeats,
+        'motion_type': motion_type,
+        'encoded_bytes': len(image_bytes),
+        'counts': counts,
+        'stages': stages,
+        'total_median': sum(stage['median'] for stage in stages.values()),
+    }
+
+
+def environment():
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return the (case, stage, baseline, current) tuples that got slower than tolerance allows
+    """
+    baseline_cases = {case['case']: case for case in baseline['results']}
+    regressions = []
+    for case in results['results']:
+        old = baseline_cases.get(case['case'])
+        if old is None:
+            continue
+        for stage, timing in case['stages'].items():
+            old_timing = old['stages'].get(stage)
+            if old_timing and timing['median'] > old_timing['median'] * (1 + tolerance):
+                regressions.append((case['case'], stage, old_timing['median'], timing['median']))
+    return regressions
+
+
+def slow_centerlines(results, max_ratio):
+    """
+    Return the (case, outline seconds, centerline seconds) of centerline cases that took more
+    than max_ratio times as long as the outline run of the same sketch
+    """
+    outlines = {case['base_case']: case for case in results['results'] if case['mode'] == 'outline'}
+    slow = []
+    for case in results['results']:
+        outline = outlines.get(case['base_case'])
+        if case['mode'] != 'centerline' or outline is None:
+            continue
+        if case['total_median'] > outline['total_median'] * max_ratio:
+            slow.append((case['case'], outline['total_median'], case['total_median']))
+    return slow
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the sketch -> KRL pipeline stage by stage')
+    parser.add_argument('--sizes', nargs='+', default=['canvas', 'hd', '4k'], choices=sorted(SKETCH_SIZES),
+                        help='Sketch sizes to benchmark (8k takes seconds per repeat)')
+    parser.add_argument('--strokes', nargs='+', type=int, default=[10, 100])
+    parser.add_argument('--noise', nargs='+', type=float, default=[0.0, 0.05])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--motion-type', default='LIN', choices=MOTION_TYPES,
+                        help='Motion type of the trajectory program emitted through every path point')
+    parser.add_argument('--modes', nargs='+', default=['outline'], choices=MODES,
+                        help='Trace stroke outlines and/or centerlines')
+    parser.add_argument('--max-centerline-ratio', type=float, default=10.0,
+                        help='With both modes, fail when a centerline case takes more than this many times '
+                             'as long as the outline case of the same sketch (0 disables the check)')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='JSON results file')
+    parser.add_argument('--baseline', help='Previous results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed slowdown per stage before it counts as a regression (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    results = {'environment': environment(), 'results': []}
+    for size_name in args.sizes:
+        for strokes in args.strokes:
+            for noise in args.noise:
+                for mode in args.modes:
+                    case = benchmark_case(size_name, strokes, noise, args.repeats, motion_type=args.motion_type,
+                                          mode=mode)
+                    results['results'].append(case)
+                    slowest = max(case['stages'], key=lambda stage: case['stages'][stage]['median'])
+                    print(f"{case['case']:>35}: {case['total_median'] * 1000:9.2f} ms total, "
+                          f"{case['counts']['paths']} paths, {case['counts']['points']} points, "
+                          f"{case['counts']['program_lines']} program lines, "
+                          f"slowest stage {slowest}")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    failed = False
+    if args.max_centerline_ratio > 0:
+        for case, outline, centerline in slow_centerlines(results, args.max_centerline_ratio):
+            print(f"SLOW CENTERLINE {case}: {centerline * 1000:.2f} ms, "
+                  f"{centerline / outline:.1f}x the outline run ({outline * 1000:.2f} ms)")
+            failed = True
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for case, stage, old, new in regressions:
+            print(f"REGRESSION {case} {stage}: {old * 1000:.2f} ms -> {new * 1000:.2f} ms")
+        if regressions:
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
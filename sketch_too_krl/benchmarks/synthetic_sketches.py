@@ -0,0 +1,63 @@
+import cv2
+import numpy as np
+
+# Named sketch sizes (width, height), from the sample canvas up to 8K scans
+SKETCH_SIZES = {
+    'canvas': (400, 300),
+    'hd': (1920, 1080),
+    '4k': (3840, 2160),
+    '8k': (7680, 4320),
+}
+
+
+def generate_sketch(width, height, strokes=20, noise=0.0, seed=0):
+    """
+    Procedurally draw a BGR sketch with random lines, circles, rectangles and polylines.
+    noise is the fraction of pixels (0-1) disturbed by sensor noise and specks.
+    """
+    rng = np.random.default_rng(seed)
+    # Drawn in grayscale (scans are black on white) and converted to BGR at the end
+    img = np.full((height, width), 255, dtype=np.uint8)
+
+    # Pen width and shape size scale with the image so large scans look like scanned sketches
+    scale = min(width, height)
+    thickness = max(2, scale // 150)
+
+    for _ in range(strokes):
+        shape = rng.integers(4)
+        x, y = int(rng.integers(width)), int(rng.integers(height))
+        size = int(rng.integers(scale // 20, scale // 4))
+
+        if shape == 0:
+            x2, y2 = int(rng.integers(width)), int(rng.integers(height))
+            cv2.line(img, (x, y), (x2, y2), 0, thickness)
+        elif shape == 1:
+            cv2.circle(img, (x, y), size, 0, thickness)
+        elif shape == 2:
+            cv2.rectangle(img, (x, y), (x + size, y + size // 2), 0, thickness)
+        else:
+            # Freehand-like stroke: a random walk drawn as an open polyline
+            steps = rng.normal(0, size / 6, size=(12, 2)).cumsum(axis=0)
+            points = (steps + (x, y)).astype(np.int32)
+            cv2.polylines(img, [points], False, 0, thickness)
+
+    if noise > 0:
+        # Gaussian sensor noise plus dark specks, as seen on scanned paper
+        noisy = rng.standard_normal((height, width), dtype=np.float32)
+        noisy *= 255 * noise
+        noisy += img
+        img = np.clip(noisy, 0, 255).astype(np.uint8)
+        specks = rng.random((height, width), dtype=np.float32) < noise / 10
+        img[specks] = 0
+
+    return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+
+def encode_sketch(img, ext='.png'):
+    """
+    Encode a sketch to image file bytes, as it would arrive from an upload or a scanner
+    """
+    ok, buffer = cv2.imencode(ext, img)
+    if not ok:
+        raise ValueError("Could not encode sketch")
+    return buffer.tobytes()
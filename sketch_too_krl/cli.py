@@ -0,0 +1,157 @@
+import argparse
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from utils.batch_runner import BatchConverter, find_sketches, summarize
+from utils.calibration import WorkspaceCalibration
+from utils.krl_generator import DEFAULT_TOLERANCE
+from utils.krl_modules import DEFAULT_CHUNK_SIZE
+from utils.krl_validator import WORKSPACE_BOUNDS
+
+
+def run_batch(args):
+    sketches = find_sketches(args.input_dir)
+    if not sketches:
+        print(f"No PNG or JPG sketches found in {args.input_dir}")
+        return 1
+
+    output_dir = args.output or os.path.join(args.input_dir, 'krl_output')
+    calibration = WorkspaceCalibration.load(args.calibration) if args.calibration else None
+    converter = BatchConverter(output_dir,
+                               workers=args.workers,
+                               motion_type=args.motion_type,
+                               interpretation=args.interpretation,
+                               start_position=args.start_position,
+                               keep_previews=args.keep_previews,
+                               reduce_factor=args.reduce,
+                               tile_size=args.tile_size,
+                               simplify_tolerance=args.simplify_tolerance,
+                               tolerance=args.tolerance,
+                               optimize_order=args.order,
+                               merge_tolerance=args.merge_tolerance,
+                               centerline=args.centerline,
+                               calibration=calibration,
+                               validate=args.validate,
+                               bounds=(tuple(args.bounds[:3]), tuple(args.bounds[3:])),
+                               max_reach=args.max_reach,
+                               chunk_size=args.chunk_size if args.modules else None)
+
+    print(f"Converting {len(sketches)} sketch(es) with {converter.workers} worker(s) -> {output_dir}")
+
+    results = []
+    start = time.perf_counter()
+    for result in converter.run(sketches):
+        results.append(result)
+        name = os.path.basename(result['input'])
+        if result['error'] is None:
+            travel = ''
+            if result['travel']:
+                travel = f", travel {result['travel']['before']:.0f} -> {result['travel']['after']:.0f} mm"
+            print(f"  {name}: {result['paths']} path(s) in {result['seconds'] * 1000:.1f} ms{travel}")
+            validation = result['validation']
+            if validation:
+                print(f"    {validation['errors']} error(s), {validation['warnings']} warning(s)")
+                shown = validation['issues'] if args.verbose else [
+                    issue for issue in validation['issues'] if issue['severity'] == 'error'][:5]
+                for issue in shown:
+                    print(f"    {issue['file']}:{issue['line']}: {issue['severity']}: {issue['message']}")
+        else:
+            print(f"  {name}: FAILED after {result['seconds'] * 1000:.1f} ms ({result['error']})")
+    summary = summarize(results, time.perf_counter() - start)
+
+    print(f"Converted {summary['converted']}/{summary['files']} file(s) "
+          f"in {summary['elapsed_seconds']:.2f} s "
+          f"({summary['files_per_second']:.1f} files/s, "
+          f"{summary['mean_seconds_per_file'] * 1000:.1f} ms/file mean)")
+    if args.validate:
+        print(f"{summary['invalid']} program(s) failed validation")
+
+    return 0 if summary['failed'] == 0 and summary['invalid'] == 0 else 1
+
+
+def run_calibrate(args):
+    marks = [mark[:2] for mark in args.mark], [mark[2:] for mark in args.mark]
+    try:
+        calibration = WorkspaceCalibration.from_reference_marks(*marks, z=args.z, orientation=args.orientation)
+    except ValueError as e:
+        print(f"Calibration failed: {e}")
+        return 1
+
+    calibration.save(args.output)
+    residuals = calibration.residuals(*marks)
+    print(f"Saved calibration from {len(args.mark)} mark(s) to {args.output}")
+    for (px, py, rx, ry), residual in zip(args.mark, residuals):
+        print(f"  ({px:g}, {py:g}) px -> ({rx:g}, {ry:g}) mm: residual {residual:.2f} mm")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='sketch-to-krl',
+                                     description='Sketch-to-KRL Code Generator command line interface')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    batch = subparsers.add_parser('batch', help='Convert a directory of sketches to .src files')
+    batch.add_argument('input_dir', help='Directory containing PNG/JPG sketches')
+    batch.add_argument('-o', '--output', help='Output directory (default: <input_dir>/krl_output)')
+    batch.add_argument('-j', '--workers', type=int, default=None,
+                       help='Number of worker processes (default: CPU count)')
+    batch.add_argument('--motion-type', default='PTP', choices=['PTP', 'LIN', 'CIRC', 'SPLINE', 'AUTO'],
+                       help='Motion type used for every detected path (AUTO fits lines and arcs)')
+    batch.add_argument('--interpretation', default='coordinates', choices=['coordinates', 'direct', 'trajectory'],
+                       help='"trajectory" emits every point of each path instead of its start')
+    batch.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                       help='Maximum deviation in mm of trajectory motions from the sketch')
+    batch.add_argument('--simplify-tolerance', type=float, default=None,
+                       help='Simplify contours to within this many pixels instead of 2%% of their perimeter')
+    batch.add_argument('--start-position', default='HOME', choices=['HOME', 'Anywhere'])
+    batch.add_argument('--keep-previews', action='store_true',
+                       help='Keep the processed contour previews next to the .src files')
+    batch.add_argument('--reduce', type=int, default=1, choices=[1, 2, 4, 8],
+                       help='Decode large scans at 1/N resolution')
+    batch.add_argument('--tile-size', type=int, default=None,
+                       help='Binarize large scans in tiles of this many pixels')
+    batch.add_argument('--centerline', action='store_true',
+                       help='Trace the middle of pen strokes instead of their outlines')
+    batch.add_argument('--merge-tolerance', type=float, default=None,
+                       help='Join broken strokes whose ends are within this many pixels')
+    batch.add_argument('--order', action='store_true',
+                       help='Reorder paths to reduce robot travel between them')
+    batch.add_argument('--calibration', default=None,
+                       help='Workspace calibration file (see the calibrate command) mapping pixels to mm')
+    batch.add_argument('--modules', action='store_true',
+                       help='Write .src/.dat module pairs with point tables, split into subprograms')
+    batch.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                       help='Positions per subprogram with --modules (default: %(default)s)')
+    batch.add_argument('--validate', action='store_true',
+                       help='Check every written program for KRL syntax, workspace and point spacing errors')
+    batch.add_argument('--bounds', nargs=6, type=float,
+                       default=[*WORKSPACE_BOUNDS[0], *WORKSPACE_BOUNDS[1]],
+                       metavar=('XMIN', 'YMIN', 'ZMIN', 'XMAX', 'YMAX', 'ZMAX'),
+                       help='Workspace (mm) --validate expects every target in (default: 0 0 0 1000 1000 1000)')
+    batch.add_argument('--max-reach', type=float, default=None,
+                       help='Reach (mm) from the robot base --validate expects every target in')
+    batch.add_argument('-v', '--verbose', action='store_true', help='Print every validation issue')
+    batch.set_defaults(func=run_batch)
+
+    calibrate = subparsers.add_parser('calibrate',
+                                      help='Fit a pixel -> robot base calibration from reference marks')
+    calibrate.add_argument('--mark', nargs=4, type=float, action='append', required=True,
+                           metavar=('PX', 'PY', 'X', 'Y'),
+                           help='A reference mark at pixel (PX, PY) measured at robot (X, Y) mm; at least four')
+    calibrate.add_argument('--z', type=float, default=300.0, help='Height (mm) of the drawing plane')
+    calibrate.add_argument('--orientation', nargs=3, type=float, default=(0.0, 0.0, 0.0),
+                           metavar=('A', 'B', 'C'), help='Tool orientation in degrees')
+    calibrate.add_argument('-o', '--output', default='calibration.json', help='Calibration file to write')
+    calibrate.set_defaults(func=run_calibrate)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+import io
+import json
+import os
+import sys
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.archive_export import archive_stems, stream_archive
+
+
+def read_archive(chunks):
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+    names = archive.namelist()
+    return names, json.loads(archive.read('summary.json'))['sketches']
+
+
+def sketch_png():
+    img = np.ones((300, 400, 3), dtype=np.uint8) * 255
+    for k in range(8):
+        cv2.circle(img, (40 + 45 * k, 80 + 20 * (k % 3)), 15, (0, 0, 0), 2)
+    return cv2.imencode('.png', img)[1].tobytes()
+
+
+def export(filenames, **form):
+    from app import app
+    data = dict(form, files=[(io.BytesIO(sketch_png()), filename) for filename in filenames])
+    response = app.test_client().post('/export', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    return read_archive([response.data])
+
+
+def test_archive_stems_are_final_names():
+    assert archive_stems(['a.png', 'a.jpg', 'a_2.png']) == ['a', 'a_3', 'a_2']
+    long_names = ['averyveryverylongname_one.png', 'averyveryverylongname_two.png']
+    assert archive_stems(long_names) == ['averyveryverylongname_one', 'averyveryverylongname_two']
+    stems = archive_stems(long_names, modules=True)
+    assert stems[0] != stems[1]
+
+
+def test_stream_archive_never_writes_an_entry_twice():
+    def convert(name, image_bytes):
+        return [('same.src', image_bytes)], {}
+
+    sources = [(f"sketch{k}.png", lambda k=k: str(k).encode()) for k in range(3)]
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        names, summary = read_archive(stream_archive(sources, convert, executor))
+    assert names == ['same.src', 'summary.json']
+    assert sum(sketch['error'] is None for sketch in summary) == 1
+    assert all('already in the archive' in sketch['error'] for sketch in summary if sketch['error'])
+
+
+def test_export_same_sketch_twice_as_split_modules():
+    names, summary = export(['a.png', 'a.png'], modules='1', chunk_size='5')
+    assert len(names) == len(set(names))
+    assert {'a.src', 'a.dat', 'a__1.src', 'a_2.src', 'a_2.dat', 'a_2__1.src'} <= set(names)
+    assert all(sketch['error'] is None for sketch in summary)
+
+
+def test_export_names_cut_to_the_same_module():
+    names, summary = export(['averyveryverylongname_one.png', 'averyveryverylongname_two.png'],
+                            modules='1', previews='1')
+    programs = [name for name in names if name.endswith('.src')]
+    assert len(programs) == 2 and len(names) == len(set(names))
+    assert all(sketch['error'] is None for sketch in summary)
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.krl_validator import KRLValidator
+from utils.pipeline import SketchPipeline
+
+
+def sketch_bytes(draw):
+    img = np.ones((300, 400, 3), dtype=np.uint8) * 255
+    draw(img)
+    return cv2.imencode('.png', img)[1].tobytes()
+
+
+def motions(image_bytes, motion_type, interpretation='coordinates'):
+    pipeline = SketchPipeline()
+    _, paths, _ = pipeline.process_bytes(image_bytes)
+    code = pipeline.generate('HOME', [motion_type] * len(paths), interpretation, 'no', paths)
+    errors = [issue for issue in KRLValidator().validate(code) if issue['severity'] == 'error']
+    assert not errors, errors
+    return [line.split()[0] for line in code.splitlines() if line.strip().startswith(('LIN', 'CIRC', 'SPL'))]
+
+
+def test_drawn_circle_becomes_circ_motions():
+    moves = motions(sketch_bytes(lambda img: cv2.circle(img, (300, 150), 30, (0, 0, 0), 2)), 'AUTO')
+    assert moves.count('CIRC') >= 2
+    assert moves.count('CIRC') > moves.count('LIN')
+
+
+def test_rectangle_stays_straight():
+    image_bytes = sketch_bytes(lambda img: cv2.rectangle(img, (250, 200), (350, 250), (0, 0, 0), 2))
+    assert 'CIRC' not in motions(image_bytes, 'AUTO')
+    assert 'CIRC' not in motions(image_bytes, 'CIRC', 'trajectory')
+
+
+def test_direct_interpretation_uses_default_coordinates():
+    image_bytes = sketch_bytes(lambda img: cv2.circle(img, (300, 150), 30, (0, 0, 0), 2))
+    assert motions(image_bytes, 'AUTO', 'direct') == ['LIN']
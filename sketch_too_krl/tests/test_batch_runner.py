@@ -0,0 +1,45 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.batch_runner import BatchConverter, output_names
+
+
+def write_sketches(directory, *filenames):
+    img = np.ones((200, 300, 3), dtype=np.uint8) * 255
+    cv2.rectangle(img, (40, 40), (200, 150), (0, 0, 0), 3)
+    paths = []
+    for filename in filenames:
+        path = os.path.join(directory, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        cv2.imwrite(path, img)
+        paths.append(path)
+    return paths
+
+
+def convert(output_dir, paths, **options):
+    results = list(BatchConverter(str(output_dir), workers=1, **options).run(paths))
+    assert all(result['error'] is None for result in results), results
+    return sorted(os.path.relpath(path, output_dir) for result in results for path in result['files'])
+
+
+def test_output_names_keep_directories_and_number_duplicates(tmp_path):
+    paths = [str(tmp_path / name) for name in ('a/sketch.png', 'b/sketch.png', 'a/sketch.jpg', 'a/sketch_2.png')]
+    assert output_names(paths) == [os.path.join('a', 'sketch'), os.path.join('b', 'sketch'),
+                                   os.path.join('a', 'sketch_3'), os.path.join('a', 'sketch_2')]
+
+
+def test_same_stem_with_different_extensions(tmp_path):
+    paths = write_sketches(tmp_path, 'sketch.png', 'sketch.jpg')
+    assert convert(tmp_path / 'out', paths) == ['sketch.src', 'sketch_2.src']
+
+
+def test_module_names_cut_to_the_same_length(tmp_path):
+    paths = write_sketches(tmp_path, 'averyveryverylongname_one.png', 'averyveryverylongname_two.png')
+    files = convert(tmp_path / 'out', paths, chunk_size=1000)
+    assert len(files) == 4
+    assert files[0] != files[2]
+    assert all(len(os.path.splitext(name)[0]) <= 19 for name in files)
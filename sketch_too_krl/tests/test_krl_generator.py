@@ -0,0 +1,69 @@
+import os
+import re
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.calibration import WorkspaceCalibration
+from utils.krl_format import PositionFormat
+from utils.krl_generator import KRLGenerator
+from utils.path_data import SketchPath, SketchPaths
+
+MOTION_TYPES = ['PTP', 'LIN', 'CIRC', 'SPLINE', 'AUTO']
+
+
+def square_paths():
+    return SketchPaths([SketchPath(i, np.array([[10, 10], [90, 10], [90, 60], [10, 60]]) + 5 * i, closed=True)
+                        for i in range(len(MOTION_TYPES))], image_size=(200, 100))
+
+
+def positions(program):
+    return [line for line in program.splitlines() if '{X' in line and 'home_position' not in line]
+
+
+@pytest.mark.parametrize('paths', [square_paths(), []])
+def test_default_positions_follow_the_position_format(paths):
+    position_format = PositionFormat(orientation=(180, 0, 90), status=2, turn=10, precision=2)
+    program = KRLGenerator(position_format=position_format).generate_program(
+        'HOME', MOTION_TYPES, 'direct', 'no', paths)
+    lines = positions(program)
+    assert lines
+    for line in lines:
+        assert 'A 180, B 0, C 90, S 2, T 10' in line
+        assert all(re.fullmatch(r'-?\d+\.\d\d', value) for value in re.findall(r'[XYZ] ([^,]+)', line)), line
+
+
+def test_default_positions_keep_their_comments():
+    program = KRLGenerator().generate_program('HOME', MOTION_TYPES, 'direct', 'no', [])
+    assert "  CIRC {X 450, Y 750, Z 1050, A 0, B 0, C 0, S 6, T 27}, " \
+           "{X 600, Y 900, Z 1200, A 0, B 0, C 0, S 6, T 27} C_VEL ; Sample points 3\n" in program
+    assert "    SPL {X 600, Y 1000, Z 1400, A 0, B 0, C 0, S 6, T 27} ; Sample point 4b\n" in program
+
+
+def test_changed_settings_are_not_served_from_the_block_cache():
+    angles = np.linspace(0, 2 * np.pi, 60, endpoint=False)
+    paths = SketchPaths([SketchPath(i, np.rint(np.column_stack((100 + 40 * np.cos(angles) + i,
+                                                                  50 + 30 * np.sin(angles)))), closed=True)
+                         for i in range(len(MOTION_TYPES))], image_size=(200, 100))
+    generator = KRLGenerator()
+
+    def build():
+        return generator.build_program('HOME', MOTION_TYPES, 'trajectory', 'no', paths)
+
+    previous = build()
+    assert build().diff(previous) == []
+    for change in (lambda: setattr(generator, 'tolerance', 5.0),
+                   lambda: setattr(generator, 'decimation', 'visvalingam'),
+                   lambda: setattr(generator, 'position_format', PositionFormat(precision=1)),
+                   lambda: setattr(generator, 'calibration',
+                                   WorkspaceCalibration.from_canvas((200, 100), 0, 500, z=20))):
+        change()
+        program = build()
+        assert program.text() == KRLGenerator(generator.tolerance, generator.decimation,
+                                              calibration=generator.calibration,
+                                              position_format=generator.position_format).build_program(
+            'HOME', MOTION_TYPES, 'trajectory', 'no', paths).text()
+        assert program.diff(previous)
+        previous = program
@@ -0,0 +1,92 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.krl_generator import KRLGenerator
+from utils.krl_modules import (MAX_MODULE_NAME_LENGTH, module_name, split_program, subprogram_name,
+                               unique_names)
+from utils.krl_validator import MAX_NAME_LENGTH, KRLValidator
+from utils.path_data import SketchPath, SketchPaths
+
+
+def zigzag_paths(count=3, points=40):
+    paths = SketchPaths(image_size=(400, 300))
+    for i in range(count):
+        x = np.arange(points) * 8 + 10
+        y = 50 + 80 * i + (np.arange(points) % 2) * 20
+        paths.append(SketchPath(i, np.column_stack((x, y)), closed=False))
+    return paths
+
+
+def modules(name, chunk_size, paths=None):
+    generator = KRLGenerator(tolerance=0)
+    program = generator.build_program('HOME', ['LIN'] * 3, 'trajectory', 'no', paths or zigzag_paths())
+    return split_program(program, name, chunk_size)
+
+
+def test_module_name_is_a_short_krl_identifier():
+    assert module_name('sketch 1.final') == 'sketch_1_final'
+    assert module_name('2024_scan') == 'p_2024_scan'
+    assert module_name('') == 'sketch_program'
+    assert module_name('___') == 'sketch_program'
+    name = module_name('averyveryverylongname_one')
+    assert len(name) <= MAX_MODULE_NAME_LENGTH
+    assert len(subprogram_name(name, 999)) <= MAX_NAME_LENGTH
+
+
+def test_module_names_never_look_like_subprograms():
+    assert module_name('a__1') == 'a_1'
+    assert module_name('abcdefghijklmnopqr__x') == 'abcdefghijklmnopqr'
+    assert module_name('a__1') != subprogram_name('a', 1)
+
+
+def test_unique_names_number_duplicates_past_existing_names():
+    assert unique_names(['a', 'A', 'a_2', 'b']) == ['a', 'A_3', 'a_2', 'b']
+    assert unique_names([os.path.join('x', 'a'), os.path.join('y', 'a'), os.path.join('x', 'a')]) == [
+        os.path.join('x', 'a'), os.path.join('y', 'a'), os.path.join('x', 'a_2')]
+
+
+def test_unique_names_catch_names_cut_to_the_same_module():
+    names = [module_name('averyveryverylongname_one'), module_name('averyveryverylongname_two')]
+    assert names[0] == names[1]
+    unique = unique_names(names, MAX_MODULE_NAME_LENGTH)
+    assert unique[0] != unique[1]
+    assert all(len(name) <= MAX_MODULE_NAME_LENGTH and name == module_name(name) for name in unique)
+
+
+def test_small_program_is_one_module_with_a_point_table():
+    files = modules('drawing', chunk_size=1000)
+    assert list(files) == ['drawing.src', 'drawing.dat']
+    assert files['drawing.src'].startswith('DEF drawing()\n')
+    assert 'FOR I = 1 TO' in files['drawing.src']
+    assert 'DECL E6POS PTS[' in files['drawing.dat']
+
+
+def test_large_program_is_split_into_subprograms():
+    files = modules('drawing', chunk_size=30)
+    parts = sorted(name for name in files if name.startswith('drawing__') and name.endswith('.src'))
+    assert len(parts) >= 4
+    assert list(files)[:2] == ['drawing.src', 'drawing.dat']
+    for k, part in enumerate(sorted(parts, key=lambda name: int(name[9:-4])), 1):
+        assert files[part].startswith(f'DEF drawing__{k}()\n')
+        assert f'  drawing__{k}()\n' in files['drawing.src']
+        assert files[part].count('{X ') <= 30 + 1
+    validator = KRLValidator()
+    for name, text in files.items():
+        if name.endswith('.src'):
+            assert not [issue for issue in validator.validate(text) if issue['severity'] == 'error'], name
+
+
+def test_split_files_of_different_sketches_never_clash():
+    names = unique_names([module_name(stem) for stem in ('a', 'a', 'a_2', 'a__1')], MAX_MODULE_NAME_LENGTH)
+    files = [name.lower() for stem in names for name in modules(stem, chunk_size=30)]
+    assert len(files) == len(set(files))
+
+
+def test_too_many_subprograms_are_refused():
+    paths = zigzag_paths(count=1, points=1100)
+    with pytest.raises(ValueError, match='larger chunk size'):
+        modules('drawing', chunk_size=1, paths=paths)
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.krl_validator import ERROR, KRLValidator, summarize_issues
+
+POSITION = "{X %s, Y %s, Z %s, A 0, B 0, C 0, S 6, T 27}"
+
+PROGRAM = f"""DEF demo()
+  DECL E6POS home_position = {{X 0, Y 0, Z 0, A 0, B 0, C 0, S 6, T 27}}
+  INI
+  PTP home_position
+  LIN {POSITION % (100, 200, 300)} C_VEL
+  CIRC {POSITION % (150, 250, 300)}, {POSITION % (200, 200, 300)} C_VEL
+  SPLINE
+    SPL {POSITION % (250, 250, 300)}
+    SLIN {POSITION % (300, 300, 300)}
+  ENDSPLINE
+  PTP home_position
+END
+"""
+
+
+def issues(text, severity=ERROR, **options):
+    found = KRLValidator(**options).validate(text, name='demo')
+    return [(issue['line'], issue['message']) for issue in found if issue['severity'] == severity]
+
+
+def test_valid_program_has_no_issues():
+    assert KRLValidator(max_reach=1200).validate(PROGRAM, name='demo') == []
+
+
+@pytest.mark.parametrize('old, new, line, message', [
+    ('END\n', '', 11, 'missing END'),
+    ('DEF demo()\n', '', 1, 'no DEF line'),
+    ('  ENDSPLINE\n', '', 7, 'never closed'),
+    ('LIN {X 100,', 'LIN {X 100,,', 5, 'expected a component name'),
+    ('} C_VEL\n  CIRC', '} C_PTP\n  CIRC', 5, "invalid approximation 'C_PTP'"),
+    ('X 100, Y 200', 'X 1500, Y 200', 5, 'outside the workspace'),
+    ('X 200, Y 200, Z 300', 'X 200, Y 300, Z 300', 6, 'lie on one line'),
+    ('X 150, Y 250', 'X 100, Y 200', 6, 'auxiliary point coincides'),
+    ('demo()', 'averyveryveryverylongprogramname()', 1, 'longer than 24 characters'),
+])
+def test_invalid_programs_are_reported(old, new, line, message):
+    found = issues(PROGRAM.replace(old, new, 1))
+    assert any(number == line and message in text for number, text in found), found
+
+
+def test_reach_is_checked_from_the_robot_base():
+    far = PROGRAM.replace('X 100, Y 200', 'X 900, Y 900')
+    assert issues(far) == []
+    assert any('reach' in message for _, message in issues(far, max_reach=1200))
+
+
+def test_dat_declarations_are_known_to_the_program():
+    src = PROGRAM.replace('  DECL E6POS home_position = {X 0, Y 0, Z 0, A 0, B 0, C 0, S 6, T 27}\n', '')
+    assert issues(src, severity='warning')
+    dat = "DEFDAT demo\nDECL E6POS home_position={X 0, Y 0, Z 0, A 0, B 0, C 0, S 6, T 27}\nENDDAT\n"
+    assert KRLValidator().validate(src, name='demo', dat=dat) == []
+
+
+def test_summarize_issues_counts_errors_and_warnings():
+    found = KRLValidator().validate(PROGRAM.replace('demo()', 'other()').replace('END\n', ''), name='demo')
+    assert summarize_issues(found) == {'errors': 1, 'warnings': 1}
@@ -0,0 +1,68 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.path_data import SketchPath, SketchPaths
+from utils.path_ordering import order_paths, travel_distance
+
+
+def random_paths(seed, count=40, size=(800, 600)):
+    rng = np.random.default_rng(seed)
+    paths = SketchPaths(image_size=size)
+    for i in range(count):
+        start = rng.uniform((0, 0), size)
+        steps = rng.normal(0, 15, size=(int(rng.integers(2, 12)), 2))
+        points = np.clip(np.rint(start + np.cumsum(steps, axis=0)), 0, (size[0] - 1, size[1] - 1))
+        paths.append(SketchPath(i, points.astype(np.int32), closed=bool(rng.random() < 0.3)))
+    return paths
+
+
+def point_set(path):
+    return sorted(map(tuple, path.points.tolist()))
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('improve', [False, True])
+def test_ordering_never_increases_travel(seed, improve):
+    paths = random_paths(seed)
+    ordered, report = order_paths(paths, improve=improve)
+    assert report['before'] == pytest.approx(travel_distance(paths))
+    assert report['after'] == pytest.approx(travel_distance(ordered))
+    assert report['after'] <= report['before'] + 1e-9
+
+
+def test_ordering_keeps_every_path():
+    paths = random_paths(7)
+    paths.append(SketchPath(len(paths), np.empty((0, 2), dtype=np.int32), closed=False))
+    ordered, _ = order_paths(paths)
+    assert len(ordered) == len(paths)
+    assert not len(ordered[-1].points)
+    by_id = {path.id: path for path in paths}
+    for path in ordered:
+        original = by_id[path.id]
+        assert path.closed == original.closed
+        assert point_set(path) == point_set(original)
+        if not path.closed and len(path.points):
+            assert (np.array_equal(path.points, original.points)
+                    or np.array_equal(path.points, original.points[::-1]))
+
+
+def test_far_path_comes_last():
+    paths = SketchPaths([SketchPath(0, np.array([[700, 500], [720, 500]]), False),
+                         SketchPath(1, np.array([[10, 10], [30, 10]]), False),
+                         SketchPath(2, np.array([[60, 10], [40, 10]]), False)], image_size=(800, 600))
+    ordered, report = order_paths(paths)
+    assert [path.id for path in ordered] == [1, 2, 0]
+    assert ordered[1].points[0].tolist() == [40, 10]
+    assert report['after'] < report['before']
+
+
+def test_ordered_input_is_kept_when_nothing_shorter_is_found():
+    for seed in range(20):
+        ordered, _ = order_paths(random_paths(seed, count=8))
+        again, report = order_paths(ordered, improve=False)
+        assert report['after'] <= report['before'] + 1e-9
+        assert report['after'] == pytest.approx(travel_distance(again))
@@ -0,0 +1,55 @@
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import session_store
+from utils.session_store import create_session_store
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(session_store, 'time', types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    return create_session_store(request.param, path=str(tmp_path / 'sessions.db'), ttl=60)
+
+
+def test_values_round_trip(store, clock):
+    key = store.new_key()
+    assert store.get(key) is None
+    store.set(key, {'paths': [[1, 2], [3, 4]], 'name': 'sketch'})
+    assert store.get(key) == {'paths': [[1, 2], [3, 4]], 'name': 'sketch'}
+    store.delete(key)
+    assert store.get(key) is None
+
+
+def test_reads_keep_sessions_alive(store, clock):
+    read, unread = store.new_key(), store.new_key()
+    store.set(read, {'n': 1})
+    store.set(unread, {'n': 2})
+    for _ in range(3):
+        clock[0] += 40
+        assert store.get(read) == {'n': 1}
+    assert store.get(unread) is None
+
+
+def test_expired_sessions_are_dropped_on_write(store, clock):
+    old, new = store.new_key(), store.new_key()
+    store.set(old, {'n': 1})
+    clock[0] += 61
+    store.set(new, {'n': 2})
+    clock[0] -= 61
+    assert store.get(old) is None
+    assert store.get(new) == {'n': 2}
+
+
+def test_unknown_store_kind():
+    with pytest.raises(ValueError):
+        create_session_store('redis')
@@ -0,0 +1,113 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.skeleton import thin, trace_skeleton
+
+
+def reference_thin(binary):
+    """
+    Textbook Zhang-Suen thinning over the whole image, sub-iteration by sub-iteration
+    """
+    image = np.pad((binary > 0).astype(np.uint8), 1)
+    while True:
+        changed = False
+        for step in (0, 1):
+            p = [np.roll(image, shift, axis=(0, 1)) for shift in
+                 [(1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1)]]
+            count = sum(p)
+            transitions = sum((p[k] == 0) & (p[(k + 1) % 8] == 1) for k in range(8))
+            if step == 0:
+                keep = (p[0] * p[2] * p[4] == 0) & (p[2] * p[4] * p[6] == 0)
+            else:
+                keep = (p[0] * p[2] * p[6] == 0) & (p[0] * p[4] * p[6] == 0)
+            remove = (image == 1) & (count >= 2) & (count <= 6) & (transitions == 1) & keep
+            if remove.any():
+                image[remove] = 0
+                changed = True
+        if not changed:
+            return image[1:-1, 1:-1] * 255
+
+
+@pytest.fixture
+def without_contrib(monkeypatch):
+    monkeypatch.delattr(cv2, 'ximgproc', raising=False)
+
+
+def drawing(seed):
+    rng = np.random.default_rng(seed)
+    img = np.zeros((120, 160), np.uint8)
+    for _ in range(4):
+        cv2.line(img, tuple(rng.integers(0, 160, 2).tolist()), tuple(rng.integers(0, 120, 2).tolist()),
+                 255, int(rng.integers(1, 9)))
+    cv2.circle(img, tuple(rng.integers(20, 100, 2).tolist()), int(rng.integers(5, 40)), 255,
+               int(rng.integers(1, 6)))
+    if seed % 2:
+        img[rng.random(img.shape) < 0.05] = 255
+    return img
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_thin_matches_zhang_suen(seed, without_contrib):
+    img = drawing(seed)
+    assert np.array_equal(thin(img), reference_thin(img))
+
+
+def test_thin_leaves_one_pixel_wide_lines(without_contrib):
+    img = np.zeros((60, 200), np.uint8)
+    cv2.line(img, (20, 30), (180, 30), 255, 11)
+    skeleton = thin(img) > 0
+    assert not (skeleton[:-1, :-1] & skeleton[1:, :-1] & skeleton[:-1, 1:] & skeleton[1:, 1:]).any()
+    ys, xs = np.nonzero(skeleton)
+    assert set(ys.tolist()) <= {29, 30, 31}
+    assert xs.min() < 30 and xs.max() > 170
+
+
+def skeleton_of(draw, size=(200, 200)):
+    img = np.zeros(size, np.uint8)
+    draw(img)
+    return thin(img)
+
+
+def test_line_traces_end_to_end(without_contrib):
+    traced = trace_skeleton(skeleton_of(lambda img: cv2.line(img, (20, 100), (180, 100), 255, 5)))
+    assert len(traced) == 1
+    points, closed = traced[0]
+    assert not closed and points.dtype == np.int32
+    assert sorted((points[0, 0], points[-1, 0])) == [pytest.approx(20, abs=4), pytest.approx(180, abs=4)]
+    assert np.all(np.abs(np.diff(points, axis=0)) <= 1)
+
+
+def test_ring_traces_as_closed_path(without_contrib):
+    traced = trace_skeleton(skeleton_of(lambda img: cv2.circle(img, (100, 100), 50, 255, 5)))
+    assert len(traced) == 1
+    points, closed = traced[0]
+    assert closed
+    assert np.allclose(np.hypot(*(points - 100).T), 50, atol=2)
+
+
+def test_crossing_rejoins_straight_strokes(without_contrib):
+    def cross(img):
+        cv2.line(img, (20, 20), (180, 180), 255, 5)
+        cv2.line(img, (20, 180), (180, 20), 255, 5)
+
+    traced = trace_skeleton(skeleton_of(cross))
+    assert len(traced) == 2
+    for points, closed in traced:
+        assert not closed
+        start, end = sorted(map(tuple, points[[0, -1]].tolist()))
+        assert np.hypot(*np.subtract(end, start)) > 200
+
+
+def test_short_spurs_are_pruned(without_contrib):
+    def spurred(img):
+        cv2.line(img, (20, 100), (180, 100), 255, 3)
+        cv2.line(img, (100, 100), (100, 95), 255, 1)
+
+    traced = trace_skeleton(skeleton_of(spurred))
+    assert len(traced) == 1
+    assert not traced[0][1]
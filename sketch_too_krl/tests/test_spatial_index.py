@@ -0,0 +1,78 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.path_data import SketchPath, SketchPaths
+from utils.spatial_index import PathIndex, PointGrid
+
+
+def clustered_points(seed, count=400):
+    rng = np.random.default_rng(seed)
+    centres = rng.uniform(0, 1000, size=(5, 2))
+    return centres[rng.integers(0, 5, count)] + rng.normal(0, 30, size=(count, 2))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_nearest_matches_brute_force(seed):
+    points = clustered_points(seed)
+    grid = PointGrid(points)
+    rng = np.random.default_rng(100 + seed)
+    inactive = rng.choice(len(points), 50, replace=False)
+    grid.deactivate(inactive)
+    active = np.ones(len(points), dtype=bool)
+    active[inactive] = False
+    for query in rng.uniform(-200, 1200, size=(50, 2)):
+        distances = np.where(active, np.hypot(*(points - query).T), np.inf)
+        found = grid.nearest(query, k=5)
+        assert len(found) == 5
+        assert np.allclose(distances[found], np.sort(distances)[:5])
+
+
+def test_nearest_honours_accept():
+    points = clustered_points(9)
+    grid = PointGrid(points)
+    even = grid.nearest((500, 500), k=3, accept=lambda candidates: candidates % 2 == 0)
+    distances = np.hypot(*(points - (500, 500)).T)
+    distances[1::2] = np.inf
+    assert all(index % 2 == 0 for index in even)
+    assert np.allclose(distances[even], np.sort(distances)[:3])
+
+
+@pytest.mark.parametrize('radius', [0, 5, 40, 300])
+def test_within_matches_brute_force(radius):
+    points = np.rint(clustered_points(3))
+    grid = PointGrid(points)
+    grid.deactivate(np.arange(0, len(points), 7))
+    active = np.ones(len(points), dtype=bool)
+    active[::7] = False
+    for query in list(points[:20]) + [(-50, -50), (2000, 2000)]:
+        expected = np.flatnonzero(active & (np.hypot(*(points - query).T) <= radius))
+        assert sorted(grid.within(query, radius).tolist()) == expected.tolist()
+
+
+def test_empty_grid():
+    grid = PointGrid(np.empty((0, 2)))
+    assert len(grid) == 0
+    assert grid.nearest((0, 0)) == []
+    assert len(grid.within((0, 0), 10)) == 0
+
+
+def test_path_index_selects_and_merges():
+    paths = SketchPaths([SketchPath(0, np.array([[0, 0], [50, 0]]), False),
+                         SketchPath(1, np.array([[52, 0], [100, 40]]), False),
+                         SketchPath(2, np.array([[300, 300], [350, 300], [350, 350]]), True)],
+                        image_size=(400, 400))
+    index = PathIndex(paths)
+    assert index.select((280, 280, 400, 400)) == [2]
+    assert index.select((0, 0, 60, 10), contained=True) == [0]
+    assert index.path_at((25, 2)) == 0
+    assert index.path_at((200, 200)) is None
+    assert index.nearest_endpoint((50.5, 0), k=2) == [(0, 1), (1, 0)]
+
+    merged = index.merge_gaps(3)
+    assert len(merged) == 2
+    assert merged[0].points.tolist() == [[0, 0], [50, 0], [52, 0], [100, 40]]
+    assert merged[1] is paths[2]
@@ -0,0 +1,49 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.strokes import stroke_points, strokes_to_paths
+
+
+def line(x, t=None):
+    return [[x, 10 + 5 * k] + ([] if t is None else [t + k]) for k in range(5)]
+
+
+def starts(paths):
+    return [int(path.points[0, 0]) for path in paths]
+
+
+def test_timed_strokes_are_ordered_by_their_first_timestamp():
+    paths = strokes_to_paths([line(10, 300), line(20, 100), line(30, 200)], (100, 100))
+    assert starts(paths) == [20, 30, 10]
+    assert [path.id for path in paths] == [0, 1, 2]
+
+
+def test_untimed_strokes_keep_their_place():
+    strokes = [line(10, 300), line(20), line(30, 100), {'points': line(40)}, line(50, 200)]
+    assert starts(strokes_to_paths(strokes, (100, 100))) == [30, 20, 50, 40, 10]
+    assert starts(strokes_to_paths([line(x) for x in (40, 10, 30)], (100, 100))) == [40, 10, 30]
+
+
+def test_closed_and_open_strokes():
+    square = [[10, 10], [60, 10], [60, 60], [10, 60], [11, 11]]
+    paths = strokes_to_paths([square, line(80)], (100, 100))
+    assert [path.closed for path in paths] == [True, False]
+    assert paths[0].points.tolist() == [[10, 10], [60, 10], [60, 60], [10, 60]]
+
+
+def test_points_are_clamped_and_taps_dropped():
+    paths = strokes_to_paths([[[-20, 5], [150, 5.4]], [[7, 7], [7.2, 6.9]], []], (100, 50))
+    assert len(paths) == 1
+    assert paths[0].points.tolist() == [[0, 5], [99, 5]]
+
+
+def test_stroke_points_rejects_bad_input():
+    assert np.isnan(stroke_points([[1, 2], [3, 4]])[:, 2]).all()
+    with pytest.raises(ValueError):
+        stroke_points([[1, 2, 3, 4]])
+    with pytest.raises(ValueError):
+        stroke_points([[1, float('nan')]])
@@ -0,0 +1,111 @@
+import json
+import os
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from utils.krl_modules import MAX_MODULE_NAME_LENGTH, module_name, unique_names
+
+# Sketches loaded or converting at once while an archive is streamed
+DEFAULT_MAX_PENDING = 8
+
+
+class _ZipSink:
+    """
+    Write-only file object collecting what ZipFile writes until the stream takes it.
+    It cannot seek, so ZipFile writes each entry's sizes after its data.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def archive_stems(filenames, modules=False):
+    """
+    Distinct names the programs of the sketches are written under: the file names without
+    extension, or with modules the module names they get (see module_name), numbered
+    where an earlier sketch has the same final name. Subprogram files derive from the
+    module name and cannot clash with another sketch's files.
+    """
+    stems = [os.path.splitext(os.path.basename(filename))[0] or 'sketch' for filename in filenames]
+    if modules:
+        return unique_names([module_name(stem) for stem in stems], MAX_MODULE_NAME_LENGTH)
+    return unique_names(stems)
+
+
+def stream_archive(sources, convert, executor, max_pending=DEFAULT_MAX_PENDING, compression=zipfile.ZIP_DEFLATED):
+    """
+    Convert sketches in parallel and stream a ZIP archive of the results as they finish.
+
+    sources yields (name, load) pairs where load() returns the image bytes; it is called
+    only when the sketch is submitted, and at most max_pending sketches are loaded or
+    converting at a time, so memory stays bounded however many sketches there are.
+    convert(name, image_bytes) runs on the executor and returns a list of (archive name,
+    bytes) entries and a dict of details for the summary. A sketch with an entry already
+    in the archive (names compared ignoring case) is left out and reported as failed.
+    Yields chunks of the archive, ending with a summary.json listing the entries, details
+    and errors per sketch.
+    """
+    sink = _ZipSink()
+    summary = []
+    written = {}
+    sources = iter(sources)
+    pending = {}
+
+    def submit_next():
+        for name, load in sources:
+            try:
+                future = executor.submit(_convert_timed, convert, name, load())
+            except Exception as e:
+                summary.append({'sketch': name, 'files': [], 'error': str(e), 'seconds': 0.0})
+                continue
+            pending[future] = name
+            return True
+        return False
+
+    with zipfile.ZipFile(sink, 'w', compression=compression) as archive:
+        while len(pending) < max_pending and submit_next():
+            pass
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                entries, info = future.result()
+                clash = next((arcname for arcname, _ in entries if arcname.lower() in written), None)
+                if clash is not None:
+                    entries = []
+                    info['error'] = f"{clash} is already in the archive for {written[clash.lower()]}"
+                written.update((arcname.lower(), name) for arcname, _ in entries)
+                for arcname, data in entries:
+                    archive.writestr(arcname, data)
+                    # Hand each entry to the client before converting further
+                    yield sink.take()
+                summary.append(dict(info, sketch=name, files=[arcname for arcname, _ in entries]))
+                submit_next()
+        archive.writestr('summary.json', json.dumps({'sketches': summary}, indent=2))
+    yield sink.take()
+
+
+def _convert_timed(convert, name, image_bytes):
+    start = time.perf_counter()
+    info = {'error': None}
+    try:
+        entries, details = convert(name, image_bytes)
+        info.update(details)
+    except Exception as e:
+        entries = []
+        info['error'] = str(e)
+    info['seconds'] = time.perf_counter() - start
+    return entries, info
@@ -0,0 +1,197 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils.krl_generator import DEFAULT_TOLERANCE
+from utils.krl_modules import MAX_MODULE_NAME_LENGTH, module_name, unique_names
+from utils.krl_validator import WORKSPACE_BOUNDS, KRLValidator, summarize_issues
+from utils.pipeline import SketchPipeline
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+
+# Per-worker pipeline, created once by the pool initializer
+_worker_pipeline = None
+
+
+def _init_worker(preview_dir, pipeline_options):
+    global _worker_pipeline
+    _worker_pipeline = SketchPipeline(output_dir=preview_dir, **pipeline_options)
+
+
+def _result(image_path):
+    return {
+        'input': image_path,
+        'output': None,
+        'files': [],
+        'paths': 0,
+        'seconds': 0.0,
+        'travel': None,
+        'validation': None,
+        'error': None,
+    }
+
+
+def _convert_one(image_path, name, output_dir, options):
+    """
+    Convert a single sketch to a .src file inside a worker process; name is the output
+    path without extension relative to output_dir (see output_names)
+    """
+    start = time.perf_counter()
+    result = _result(image_path)
+
+    try:
+        _, paths = _worker_pipeline.process_file(image_path)
+        motion_types = [options['motion_type']] * max(len(paths), 1)
+
+        output_dir = os.path.join(output_dir, os.path.dirname(name))
+        os.makedirs(output_dir, exist_ok=True)
+        name = os.path.basename(name)
+        if options['chunk_size']:
+            written = _worker_pipeline.write_modules(output_dir, name,
+                                                    options['start_position'],
+                                                    motion_types,
+                                                    options['interpretation'],
+                                                    'no',
+                                                    paths,
+                                                    chunk_size=options['chunk_size'])
+        else:
+            written = [os.path.join(output_dir, name + '.src')]
+            with open(written[0], 'w') as f:
+                _worker_pipeline.write_program(f,
+                                               options['start_position'],
+                                               motion_types,
+                                               options['interpretation'],
+                                               'no',
+                                               paths)
+
+        result['output'] = written[0]
+        result['files'] = written
+        result['paths'] = len(paths)
+        result['travel'] = getattr(paths, 'travel', None)
+        if options['validate'] is not None:
+            validator = KRLValidator(**options['validate'])
+            issues = []
+            for path in written:
+                if path.endswith('.src'):
+                    for issue in validator.validate_file(path):
+                        issue['file'] = os.path.basename(path)
+                        issues.append(issue)
+            result['validation'] = dict(summarize_issues(issues), issues=issues)
+    except Exception as e:
+        result['error'] = str(e)
+
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def find_sketches(input_dir):
+    """
+    List the sketch images in a directory, sorted by name
+    """
+    sketches = []
+    for entry in sorted(os.listdir(input_dir)):
+        path = os.path.join(input_dir, entry)
+        if os.path.isfile(path) and '.' in entry and entry.rsplit('.', 1)[1].lower() in IMAGE_EXTENSIONS:
+            sketches.append(path)
+    return sketches
+
+
+def output_names(image_paths, modules=False):
+    """
+    Output path of each sketch without extension, relative to the output directory: its
+    path below the deepest directory holding all of them, so sketches of the same name in
+    different directories do not overwrite each other. With modules the file name is the
+    module name the program gets (see module_name). Sketches that would still share a name
+    (e.g. sketch.png and sketch.jpg) are numbered, see unique_names.
+    """
+    if not image_paths:
+        return []
+    image_paths = [os.path.abspath(path) for path in image_paths]
+    root = os.path.commonpath([os.path.dirname(path) for path in image_paths])
+    names = [os.path.relpath(os.path.splitext(path)[0], root) for path in image_paths]
+    if modules:
+        names = [os.path.join(os.path.dirname(name), module_name(os.path.basename(name))) for name in names]
+        return unique_names(names, MAX_MODULE_NAME_LENGTH)
+    return unique_names(names)
+
+
+class BatchConverter:
+    def __init__(self, output_dir, workers=None, motion_type='PTP',
+                 interpretation='coordinates', start_position='HOME', keep_previews=False,
+                 reduce_factor=1, tile_size=None, simplify_tolerance=None, tolerance=DEFAULT_TOLERANCE,
+                 optimize_order=False, merge_tolerance=None, centerline=False, calibration=None,
+                 validate=False, bounds=WORKSPACE_BOUNDS, max_reach=None, chunk_size=None):
+        self.output_dir = output_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.keep_previews = keep_previews
+        self.options = {
+            'motion_type': motion_type,
+            'interpretation': interpretation,
+            'start_position': start_position,
+            # Write .src/.dat modules split every chunk_size positions instead of one .src
+            'chunk_size': chunk_size,
+            # Options of the KRLValidator checking each written program, if requested
+            'validate': {'bounds': bounds, 'max_reach': max_reach} if validate else None,
+        }
+        self.pipeline_options = {
+            'reduce_factor': reduce_factor,
+            'tile_size': tile_size,
+            'simplify_tolerance': simplify_tolerance,
+            'tolerance': tolerance,
+            'optimize_order': optimize_order,
+            'merge_tolerance': merge_tolerance,
+            'centerline': centerline,
+            'calibration': calibration,
+        }
+
+    def run(self, image_paths):
+        """
+        Convert every sketch in image_paths, yielding one result dict per file as it completes.
+        Each sketch gets its own output name (see output_names); one that still wrote a file
+        another one wrote is reported as failed.
+        """
+        image_paths = list(image_paths)
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        # Previews are only kept on request; otherwise they go to a scratch folder
+        preview_dir = os.path.join(self.output_dir, 'previews' if self.keep_previews else '.previews')
+        os.makedirs(preview_dir, exist_ok=True)
+
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 initializer=_init_worker,
+                                 initargs=(preview_dir, self.pipeline_options)) as executor:
+            names = output_names(image_paths, modules=bool(self.options['chunk_size']))
+            futures = [executor.submit(_convert_one, path, name, self.output_dir, self.options)
+                       for path, name in zip(image_paths, names)]
+            written = {}
+            for future in as_completed(futures):
+                result = future.result()
+                for file in result['files']:
+                    key = os.path.normcase(file).lower()
+                    if key in written and result['error'] is None:
+                        result['error'] = f"{file} was also written for {written[key]}"
+                    written.setdefault(key, result['input'])
+                yield result
+
+        if not self.keep_previews:
+            for entry in os.listdir(preview_dir):
+                os.remove(os.path.join(preview_dir, entry))
+            os.rmdir(preview_dir)
+
+
+def summarize(results, elapsed):
+    """
+    Build a throughput summary from the per-file results of a batch run
+    """
+    converted = [r for r in results if r['error'] is None]
+    invalid = [r for r in converted if r['validation'] and r['validation']['errors']]
+    total = len(results)
+    return {
+        'files': total,
+        'converted': len(converted),
+        'failed': total - len(converted),
+        'invalid': len(invalid),
+        'elapsed_seconds': elapsed,
+        'files_per_second': total / elapsed if elapsed > 0 else 0.0,
+        'mean_seconds_per_file': sum(r['seconds'] for r in results) / total if total else 0.0,
+    }
@@ -0,0 +1,101 @@
+import json
+import os
+
+import cv2
+import numpy as np
+
+
+class WorkspaceCalibration:
+    def __init__(self, homography, z=0.0, orientation=(0.0, 0.0, 0.0), decimals=2):
+        """
+        Pixel -> robot base frame transform: a 3x3 homography onto the drawing plane at
+        height z (mm) with a fixed tool orientation (A, B, C in degrees). Built once and
+        applied to whole (N, 2) point arrays.
+        """
+        self.homography = np.asarray(homography, dtype=np.float64).reshape(3, 3)
+        self.z = float(z)
+        self.orientation = tuple(float(angle) for angle in orientation)
+        self.decimals = decimals
+
+    @classmethod
+    def from_canvas(cls, canvas_size, out_min, out_max, z=0.0, orientation=(0.0, 0.0, 0.0)):
+        """
+        Scale a canvas of (width, height) pixels onto the square [out_min, out_max] mm range
+        """
+        span = out_max - out_min
+        homography = [
+            [span / canvas_size[0], 0.0, out_min],
+            [0.0, span / canvas_size[1], out_min],
+            [0.0, 0.0, 1.0],
+        ]
+        return cls(homography, z=z, orientation=orientation)
+
+    @classmethod
+    def from_reference_marks(cls, pixel_points, robot_points, z=0.0, orientation=(0.0, 0.0, 0.0)):
+        """
+        Fit the homography mapping at least four reference marks found in the image
+        (pixels) onto their measured X/Y positions in the robot base frame (mm)
+        """
+        pixel_points = np.asarray(pixel_points, dtype=np.float64).reshape(-1, 2)
+        robot_points = np.asarray(robot_points, dtype=np.float64).reshape(-1, 2)
+        if len(pixel_points) < 4 or len(pixel_points) != len(robot_points):
+            raise ValueError("At least four matching pixel and robot reference points are needed")
+        homography, _ = cv2.findHomography(pixel_points, robot_points, 0)
+        if homography is None or abs(np.linalg.det(homography)) < 1e-12:
+            raise ValueError("Reference points are degenerate (three or more on one line?)")
+        calibration = cls(homography, z=z, orientation=orientation)
+        if not np.all(np.isfinite(calibration.apply(pixel_points))):
+            raise ValueError("Reference points are degenerate (three or more on one line?)")
+        return calibration
+
+    def apply(self, points):
+        """
+        Map an (N, 2) pixel array to an (N, 3) X/Y/Z array in mm
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        mapped = points @ self.homography[:, :2].T + self.homography[:, 2]
+        coords = np.empty((len(points), 3), dtype=np.float64)
+        coords[:, :2] = mapped[:, :2] / mapped[:, 2:]
+        coords[:, 2] = self.z
+        return np.round(coords, self.decimals)
+
+    def pixel_size(self, pixel):
+        """
+        Size (mm) of one pixel at the given pixel position, the larger of its two sides
+        """
+        x, y = pixel
+        corners = self.apply([(x, y), (x + 1, y), (x, y + 1)])[:, :2]
+        return float(np.hypot(*(corners[1:] - corners[0]).T).max())
+
+    def residuals(self, pixel_points, robot_points):
+        """
+        Distance (mm) between the mapped reference marks and their measured positions
+        """
+        mapped = self.apply(pixel_points)[:, :2]
+        return np.hypot(*(mapped - np.asarray(robot_points, dtype=np.float64).reshape(-1, 2)).T)
+
+    def to_dict(self):
+        return {
+            'homography': self.homography.tolist(),
+            'z': self.z,
+            'orientation': list(self.orientation),
+            'decimals': self.decimals,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['homography'], z=data.get('z', 0.0),
+                   orientation=data.get('orientation', (0.0, 0.0, 0.0)),
+                   decimals=data.get('decimals', 2))
+
+    def save(self, path):
+        # Write next to the target and rename, so readers never see a partial file
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
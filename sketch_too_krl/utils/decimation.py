@@ -0,0 +1,99 @@
+import numpy as np
+
+DECIMATION_METHODS = ('rdp', 'visvalingam')
+
+
+def _segment_distance(points, start, end):
+    """
+    Distance of every point to the segment start -> end (rows are matched up)
+    """
+    direction = end - start
+    length_sq = np.einsum('ij,ij->i', direction, direction)
+    offset = points - start
+    # Degenerate segments (closed loops) fall back to the distance to the start point
+    t = np.divide(np.einsum('ij,ij->i', offset, direction), length_sq,
+                  out=np.zeros(len(points)), where=length_sq > 0)
+    nearest = start + np.clip(t, 0.0, 1.0)[:, None] * direction
+    return np.linalg.norm(points - nearest, axis=1)
+
+
+def rdp(points, tolerance, kept=None):
+    """
+    Ramer-Douglas-Peucker keeping every point farther than tolerance from the simplified
+    polyline, starting from the kept indices (default: the end points). All open segments
+    are split in the same pass, so the loop runs once per recursion level instead of once
+    per segment.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    n = len(points)
+    if n < 3:
+        return np.arange(n)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    if kept is not None:
+        keep[kept] = True
+    index = np.arange(n)
+    while True:
+        kept = np.flatnonzero(keep)
+        segment = np.minimum(np.searchsorted(kept, index, side='right') - 1, len(kept) - 2)
+        distance = _segment_distance(points, points[kept[segment]], points[kept[segment + 1]])
+        distance[keep] = 0.0
+
+        # Farthest point of every segment, split wherever it exceeds the tolerance
+        segment_max = np.maximum.reduceat(distance, kept[:-1])
+        split = segment_max > tolerance
+        if not split.any():
+            return kept
+        candidates = np.flatnonzero(split[segment] & (distance == segment_max[segment]))
+        _, first = np.unique(segment[candidates], return_index=True)
+        keep[candidates[first]] = True
+
+
+def visvalingam(points, tolerance):
+    """
+    Visvalingam-Whyatt removing points whose triangle with their neighbours is flatter than
+    tolerance (measured as the height over the neighbour chord). Non-adjacent minima are
+    removed in batches so the loop runs far fewer times than there are points.
+    Each removal is only checked against the current neighbours, so removed points can
+    drift further than tolerance from the result. Points are then added back the way
+    rdp splits segments, until every original point is within tolerance again.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    kept = np.arange(len(points))
+    while len(kept) > 2:
+        prev, cur, nxt = points[kept[:-2]], points[kept[1:-1]], points[kept[2:]]
+        chord = nxt - prev
+        cross = np.abs(chord[:, 0] * (cur[:, 1] - prev[:, 1]) - chord[:, 1] * (cur[:, 0] - prev[:, 0]))
+        chord_length = np.linalg.norm(chord, axis=1)
+        height = np.divide(cross, chord_length, out=np.linalg.norm(cur - prev, axis=1),
+                           where=chord_length > 0)
+
+        # Remove local minima below the tolerance; neighbours wait for the next pass
+        padded = np.concatenate(([np.inf], height, [np.inf]))
+        remove = (height <= tolerance) & (height < padded[:-2]) & (height <= padded[2:])
+        if not remove.any():
+            break
+        kept = np.concatenate((kept[:1], kept[1:-1][~remove], kept[-1:]))
+    return rdp(points, tolerance, kept)
+
+
+def decimate(points, tolerance, method='rdp', closed=False):
+    """
+    Drop points of an (N, D) polyline while keeping every original point within tolerance
+    (in the units of the points, measured in the first two dimensions) of the result. Both
+    methods keep points where the path bends and thin out straight stretches. Closed paths
+    are decimated as a loop and returned without the repeated first point.
+    """
+    if method not in DECIMATION_METHODS:
+        raise ValueError(f"method must be one of {DECIMATION_METHODS}, got {method!r}")
+    points = np.asarray(points)
+    if len(points) < 3 or tolerance <= 0:
+        return points
+
+    simplify = rdp if method == 'rdp' else visvalingam
+    if closed:
+        kept = simplify(np.concatenate((points, points[:1]))[:, :2], tolerance)[:-1]
+    else:
+        kept = simplify(points[:, :2], tolerance)
+    return points[kept]
@@ -1,100 +1,370 @@
 import cv2
 import numpy as np
 import os
+from utils.path_data import SketchPath, SketchPaths, paths_to_coordinates
+from utils.decimation import decimate
+from utils.path_ordering import order_paths
+from utils.skeleton import thin, trace_skeleton
+from utils.spatial_index import PathIndex
+from utils.strokes import STROKE_TOLERANCE, strokes_to_paths
+from utils.metrics import PipelineMetrics
+
+# Decode flags for reduced-resolution decoding (the JPEG decoder scales while decoding)
+REDUCED_DECODE_FLAGS = {
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+# Previews of large sketches are drawn at most this many pixels wide/high
+PREVIEW_MAX_SIDE = 2048
+# (width, height) of the synthetic sketch warm_up runs through the pipeline
+WARM_UP_SIZE = (400, 300)
 
 class SketchProcessor:
-    def __init__(self):
-        pass
+    def __init__(self, output_dir='uploads', cache=None, threshold=127, blur_kernel=5,
+                 morph_kernel=3, epsilon_factor=0.02, metrics_registry=None, profile=False,
+                 reduce_factor=1, tile_size=None, simplify_tolerance=None, optimize_order=False,
+                 merge_tolerance=None, centerline=False):
+        # Directory process_sketch writes the processed preview images to
+        # (process_sketch_bytes keeps them in memory)
+        self.output_dir = output_dir
+        # Optional ResultCache shared between requests
+        self.cache = cache
+        # Optional MetricsRegistry aggregating the stage metrics of every run
+        self.metrics_registry = metrics_registry
+        # Capture a cProfile report for every run (expensive, for diagnosing slow sketches)
+        self.profile = profile
+        
+        # Pipeline parameters (also part of the cache key)
+        self.threshold = threshold
+        self.blur_kernel = blur_kernel
+        self.morph_kernel = morph_kernel
+        self.epsilon_factor = epsilon_factor
+        # Simplify contours to within this many (full-resolution) pixels of the traced
+        # outline instead of the perimeter-proportional epsilon_factor
+        self.simplify_tolerance = simplify_tolerance
+        # Trace stroke centerlines (open paths) instead of the outlines around strokes
+        self.centerline = centerline
+        # Join open paths whose ends are within merge_tolerance pixels into single strokes
+        self.merge_tolerance = merge_tolerance
+        # Reorder the paths (and their start points) to reduce travel between them
+        self.optimize_order = optimize_order
+        
+        # Large scans: decode at 1/reduce_factor resolution (1, 2, 4 or 8) and/or
+        # run blur/threshold/morphology tile by tile on tile_size x tile_size blocks
+        if reduce_factor != 1 and reduce_factor not in REDUCED_DECODE_FLAGS:
+            raise ValueError(f"reduce_factor must be 1, 2, 4 or 8, not {reduce_factor}")
+        self.reduce_factor = reduce_factor
+        self.tile_size = tile_size
     
-    def process_sketch(self, filepath):
+    def pipeline_params(self):
+        """
+        Parameters that influence the extracted paths and preview
+        """
+        return {
+            'threshold': self.threshold,
+            'blur_kernel': self.blur_kernel,
+            'morph_kernel': self.morph_kernel,
+            'epsilon_factor': self.epsilon_factor,
+            'simplify_tolerance': self.simplify_tolerance,
+            'centerline': self.centerline,
+            'merge_tolerance': self.merge_tolerance,
+            'optimize_order': self.optimize_order,
+            'reduce_factor': self.reduce_factor,
+            'tile_size': self.tile_size,
+        }
+    
+    def process_sketch(self, filepath, metrics=None):
         """
         Process a sketch image to extract paths and generate intermediate representation
         """
-        # Read the image
-        img = cv2.imread(filepath)
+        return self._run(self._process_file, metrics, filepath)
+    
+    def process_sketch_bytes(self, image_bytes, filename, metrics=None):
+        """
+        Process an in-memory sketch (e.g. straight from an upload) without touching the disk.
+        Returns the preview filename, the paths and the encoded preview image.
+        """
+        return self._run(self._process_bytes, metrics, image_bytes, filename)
+    
+    def _run(self, func, metrics, *args):
+        # Stage timings and counts are collected even when the caller does not ask for them,
+        # so the metrics registry sees every processed sketch
+        if metrics is None:
+            metrics = PipelineMetrics(profile=self.profile)
+        
+        metrics.start_profile()
+        try:
+            return func(*args, metrics)
+        finally:
+            metrics.stop_profile()
+            if self.metrics_registry is not None:
+                self.metrics_registry.record(metrics)
+    
+    def profile_sketch(self, filepath, profile=False):
+        """
+        Process a sketch and also return its PipelineMetrics (optionally with a cProfile report)
+        """
+        metrics = PipelineMetrics(profile=profile)
+        processed_filename, paths = self.process_sketch(filepath, metrics)
+        return processed_filename, paths, metrics
+    
+    def warm_up(self, metrics=None):
+        """
+        Run a small synthetic sketch through every configured stage once, so one-off
+        initialization (image codecs, OpenCV's thread pool, NumPy kernels) happens at
+        startup instead of in the first request. The run is neither cached nor recorded
+        in the metrics registry; call it before requests are served.
+        """
+        if metrics is None:
+            metrics = PipelineMetrics()
+        width, height = WARM_UP_SIZE
+        image = np.full((height, width, 3), 255, dtype=np.uint8)
+        cv2.line(image, (width // 8, height // 8), (width // 2, height // 3), (0, 0, 0), 3)
+        cv2.circle(image, (2 * width // 3, 2 * height // 3), height // 6, (0, 0, 0), 3)
+        with metrics.stage('encode'):
+            ok, encoded = cv2.imencode('.png', image)
+        if not ok:
+            raise ValueError("Could not encode the warm-up sketch")
+        
+        cache, self.cache = self.cache, None
+        try:
+            _, paths, _ = self._process_bytes(encoded.tobytes(), 'warm_up.png', metrics)
+        finally:
+            self.cache = cache
+        return paths
+    
+    def _process_file(self, filepath, metrics):
+        # Read the raw image bytes (used both for decoding and as cache key)
+        with metrics.stage('read'):
+            with open(filepath, 'rb') as f:
+                image_bytes = f.read()
+        
+        processed_filename, paths, preview_bytes = self._process_bytes(image_bytes,
+                                                                       os.path.basename(filepath),
+                                                                       metrics)
+        
+        # Save processed image (a cached result only needs it restored if it was removed)
+        processed_filepath = os.path.join(self.output_dir, processed_filename)
+        if not metrics.counts.get('cache_hit') or not os.path.exists(processed_filepath):
+            with metrics.stage('write_preview'):
+                with open(processed_filepath, 'wb') as f:
+                    f.write(preview_bytes)
+        
+        return processed_filename, paths
+    
+    def _process_bytes(self, image_bytes, filename, metrics):
+        metrics.count('input_bytes', len(image_bytes))
+        processed_filename = "processed_" + filename
+        
+        cache_key = None
+        if self.cache is not None:
+            with metrics.stage('cache_lookup'):
+                cache_key = self.cache.make_key(image_bytes, self.pipeline_params())
+                cached = self.cache.get(cache_key)
+            metrics.count('cache_hit', int(cached is not None))
+            if cached is not None:
+                return processed_filename, cached['paths'], cached['preview']
+        
+        # Decode the image
+        large_mode = self.reduce_factor != 1 or self.tile_size
+        with metrics.stage('decode'):
+            buffer = np.frombuffer(image_bytes, np.uint8)
+            if large_mode:
+                # Large-sketch modes decode straight to (reduced) grayscale
+                flag = REDUCED_DECODE_FLAGS.get(self.reduce_factor, cv2.IMREAD_GRAYSCALE)
+                img = cv2.imdecode(buffer, flag)
+            else:
+                img = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
         
         if img is None:
             raise ValueError("Could not read image file")
+        height, width = img.shape[:2]
+        metrics.count('pixels', height * width)
         
         # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        if large_mode:
+            gray = img
+        else:
+            with metrics.stage('grayscale'):
+                gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         
-        # Apply Gaussian blur to reduce noise
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+        # Blur, threshold and clean up into a binary image
+        if self.tile_size:
+            cleaned = self._binarize_tiled(gray, metrics)
+        else:
+            cleaned = self._binarize(gray, metrics)
         
-        # Apply threshold to get binary image
-        _, binary = cv2.threshold(blurred, 127, 255, cv2.THRESH_BINARY_INV)
+        if self.centerline:
+            # Trace the middle of each stroke instead of the outline around it
+            with metrics.stage('skeletonize'):
+                skeleton = thin(cleaned)
+            with metrics.stage('trace'):
+                polylines = trace_skeleton(skeleton)
+            contours = [points.reshape(-1, 1, 2) for points, _ in polylines]
+            closed = [is_closed for _, is_closed in polylines]
+        else:
+            # Find contours
+            with metrics.stage('find_contours'):
+                contours, _ = cv2.findContours(cleaned, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            closed = None
+        metrics.count('contours', len(contours))
+        metrics.count('contour_points', sum(len(contour) for contour in contours))
+        
+        # Draw contours on a black background
+        with metrics.stage('preview'):
+            preview_scale = min(1.0, PREVIEW_MAX_SIDE / max(height, width))
+            if preview_scale < 1.0:
+                preview_contours = [(contour * preview_scale).astype(np.int32) for contour in contours]
+                preview_shape = (int(height * preview_scale), int(width * preview_scale), 3)
+            else:
+                preview_contours = contours
+                preview_shape = (height, width, 3)
+            contour_img = np.zeros(preview_shape, dtype=np.uint8)
+            if closed is None:
+                cv2.drawContours(contour_img, preview_contours, -1, (0, 255, 0), 2)
+            else:
+                for contour, is_closed in zip(preview_contours, closed):
+                    cv2.polylines(contour_img, [contour], is_closed, (0, 255, 0), 2)
+            
+            # Encode the processed image in memory
+            ok, preview = cv2.imencode(os.path.splitext(processed_filename)[1] or '.png', contour_img)
+            if not ok:
+                raise ValueError("Could not encode processed image")
+            preview_bytes = preview.tobytes()
         
-        # Apply morphological operations to clean up the image
-        kernel = np.ones((3, 3), np.uint8)
-        cleaned = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
+        # Extract path information
+        with metrics.stage('simplify'):
+            # Points are scaled back to full-resolution pixels
+            paths = self.extract_paths(contours, scale=self.reduce_factor,
+                                       image_size=(width * self.reduce_factor, height * self.reduce_factor),
+                                       closed=closed)
+        metrics.count('paths', len(paths))
+        metrics.count('path_points', sum(path.length for path in paths))
         
-        # Find contours
-        contours, _ = cv2.findContours(cleaned, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        paths = self._arrange_paths(paths, metrics)
         
-        # Draw contours on a black background
-        contour_img = np.zeros_like(img)
-        cv2.drawContours(contour_img, contours, -1, (0, 255, 0), 2)
+        if cache_key is not None:
+            self.cache.put(cache_key, {'paths': paths, 'preview': preview_bytes})
         
-        # Save processed image
-        processed_filename = "processed_" + os.path.basename(filepath)
-        processed_filepath = os.path.join('uploads', processed_filename)
-        cv2.imwrite(processed_filepath, contour_img)
+        return processed_filename, paths, preview_bytes
+    
+    def _arrange_paths(self, paths, metrics):
+        # Optional gap merging and travel ordering, shared by images and drawn strokes
+        if self.merge_tolerance:
+            with metrics.stage('merge_paths'):
+                paths = self.index_paths(paths).merge_gaps(self.merge_tolerance)
+            metrics.count('merged_paths', len(paths))
         
-        # Extract path information
-        paths = self.extract_paths(contours)
+        if self.optimize_order:
+            with metrics.stage('order_paths'):
+                paths, travel = order_paths(paths)
+            metrics.count('travel_before_mm', travel['before'])
+            metrics.count('travel_after_mm', travel['after'])
         
-        return processed_filename, paths
+        return paths
+    
+    def process_strokes(self, strokes, canvas_size, metrics=None):
+        """
+        Build paths straight from strokes drawn on a canvas of canvas_size (width, height),
+        each a list of [x, y] or [x, y, t] points, skipping decoding, thresholding and
+        contour finding. Strokes become open paths in drawing order.
+        """
+        return self._run(self._process_strokes, metrics, strokes, canvas_size)
+    
+    def _process_strokes(self, strokes, canvas_size, metrics):
+        metrics.count('strokes', len(strokes))
+        with metrics.stage('strokes'):
+            tolerance = STROKE_TOLERANCE if self.simplify_tolerance is None else self.simplify_tolerance
+            paths = strokes_to_paths(strokes, canvas_size, tolerance)
+        metrics.count('paths', len(paths))
+        metrics.count('path_points', sum(path.length for path in paths))
+        
+        return self._arrange_paths(paths, metrics)
+    
+    def _binarize(self, gray, metrics):
+        # Apply Gaussian blur to reduce noise (blur_kernel=0 skips it)
+        blurred = gray
+        if self.blur_kernel:
+            with metrics.stage('blur'):
+                blurred = cv2.GaussianBlur(gray, (self.blur_kernel, self.blur_kernel), 0)
+        
+        # Apply threshold to get binary image
+        with metrics.stage('threshold'):
+            _, binary = cv2.threshold(blurred, self.threshold, 255, cv2.THRESH_BINARY_INV)
+        
+        # Apply morphological operations to clean up the image (morph_kernel=0 skips it)
+        cleaned = binary
+        if self.morph_kernel:
+            with metrics.stage('morphology'):
+                kernel = np.ones((self.morph_kernel, self.morph_kernel), np.uint8)
+                cleaned = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
+        
+        return cleaned
     
-    def extract_paths(self, contours):
+    def _binarize_tiled(self, gray, metrics):
         """
-        Extract path information from contours
+        Binarize tile by tile into one full-size mask. Each tile is processed with a halo of
+        neighbouring pixels so blur and morphology match the untiled result at the seams, and
+        contours are found on the stitched mask so strokes crossing tile borders stay whole.
         """
-        paths = []
+        height, width = gray.shape
+        halo = self.blur_kernel // 2 + self.morph_kernel
+        cleaned = np.empty_like(gray)
+        
+        for y in range(0, height, self.tile_size):
+            for x in range(0, width, self.tile_size):
+                y0, x0 = max(0, y - halo), max(0, x - halo)
+                y1 = min(height, y + self.tile_size + halo)
+                x1 = min(width, x + self.tile_size + halo)
+                
+                tile = self._binarize(gray[y0:y1, x0:x1], metrics)
+                
+                # Keep only the tile interior, the halo belongs to the neighbours
+                h = min(self.tile_size, height - y)
+                w = min(self.tile_size, width - x)
+                cleaned[y:y + h, x:x + w] = tile[y - y0:y - y0 + h, x - x0:x - x0 + w]
+        
+        metrics.count('tiles', -(-height // self.tile_size) * -(-width // self.tile_size))
+        return cleaned
+    
+    def extract_paths(self, contours, scale=1, image_size=None, closed=None):
+        """
+        Extract path information from contours (closed outlines unless closed holds a flag
+        per contour, as for traced centerlines)
+        """
+        paths = SketchPaths(image_size=image_size)
         
         for i, contour in enumerate(contours):
-            # Simplify contour using Ramer-Douglas-Peucker algorithm
-            epsilon = 0.02 * cv2.arcLength(contour, True)
-            simplified = cv2.approxPolyDP(contour, epsilon, True)
-            
-            # Extract points
-            points = []
-            for point in simplified:
-                points.append({
-                    'x': int(point[0][0]),
-                    'y': int(point[0][1])
-                })
-            
-            paths.append({
-                'id': i,
-                'points': points,
-                'length': len(points)
-            })
+            is_closed = True if closed is None else closed[i]
+            dense = contour.reshape(-1, 2)
+            if self.simplify_tolerance is not None:
+                # Fixed accuracy: keeps detail on small curves that a perimeter-based epsilon drops
+                points = decimate(contour.reshape(-1, 2), self.simplify_tolerance / scale, closed=is_closed)
+            else:
+                # Simplify contour using Ramer-Douglas-Peucker algorithm
+                epsilon = self.epsilon_factor * cv2.arcLength(contour, is_closed)
+                simplified = cv2.approxPolyDP(contour, epsilon, is_closed)
+                
+                # Keep the points as a contiguous (N, 2) array
+                points = simplified.reshape(-1, 2)
+            if scale != 1:
+                points = points * scale
+                dense = dense * scale
+            paths.append(SketchPath(i, points, closed=is_closed, dense=dense if len(dense) > len(points) else None))
         
         return paths
     
-    def paths_to_coordinates(self, paths, canvas_size=(400, 300)):
+    def index_paths(self, paths):
+        """
+        Spatial index over the paths for endpoint, rectangle and point queries
+        """
+        return PathIndex(paths)
+    
+    def paths_to_coordinates(self, paths, canvas_size=None):
         """
         Convert path points to KRL coordinates
         """
-        krl_coordinates = []
-        
-        for path in paths:
-            coords = []
-            for point in path['points']:
-                # Convert canvas coordinates to KRL coordinates
-                # This is a simplified conversion - in a real application, 
-                # you would need to calibrate the coordinate system
-                x = (point['x'] / canvas_size[0]) * 1000  # Scale to mm
-                y = (point['y'] / canvas_size[1]) * 1000  # Scale to mm
-                z = 0  # Assume all points are on the same plane
-                
-                coords.append({
-                    'x': round(x, 2),
-                    'y': round(y, 2),
-                    'z': round(z, 2)
-                })
-            
-            krl_coordinates.append(coords)
-        
-        return krl_coordinates
\ No newline at end of file
+        # Same conversion as the KRL generator, so previews and programs agree
+        return paths_to_coordinates(paths, canvas_size)
\ No newline at end of file
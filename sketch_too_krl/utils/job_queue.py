@@ -0,0 +1,105 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Job:
+    __slots__ = ('id', 'status', 'result', 'error', 'submitted', 'started', 'finished', 'event')
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        # Set once the job is done or failed, used for long-polling
+        self.event = threading.Event()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JobQueue:
+    def __init__(self, workers=4, max_finished=256):
+        """
+        Background worker pool with a bounded store of finished job results.
+        The OpenCV calls release the GIL, so worker threads run in parallel.
+        """
+        self.workers = workers
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sketch-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue func(*args, **kwargs) and return the new job id immediately
+        """
+        job = Job(uuid.uuid4().hex)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job.id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id):
+        job = self.get(job_id)
+        return job.to_dict() if job is not None else None
+
+    def result(self, job_id):
+        job = self.get(job_id)
+        if job is None or job.status != DONE:
+            return None
+        return job.result
+
+    def wait(self, job_id, timeout=None):
+        """
+        Block until the job finishes or the timeout expires, then return its status
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.event.wait(timeout)
+        return job.to_dict()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job, func, args, kwargs):
+        job.status = RUNNING
+        job.started = time.time()
+        try:
+            job.result = func(*args, **kwargs)
+            job.status = DONE
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+        job.finished = time.time()
+        job.event.set()
+        self._evict_finished()
+
+    def _evict_finished(self):
+        # Drop the oldest finished jobs once the result store is full
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job.event.is_set()]
+            for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+                del self._jobs[job_id]
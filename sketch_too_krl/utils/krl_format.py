@@ -0,0 +1,70 @@
+import numpy as np
+
+# Motion lines with a {} field per position; the number of fields is how many consecutive
+# positions each line takes (CIRC: auxiliary and end point)
+MOTION_TEMPLATES = {
+    'PTP': "  PTP {}\n",
+    'LIN': "  LIN {} C_VEL\n",
+    'CIRC': "  CIRC {}, {} C_VEL\n",
+    'SPL': "    SPL {}\n",
+}
+
+# Robot configuration of every computed position (KUKA status and turn bits)
+DEFAULT_STATUS = 6
+DEFAULT_TURN = 27
+
+
+class PositionFormat:
+    def __init__(self, orientation=(0, 0, 0), status=DEFAULT_STATUS, turn=DEFAULT_TURN, precision=None):
+        """
+        How computed positions are written: the tool orientation (A, B, C in degrees), the
+        status and turn values of every E6POS, and the number of decimals of X/Y/Z. With
+        precision None coordinates are written like Python floats (100.0, 233.33).
+        Position and motion line templates are compiled once and filled with % straight
+        from the coordinate array, instead of an f-string per position and another per line.
+        """
+        self.orientation = tuple(orientation)
+        self.status = status
+        self.turn = turn
+        self.precision = precision
+        number = "%s" if precision is None else f"%.{int(precision)}f"
+        tail = "A {:g}, B {:g}, C {:g}".format(*self.orientation) + f", S {status}, T {turn}"
+        # A literal % in the tail would be read as a conversion when formatting
+        self.template = "{X %s, Y %s, Z %s, %s}" % (number, number, number, tail.replace('%', '%%'))
+        self._line_templates = {}
+
+    def _values(self, coords, fields=1):
+        """
+        Tuples of the X/Y/Z values of fields consecutive positions each, as plain Python
+        floats (their str is the float repr used with precision None)
+        """
+        values = iter(np.asarray(coords, dtype=np.float64)[:, :3].ravel().tolist())
+        return zip(*[values] * (3 * fields))
+
+    def position(self, coord):
+        if isinstance(coord, np.ndarray):
+            coord = coord.tolist()
+        return self.template % tuple(coord[:3])
+
+    def positions(self, coords):
+        """
+        One position literal per row of an (N, 3) coordinate array
+        """
+        template = self.template
+        return [template % values for values in self._values(coords)]
+
+    def lines(self, template, coords):
+        """
+        Motion lines for consecutive positions, each line taking as many positions as
+        template has {} fields (see MOTION_TEMPLATES); the number of rows must be a
+        multiple of that
+        """
+        line = self._line_templates.get(template)
+        if line is None:
+            fields = template.count("{}")
+            line = (template.replace('%', '%%').format(*[self.template] * fields), fields)
+            self._line_templates[template] = line
+        line, fields = line
+        if len(coords) % fields:
+            raise ValueError(f"{len(coords)} positions do not fill lines of {fields} positions each")
+        return [line % values for values in self._values(coords, fields)]
@@ -1,122 +1,395 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.decimation import decimate
+from utils.krl_format import MOTION_TEMPLATES, PositionFormat
+from utils.krl_modules import DEFAULT_CHUNK_SIZE, split_program
+from utils.primitive_fitting import ARC, LINE, fit_primitives, smooth_polyline
+from utils.path_data import SketchPath, canvas_calibration, canvas_size_of, paths_to_coordinates
+
+# Default accuracy (mm) of the trajectory interpretation
+DEFAULT_TOLERANCE = 0.5
+
+# Number of emitted path blocks kept for incremental regeneration
+BLOCK_CACHE_SIZE = 4096
+
+# Positions (mm) of motions emitted without sketch coordinates; the sample program scales
+# them by the motion number
+DEFAULT_POSITIONS = {
+    'PTP': [(100, 200, 300)],
+    'LIN': [(100, 200, 300)],
+    'CIRC': [(150, 250, 350), (200, 300, 400)],
+    'SPL': [(100, 200, 300), (150, 250, 350), (200, 300, 400), (250, 350, 450), (300, 400, 500)],
+}
+
+class KRLProgram:
+    def __init__(self, header, blocks, footer, paths=(), path_keys=()):
+        """
+        A generated program kept as header lines, one tuple of lines per path block and
+        footer lines, so a regenerated program can be compared block by block
+        """
+        self.header = header
+        self.blocks = blocks
+        self.footer = footer
+        self.paths = paths
+        self.path_keys = path_keys
+    
+    def lines(self):
+        yield from self.header
+        for block in self.blocks:
+            yield from block
+        yield from self.footer
+    
+    def text(self):
+        return "".join(self.lines())
+    
+    def diff(self, previous):
+        """
+        Blocks that changed since previous, as dicts with the block ('header', path index or
+        'footer'), its 1-based start line in this program and the old and new lines
+        """
+        if previous is None:
+            return [{'block': 'program', 'start_line': 1, 'old': [], 'new': list(self.lines())}]
+        
+        changes = []
+        if self.header != previous.header:
+            changes.append({'block': 'header', 'start_line': 1,
+                            'old': list(previous.header), 'new': list(self.header)})
+        
+        line = len(self.header) + 1
+        for i in range(max(len(self.blocks), len(previous.blocks))):
+            new = self.blocks[i] if i < len(self.blocks) else ()
+            old = previous.blocks[i] if i < len(previous.blocks) else ()
+            # Blocks served from the cache are the same tuple object, so most checks stop here
+            if new is not old and new != old:
+                changes.append({'block': i, 'start_line': line, 'old': list(old), 'new': list(new)})
+            line += len(new)
+        
+        if self.footer != previous.footer:
+            changes.append({'block': 'footer', 'start_line': line,
+                            'old': list(previous.footer), 'new': list(self.footer)})
+        return changes
+
 class KRLGenerator:
-    def __init__(self):
-        pass
+    def __init__(self, tolerance=DEFAULT_TOLERANCE, decimation='rdp', block_cache_size=BLOCK_CACHE_SIZE,
+                 calibration=None, position_format=None):
+        # Pixel -> robot base transform (a WorkspaceCalibration); None scales the canvas onto
+        # the default workspace. Its tool orientation is used for every computed position.
+        self.calibration = calibration
+        # How computed positions are written (orientation, status, turn, decimals); by
+        # default the calibration's orientation with S 6, T 27 and plain float coordinates
+        if position_format is None:
+            orientation = calibration.orientation if calibration is not None else (0, 0, 0)
+            position_format = PositionFormat(orientation)
+        self.position_format = position_format
+        # Trajectory interpretation: maximum deviation (mm) of the emitted path from the
+        # sketch and the decimation method ('rdp' or 'visvalingam')
+        self.tolerance = tolerance
+        self.decimation = decimation
+        # Emitted path blocks keyed on path, motion type, interpretation, canvas size and the
+        # settings above (see _settings_key), so changing a setting never serves stale blocks
+        self.block_cache_size = block_cache_size
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        self.block_hits = 0
+        self.block_misses = 0
     
-    def generate_program(self, start_position, motion_types, interpretation, clarifications, paths):
+    def generate_program(self, start_position, motion_types, interpretation, clarifications, paths, canvas_size=None):
         """
         Generate a complete KRL program based on user inputs and detected paths
         """
+        return "".join(self.iter_program(start_position, motion_types, interpretation, clarifications, paths, canvas_size))
+    
+    def write_program(self, f, start_position, motion_types, interpretation, clarifications, paths, canvas_size=None):
+        """
+        Write a KRL program straight to a file object without building it in memory
+        """
+        f.writelines(self.iter_program(start_position, motion_types, interpretation, clarifications, paths, canvas_size))
+    
+    def iter_program(self, start_position, motion_types, interpretation, clarifications, paths, canvas_size=None):
+        """
+        Lazily yield the lines of a KRL program based on user inputs and detected paths
+        """
+        yield from self._iter_header(start_position)
+        
+        # Paths are converted to coordinates lazily, one at a time, as they are emitted
+        canvas_size = canvas_size_of(paths, canvas_size)
+        
+        # Add motion commands based on detected paths
+        if paths:
+            yield "  ; Process detected paths from sketch\n"
+            for i, path in enumerate(paths):
+                yield from self._iter_path_block(i, path, self._motion_type(motion_types, i),
+                                                 interpretation, canvas_size)
+        else:
+            yield from self._iter_sample_block(motion_types)
+        
+        yield from self._iter_footer(start_position)
+    
+    def build_program(self, start_position, motion_types, interpretation, clarifications, paths,
+                      canvas_size=None, previous=None):
+        """
+        Build a KRLProgram, re-emitting only the path blocks whose motion type, interpretation,
+        coordinates or generator settings changed since they were last emitted. Passing the
+        previous program for the same paths also skips re-hashing their points.
+        """
+        canvas_size = tuple(canvas_size_of(paths, canvas_size))
+        
+        header = tuple(self._iter_header(start_position))
+        footer = tuple(self._iter_footer(start_position))
+        if not paths:
+            return KRLProgram(header, [tuple(self._iter_sample_block(motion_types))], footer)
+        
+        header += ("  ; Process detected paths from sketch\n",)
+        if previous is not None and previous.paths is paths:
+            path_keys = previous.path_keys
+        else:
+            path_keys = [self._path_key(path) for path in paths]
+        
+        settings = self._settings_key()
+        blocks = []
+        for i, path in enumerate(paths):
+            motion_type = self._motion_type(motion_types, i)
+            key = (i, path_keys[i], motion_type, interpretation, canvas_size, settings)
+            blocks.append(self._cached_block(key, i, path, motion_type, interpretation, canvas_size))
+        return KRLProgram(header, blocks, footer, paths, path_keys)
+    
+    def build_modules(self, name, start_position, motion_types, interpretation, clarifications, paths,
+                      canvas_size=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Generate the program as .src/.dat modules named after name, with the positions in
+        point tables and split into subprograms of at most chunk_size positions; returns a
+        dict of final file name -> text (see split_program for the naming)
+        """
+        program = self.build_program(start_position, motion_types, interpretation, clarifications, paths,
+                                     canvas_size)
+        return split_program(program, name, chunk_size)
+    
+    def write_modules(self, directory, name, start_position, motion_types, interpretation, clarifications,
+                      paths, canvas_size=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Write the .src/.dat modules of a program into directory; returns the paths of the
+        files written, main program first
+        """
+        written = []
+        modules = self.build_modules(name, start_position, motion_types, interpretation, clarifications,
+                                     paths, canvas_size, chunk_size)
+        for filename, text in modules.items():
+            path = os.path.join(directory, filename)
+            with open(path, 'w') as f:
+                f.write(text)
+            written.append(path)
+        return written
+    
+    def block_cache_stats(self):
+        with self._lock:
+            return {'entries': len(self._blocks), 'hits': self.block_hits, 'misses': self.block_misses}
+    
+    @staticmethod
+    def _path_key(path):
+        path = SketchPath.coerce(path)
+        digest = hashlib.blake2b(path.points.tobytes(), digest_size=16)
+        if path.dense is not None:
+            digest.update(path.dense.tobytes())
+        return path.id, digest.digest()
+    
+    def _settings_key(self):
+        """
+        The generator settings that go into every emitted block: tolerance, decimation,
+        the position format and the calibration
+        """
+        calibration = self.calibration
+        if calibration is not None:
+            calibration = (calibration.homography.tobytes(), calibration.z, calibration.orientation,
+                           calibration.decimals)
+        return self.tolerance, self.decimation, self.position_format.template, calibration
+    
+    def _cached_block(self, key, i, path, motion_type, interpretation, canvas_size):
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+                self.block_hits += 1
+                return block
+            self.block_misses += 1
+        
+        block = tuple(self._iter_path_block(i, path, motion_type, interpretation, canvas_size))
+        with self._lock:
+            self._blocks[key] = block
+            while len(self._blocks) > self.block_cache_size:
+                self._blocks.popitem(last=False)
+        return block
+    
+    @staticmethod
+    def _motion_type(motion_types, i):
+        if i < len(motion_types):
+            return motion_types[i]
+        return "PTP"  # Default motion type
+    
+    def _iter_header(self, start_position):
         # Basic KRL program structure
-        krl_code = "DEF sketch_program()\n"
-        krl_code += "  INI\n"
-        krl_code += "  \n"
+        yield "DEF sketch_program()\n"
+        yield "  INI\n"
+        yield "  \n"
         
         # Add global declarations
-        krl_code += "  DECL E6POS home_position = {X 0, Y 0, Z 0, A 0, B 0, C 0, S 6, T 27}\n"
-        krl_code += "  \n"
+        yield "  DECL E6POS home_position = {X 0, Y 0, Z 0, A 0, B 0, C 0, S 6, T 27}\n"
+        yield "  \n"
         
         # Add start position
         if start_position == "HOME":
-            krl_code += "  ; Move to home position\n"
-            krl_code += "  PTP home_position\n"
-            krl_code += "  \n"
-        
-        # Convert paths to coordinates if needed
-        if interpretation == "coordinates":
-            coordinates = self.paths_to_coordinates(paths)
-        else:
-            coordinates = []
+            yield "  ; Move to home position\n"
+            yield "  PTP home_position\n"
+            yield "  \n"
+    
+    def _iter_path_block(self, i, path, motion_type, interpretation, canvas_size):
+        """
+        Lines emitted for a single detected path
+        """
+        yield f"  ; Path {i+1} motion\n"
+        if motion_type == "AUTO":
+            if interpretation == "direct":
+                yield self._default_line("LIN", DEFAULT_POSITIONS["LIN"], "Default coordinates")
+            else:
+                yield from self._iter_fitted(path, canvas_size)
+            yield "  \n"
+            return
+        if interpretation == "trajectory":
+            yield from self._iter_trajectory(path, motion_type, canvas_size)
+            yield "  \n"
+            return
+        use_coordinates = interpretation == "coordinates"
+        if use_coordinates:
+            coords = self.paths_to_coordinates([path], canvas_size)[0]
+            position = self.position_format.position
+        if motion_type == "PTP":
+            if use_coordinates:
+                coord = coords[0] if len(coords) else DEFAULT_POSITIONS["PTP"][0]
+                yield MOTION_TEMPLATES["PTP"].format(position(coord))
+            else:
+                yield self._default_line("PTP", DEFAULT_POSITIONS["PTP"], "Default coordinates")
+        elif motion_type == "LIN":
+            if use_coordinates:
+                coord = coords[0] if len(coords) else DEFAULT_POSITIONS["LIN"][0]
+                yield MOTION_TEMPLATES["LIN"].format(position(coord))
+            else:
+                yield self._default_line("LIN", DEFAULT_POSITIONS["LIN"], "Default coordinates")
+        elif motion_type == "CIRC":
+            if use_coordinates and len(coords) >= 2:
+                yield from self.position_format.lines(MOTION_TEMPLATES["CIRC"], coords[:2])
+            else:
+                yield self._default_line("CIRC", DEFAULT_POSITIONS["CIRC"], "Default coordinates")
+        elif motion_type == "SPLINE":
+            yield f"  SPLINE\n"
+            if use_coordinates:
+                # Limit to first 5 points
+                yield from self.position_format.lines(MOTION_TEMPLATES["SPL"], coords[:5])
+            else:
+                # Default spline points
+                for coord in DEFAULT_POSITIONS["SPL"]:
+                    yield self._default_line("SPL", [coord])
+            yield f"  ENDSPLINE\n"
+        yield "  \n"
+    
+    def _iter_trajectory(self, path, motion_type, canvas_size):
+        """
+        Motions through every point of the path, decimated to within tolerance mm. CIRC
+        motions are only used where the path is circular, with LIN motions in between.
+        """
+        if motion_type == "CIRC":
+            yield from self._iter_fitted(path, canvas_size, splines=False)
+            return
+        path = SketchPath.coerce(path)
+        coords = decimate(self.paths_to_coordinates([path], canvas_size)[0], self.tolerance,
+                          self.decimation, closed=path.closed)
+        if path.closed and len(coords) > 1:
+            coords = np.concatenate((coords, coords[:1]))
+        if not len(coords):
+            return
+        lines = self.position_format.lines
         
-        # Add motion commands based on detected paths
-        if paths:
-            krl_code += "  ; Process detected paths from sketch\n"
-            for i, path in enumerate(paths):
-                if i < len(motion_types):
-                    motion_type = motion_types[i]
-                else:
-                    motion_type = "PTP"  # Default motion type
-                
-                krl_code += f"  ; Path {i+1} motion\n"
-                if motion_type == "PTP":
-                    if interpretation == "coordinates" and i < len(coordinates):
-                        coord = coordinates[i][0] if coordinates[i] else {'x': 100, 'y': 200, 'z': 300}
-                        krl_code += f"  PTP {{X {coord['x']}, Y {coord['y']}, Z {coord['z']}, A 0, B 0, C 0, S 6, T 27}}\n"
-                    else:
-                        krl_code += f"  PTP {{X 100, Y 200, Z 300, A 0, B 0, C 0, S 6, T 27}} ; Default coordinates\n"
-                elif motion_type == "LIN":
-                    if interpretation == "coordinates" and i < len(coordinates):
-                        coord = coordinates[i][0] if coordinates[i] else {'x': 100, 'y': 200, 'z': 300}
-                        krl_code += f"  LIN {{X {coord['x']}, Y {coord['y']}, Z {coord['z']}, A 0, B 0, C 0, S 6, T 27}} C_VEL\n"
-                    else:
-                        krl_code += f"  LIN {{X 100, Y 200, Z 300, A 0, B 0, C 0, S 6, T 27}} C_VEL ; Default coordinates\n"
-                elif motion_type == "CIRC":
-                    if interpretation == "coordinates" and i < len(coordinates) and len(coordinates[i]) >= 2:
-                        coord1 = coordinates[i][0]
-                        coord2 = coordinates[i][1]
-                        krl_code += f"  CIRC {{X {coord1['x']}, Y {coord1['y']}, Z {coord1['z']}, A 0, B 0, C 0, S 6, T 27}}, {{X {coord2['x']}, Y {coord2['y']}, Z {coord2['z']}, A 0, B 0, C 0, S 6, T 27}} C_VEL\n"
-                    else:
-                        krl_code += f"  CIRC {{X 150, Y 250, Z 350, A 0, B 0, C 0, S 6, T 27}}, {{X 200, Y 300, Z 400, A 0, B 0, C 0, S 6, T 27}} C_VEL ; Default coordinates\n"
-                elif motion_type == "SPLINE":
-                    krl_code += f"  SPLINE\n"
-                    if interpretation == "coordinates" and i < len(coordinates):
-                        for j, coord in enumerate(coordinates[i][:5]):  # Limit to first 5 points
-                            krl_code += f"    SPL {{X {coord['x']}, Y {coord['y']}, Z {coord['z']}, A 0, B 0, C 0, S 6, T 27}}\n"
-                    else:
-                        # Default spline points
-                        krl_code += f"    SPL {{X 100, Y 200, Z 300, A 0, B 0, C 0, S 6, T 27}}\n"
-                        krl_code += f"    SPL {{X 150, Y 250, Z 350, A 0, B 0, C 0, S 6, T 27}}\n"
-                        krl_code += f"    SPL {{X 200, Y 300, Z 400, A 0, B 0, C 0, S 6, T 27}}\n"
-                        krl_code += f"    SPL {{X 250, Y 350, Z 450, A 0, B 0, C 0, S 6, T 27}}\n"
-                        krl_code += f"    SPL {{X 300, Y 400, Z 500, A 0, B 0, C 0, S 6, T 27}}\n"
-                    krl_code += f"  ENDSPLINE\n"
-                krl_code += "  \n"
-        else:
-            # If no paths were detected, generate sample code
-            krl_code += "  ; No paths detected in sketch, generating sample motions\n"
-            for i, motion_type in enumerate(motion_types):
-                if motion_type == "PTP":
-                    krl_code += f"  PTP {{X {100*(i+1)}, Y {200*(i+1)}, Z {300*(i+1)}, A 0, B 0, C 0, S 6, T 27}} ; Sample point {i+1}\n"
-                elif motion_type == "LIN":
-                    krl_code += f"  LIN {{X {100*(i+1)}, Y {200*(i+1)}, Z {300*(i+1)}, A 0, B 0, C 0, S 6, T 27}} C_VEL ; Sample point {i+1}\n"
-                elif motion_type == "CIRC":
-                    krl_code += f"  CIRC {{X {150*(i+1)}, Y {250*(i+1)}, Z {350*(i+1)}, A 0, B 0, C 0, S 6, T 27}}, {{X {200*(i+1)}, Y {300*(i+1)}, Z {400*(i+1)}, A 0, B 0, C 0, S 6, T 27}} C_VEL ; Sample points {i+1}\n"
-                elif motion_type == "SPLINE":
-                    krl_code += f"  SPLINE\n"
-                    krl_code += f"    SPL {{X {100*(i+1)}, Y {200*(i+1)}, Z {300*(i+1)}, A 0, B 0, C 0, S 6, T 27}} ; Sample point {i+1}a\n"
-                    krl_code += f"    SPL {{X {150*(i+1)}, Y {250*(i+1)}, Z {350*(i+1)}, A 0, B 0, C 0, S 6, T 27}} ; Sample point {i+1}b\n"
-                    krl_code += f"    SPL {{X {200*(i+1)}, Y {300*(i+1)}, Z {400*(i+1)}, A 0, B 0, C 0, S 6, T 27}} ; Sample point {i+1}c\n"
-                    krl_code += f"  ENDSPLINE\n"
-                krl_code += "  \n"
+        if motion_type in ("PTP", "LIN"):
+            yield from lines(MOTION_TEMPLATES[motion_type], coords)
+        elif motion_type == "SPLINE":
+            yield f"  SPLINE\n"
+            yield from lines(MOTION_TEMPLATES["SPL"], coords)
+            yield f"  ENDSPLINE\n"
+    
+    def _iter_fitted(self, path, canvas_size, splines=True):
+        """
+        Straight lines, arcs and (unless splines is False, which leaves LIN motions through
+        their points) spline runs fitted to the path to within tolerance mm
+        """
+        segments, coords = self._fit(path, canvas_size)
+        if not len(coords):
+            return
+        positions = self.position_format.positions(coords)
+        lin, circ, spl = MOTION_TEMPLATES["LIN"], MOTION_TEMPLATES["CIRC"], MOTION_TEMPLATES["SPL"]
         
+        yield lin.format(positions[0])
+        for kind, start, end in segments:
+            if kind == LINE:
+                yield lin.format(positions[end])
+            elif kind == ARC:
+                yield circ.format(positions[(start + end) // 2], positions[end])
+            elif not splines:
+                for position in positions[start + 1:end + 1]:
+                    yield lin.format(position)
+            else:
+                yield f"  SPLINE\n"
+                for position in positions[start + 1:end + 1]:
+                    yield spl.format(position)
+                yield f"  ENDSPLINE\n"
+    
+    def _fit(self, path, canvas_size):
+        """
+        fit_primitives over the dense (traced) points of the path in robot coordinates. The
+        points are smoothed of pixel stair-steps first, and the fit is never asked to be
+        tighter than one pixel, the accuracy of the sketch itself.
+        """
+        path = SketchPath.coerce(path)
+        calibration = self.calibration or canvas_calibration(canvas_size)
+        coords = calibration.apply(smooth_polyline(path.detail, path.closed))
+        pixel = calibration.pixel_size((canvas_size[0] / 2, canvas_size[1] / 2))
+        return fit_primitives(coords, max(self.tolerance, pixel), closed=path.closed)
+    
+    def _default_line(self, motion_type, coords, comment=None):
+        """
+        Motion line through positions given in mm rather than taken from the sketch, with
+        an optional trailing comment
+        """
+        line = MOTION_TEMPLATES[motion_type].format(*map(self.position_format.position, coords))
+        return line if comment is None else line.replace("\n", f" ; {comment}\n")
+    
+    def _iter_sample_block(self, motion_types):
+        # If no paths were detected, generate sample code
+        yield "  ; No paths detected in sketch, generating sample motions\n"
+        for i, motion_type in enumerate(motion_types):
+            n = i + 1
+            if motion_type in ("PTP", "LIN", "CIRC"):
+                coords = [[value * n for value in coord] for coord in DEFAULT_POSITIONS[motion_type]]
+                label = "Sample points" if len(coords) > 1 else "Sample point"
+                yield self._default_line(motion_type, coords, f"{label} {n}")
+            elif motion_type == "SPLINE":
+                yield f"  SPLINE\n"
+                for coord, suffix in zip(DEFAULT_POSITIONS["SPL"], "abc"):
+                    yield self._default_line("SPL", [[value * n for value in coord]], f"Sample point {n}{suffix}")
+                yield f"  ENDSPLINE\n"
+            yield "  \n"
+    
+    def _iter_footer(self, start_position):
         # Add program end
         if start_position == "HOME":
-            krl_code += "  ; Return to home position\n"
-            krl_code += "  PTP home_position\n"
-        krl_code += "END\n"
-        
-        return krl_code
+            yield "  ; Return to home position\n"
+            yield "  PTP home_position\n"
+        yield "END\n"
     
-    def paths_to_coordinates(self, paths, canvas_size=(400, 300)):
+    def paths_to_coordinates(self, paths, canvas_size=None):
         """
         Convert path points to KRL coordinates with more realistic values
         """
-        krl_coordinates = []
-        
-        for path in paths:
-            coords = []
-            for point in path['points']:
-                # Convert canvas coordinates to KRL coordinates with realistic robot workspace values
-                # Assuming the robot workspace is 1000mm x 1000mm x 1000mm
-                x = (point['x'] / canvas_size[0]) * 800 + 100  # Scale to 100-900mm range
-                y = (point['y'] / canvas_size[1]) * 800 + 100  # Scale to 100-900mm range
-                z = 300  # Default Z height for a consistent plane
-                
-                coords.append({
-                    'x': round(x, 2),
-                    'y': round(y, 2),
-                    'z': round(z, 2)
-                })
-            
-            krl_coordinates.append(coords)
-        
-        return krl_coordinates
\ No newline at end of file
+        return paths_to_coordinates(paths, canvas_size, self.calibration)
\ No newline at end of file
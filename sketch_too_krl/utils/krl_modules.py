@@ -0,0 +1,233 @@
+import os
+import re
+
+from utils.krl_validator import MAX_NAME_LENGTH
+
+# Points per module before a program is split into chained subprograms
+DEFAULT_CHUNK_SIZE = 1000
+# Runs of at least this many motions of the same form become a FOR loop over the point table
+MIN_LOOP_LENGTH = 3
+# Names of the point table and loop counter declared in each .dat file
+POINT_TABLE = 'PTS'
+LOOP_COUNTER = 'I'
+# Subprograms are named <module>__<k>. Module names never contain the separator and leave
+# room for it and MAX_SUBPROGRAMS, so no subprogram can share a name with another module.
+SUBPROGRAM_SEPARATOR = '__'
+MAX_SUBPROGRAMS = 999
+MAX_MODULE_NAME_LENGTH = MAX_NAME_LENGTH - len(SUBPROGRAM_SEPARATOR) - len(str(MAX_SUBPROGRAMS))
+
+_POSITION = re.compile(r"\{X [^{}]*\}")
+
+
+def module_name(name):
+    """
+    A KRL identifier for a module derived from a file name, short enough to number its
+    subprograms and without the subprogram separator (runs of underscores become one)
+    """
+    name = re.sub(r'_+', '_', re.sub(r'\W', '_', name))
+    if name and not (name[0].isalpha() or name[0] == '_'):
+        name = 'p_' + name
+    return name[:MAX_MODULE_NAME_LENGTH].rstrip('_') or 'sketch_program'
+
+
+def numbered_name(name, n, max_length=None):
+    """
+    name with the suffix _<n>, cut short first where the result would exceed max_length
+    """
+    suffix = f"_{n}"
+    if max_length is not None:
+        name = name[:max_length - len(suffix)]
+    return name.rstrip('_') + suffix
+
+
+def unique_names(names, max_length=None):
+    """
+    The names (file names without extension, or relative paths of them) made distinct,
+    ignoring case as KRL and Windows do: the first of equal names keeps it, the others
+    get numbered (see numbered_name) past every name already in the list. Pass final
+    names, e.g. after module_name, so names that only clash once cut short are caught.
+    """
+    taken = {name.lower() for name in names}
+    seen = set()
+    unique = []
+    for name in names:
+        if name.lower() in seen:
+            directory, base = os.path.split(name)
+            n = 2
+            while os.path.join(directory, numbered_name(base, n, max_length)).lower() in taken:
+                n += 1
+            name = os.path.join(directory, numbered_name(base, n, max_length))
+            taken.add(name.lower())
+        seen.add(name.lower())
+        unique.append(name)
+    return unique
+
+
+def subprogram_name(name, k):
+    return f"{name}{SUBPROGRAM_SEPARATOR}{k}"
+
+
+def _keyword(line):
+    stripped = line.strip()
+    return stripped.split(None, 1)[0].upper() if stripped else ''
+
+
+def _units(lines):
+    """
+    Groups of lines that must stay in one module: whole SPLINE blocks, and comments and
+    blank lines together with the statement after them
+    """
+    unit = []
+    in_spline = False
+    for line in lines:
+        unit.append(line)
+        keyword = _keyword(line)
+        if keyword in ('SPLINE', 'PTP_SPLINE'):
+            in_spline = True
+        elif keyword == 'ENDSPLINE':
+            in_spline = False
+        if keyword and not keyword.startswith(';') and not in_spline:
+            yield unit
+            unit = []
+    if unit:
+        yield unit
+
+
+def _chunks(lines, chunk_size):
+    """
+    Split lines into runs of units holding at most chunk_size positions each (a single
+    larger unit, i.e. a long SPLINE block, gets a run of its own)
+    """
+    chunk, count = [], 0
+    for unit in _units(lines):
+        points = sum(line.count('{X ') for line in unit)
+        if chunk and count + points > chunk_size:
+            yield chunk
+            chunk, count = [], 0
+        chunk.extend(unit)
+        count += points
+    if chunk:
+        yield chunk
+
+
+def _table_body(lines):
+    """
+    Fold runs of motions of the same form over consecutive positions (a LIN per point, a
+    CIRC per point pair) into FOR loops over a point table. Other positions, including
+    spline segments which cannot be looped inside a SPLINE block, stay inline where they
+    take less space than a table entry. Returns the new lines and the table of literals.
+    """
+    table = []
+    body = []
+    pending = []  # (line, template, literals) of a possible loop
+    in_spline = False
+
+    def flush():
+        if len(pending) < MIN_LOOP_LENGTH:
+            body.extend(line for line, _, _ in pending)
+            pending.clear()
+            return
+        template = pending[0][1]
+        count = len(pending[0][2])
+        first = len(table) + 1
+        for _, _, literals in pending:
+            table.extend(literals)
+        last = len(table) - count + 1
+        indent = template[:len(template) - len(template.lstrip())]
+        step = f" STEP {count}" if count > 1 else ""
+        counter = [LOOP_COUNTER] + [f"{LOOP_COUNTER}+{j}" for j in range(1, count)]
+        body.append(f"{indent}FOR {LOOP_COUNTER} = {first} TO {last}{step}\n")
+        body.append("  " + template.format(*(f"{POINT_TABLE}[{c}]" for c in counter)))
+        body.append(f"{indent}ENDFOR\n")
+        pending.clear()
+
+    for line in lines:
+        keyword = _keyword(line)
+        if keyword in ('SPLINE', 'PTP_SPLINE'):
+            in_spline = True
+        elif keyword == 'ENDSPLINE':
+            in_spline = False
+
+        literals = _POSITION.findall(line) if not in_spline else ()
+        if not literals:
+            flush()
+            body.append(line)
+            continue
+        template = _template(line)
+        if pending and (pending[0][1] != template or len(pending[0][2]) != len(literals)):
+            flush()
+        pending.append((line, template, literals))
+    flush()
+    return body, table
+
+
+def _template(line):
+    """
+    The line as a format string with a {} field in place of every position literal
+    """
+    pieces = []
+    position = 0
+    for match in _POSITION.finditer(line):
+        pieces.append(line[position:match.start()].replace('{', '{{').replace('}', '}}'))
+        pieces.append('{}')
+        position = match.end()
+    pieces.append(line[position:].replace('{', '{{').replace('}', '}}'))
+    return ''.join(pieces)
+
+
+def _dat(name, declarations, table):
+    lines = [f"DEFDAT {name}\n"]
+    lines.extend(line.lstrip() for line in declarations)
+    if table:
+        lines.append(f"DECL INT {LOOP_COUNTER}\n")
+        lines.append(f"DECL E6POS {POINT_TABLE}[{len(table)}]\n")
+        lines.extend(f"{POINT_TABLE}[{k}]={literal}\n" for k, literal in enumerate(table, 1))
+    lines.append("ENDDAT\n")
+    return "".join(lines)
+
+
+def split_program(program, name, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Turn a KRLProgram into .src/.dat modules: runs of motions through consecutive
+    positions become FOR loops over an E6POS table in the .dat file, declarations move to
+    the .dat file, and programs with more than chunk_size positions are split into
+    subprograms name__1, name__2, ... called in turn by the main program. The module is
+    named module_name(name). Returns a dict of final file name -> text, main program first.
+    """
+    name = module_name(name)
+    header = []
+    declarations = []
+    for line in program.header:
+        keyword = _keyword(line)
+        if keyword == 'DEF':
+            header.append(f"DEF {name}()\n")
+        elif keyword == 'DECL':
+            declarations.append(line)
+        elif keyword or not declarations or header[-1].strip():
+            # Blank lines are kept unless they separated a moved declaration
+            header.append(line)
+
+    body = [line for block in program.blocks for line in block]
+    chunks = list(_chunks(body, chunk_size))
+    modules = {}
+    if len(chunks) <= 1:
+        src_body, table = _table_body(body)
+        modules[name + '.src'] = "".join(header + src_body + list(program.footer))
+        modules[name + '.dat'] = _dat(name, declarations, table)
+        return modules
+
+    if len(chunks) > MAX_SUBPROGRAMS:
+        raise ValueError(f"{len(chunks)} subprograms of {chunk_size} positions exceed the limit of "
+                         f"{MAX_SUBPROGRAMS}; use a larger chunk size")
+    calls = []
+    parts = {}
+    for k, chunk in enumerate(chunks, 1):
+        part = subprogram_name(name, k)
+        src_body, table = _table_body(chunk)
+        parts[part + '.src'] = "".join([f"DEF {part}()\n"] + src_body + ["END\n"])
+        parts[part + '.dat'] = _dat(part, [], table)
+        calls.append(f"  {part}()\n")
+    modules[name + '.src'] = "".join(header + calls + ["  \n"] + list(program.footer))
+    modules[name + '.dat'] = _dat(name, declarations, [])
+    modules.update(parts)
+    return modules
@@ -0,0 +1,615 @@
+import math
+import os
+import re
+
+ERROR = 'error'
+WARNING = 'warning'
+
+# Cartesian workspace (mm) motion targets must stay in, as ((x_min, y_min, z_min),
+# (x_max, y_max, z_max)); the 1000 mm cube the default coordinate conversion assumes
+WORKSPACE_BOUNDS = ((0, 0, 0), (1000, 1000, 1000))
+# Consecutive targets closer than this (mm) are reported as repeated points
+MIN_SPACING = 0.01
+# Longest name the controller accepts for programs and variables
+MAX_NAME_LENGTH = 24
+
+_NUMBER = r"[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?"
+# Aggregates of plain "Name number" components (nearly every position in a generated
+# program) are matched as one token and split with a single findall
+_FLAT_AGGREGATE = rf"\{{\s*[A-Za-z]\w*\s+{_NUMBER}(?:\s*,\s*[A-Za-z]\w*\s+{_NUMBER})*\s*\}}"
+_COMPONENT = re.compile(rf"([A-Za-z]\w*)\s+({_NUMBER})")
+
+_TOKEN = re.compile(rf"""
+    (?P<aggregate>{_FLAT_AGGREGATE})
+  | (?P<number>{_NUMBER})
+  | (?P<name>[$#A-Za-z_][\w$]*)
+  | (?P<string>'[^']*'|"[^"]*")
+  | (?P<punct>[{{}},=()\[\]%:.*/+<>-])
+  | (?P<space>\s+)
+  | (?P<comment>;.*)
+  | (?P<other>.)
+""", re.VERBOSE)
+
+# Components of Cartesian (POS/E6POS/FRAME) and axis-specific (AXIS/E6AXIS) positions
+CARTESIAN = {'X', 'Y', 'Z', 'A', 'B', 'C', 'S', 'T', 'E1', 'E2', 'E3', 'E4', 'E5', 'E6'}
+AXES = {'A1', 'A2', 'A3', 'A4', 'A5', 'A6', 'E1', 'E2', 'E3', 'E4', 'E5', 'E6'}
+# A complete start position names every component of a POS
+COMPLETE_POS = {'X', 'Y', 'Z', 'A', 'B', 'C', 'S', 'T'}
+
+# Approximation parameters allowed first and second (ignored by the controller) per motion
+PTP_APPROXIMATION = ({'C_PTP', 'C_DIS'}, {'C_DIS', 'C_VEL', 'C_ORI'})
+CP_APPROXIMATION = ({'C_DIS', 'C_VEL', 'C_ORI'}, {'C_PTP'})
+
+# Statements other than motions the validator accepts without looking further
+CONTROL_KEYWORDS = {
+    'INI', 'IF', 'THEN', 'ELSE', 'ENDIF', 'FOR', 'ENDFOR', 'WHILE', 'ENDWHILE', 'LOOP',
+    'ENDLOOP', 'REPEAT', 'UNTIL', 'SWITCH', 'CASE', 'DEFAULT', 'ENDSWITCH', 'WAIT', 'HALT',
+    'RETURN', 'EXIT', 'GOTO', 'CONTINUE', 'BAS', 'INTERRUPT', 'TRIGGER', 'BRAKE', 'RESUME',
+    'SIGNAL', 'STRUC', 'ENUM', 'CONST_VEL', 'TIME_BLOCK', 'STOP', 'ANIN', 'ANOUT', 'PULSE',
+}
+# Besides segments, a CP spline block may only hold these (comments and blank lines aside)
+SPLINE_BLOCK_KEYWORDS = {'TRIGGER', 'CONST_VEL', 'TIME_BLOCK', 'STOP'}
+
+# Positions known to the controller without a declaration in the program
+SYSTEM_POSITIONS = {'HOME', 'XHOME', '$POS_ACT', '$AXIS_ACT', '$POS_INT', '$AXIS_INT'}
+
+
+def tokenize(line):
+    """
+    Split one line of KRL into (kind, text) tokens, dropping whitespace and comments
+    """
+    tokens = []
+    for match in _TOKEN.finditer(line):
+        kind = match.lastgroup
+        if kind == 'comment':
+            break
+        if kind != 'space':
+            tokens.append((kind, match.group()))
+    return tokens
+
+
+class _ParseError(Exception):
+    pass
+
+
+class _Cursor:
+    """
+    Read position in the tokens of one statement
+    """
+
+    def __init__(self, tokens, start=0):
+        self.tokens = tokens
+        self.index = start
+
+    def peek(self, offset=0):
+        index = self.index + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise _ParseError("unexpected end of line")
+        self.index += 1
+        return token
+
+    def accept(self, text):
+        if self.peek()[1] == text:
+            self.index += 1
+            return True
+        return False
+
+    def expect(self, text):
+        if not self.accept(text):
+            raise _ParseError(f"expected '{text}'" + (f" before '{self.peek()[1]}'" if self.peek()[1] else ""))
+
+    def done(self):
+        return self.index >= len(self.tokens)
+
+    def rest(self):
+        return [text for _, text in self.tokens[self.index:]]
+
+
+def _parse_value(cursor):
+    """
+    A number, string, name (optionally indexed) or nested aggregate
+    """
+    kind, text = cursor.peek()
+    if text == '{' or kind == 'aggregate':
+        return _parse_aggregate(cursor)
+    if kind == 'punct' and text == '-' and cursor.peek(1)[0] == 'number':
+        cursor.next()
+        return -float(cursor.next()[1])
+    kind, text = cursor.next()
+    if kind == 'number':
+        return float(text)
+    if kind == 'string':
+        return text
+    if kind == 'name':
+        return _parse_reference(cursor, text)
+    raise _ParseError(f"unexpected '{text}'")
+
+
+def _parse_aggregate(cursor):
+    """
+    {Name value, Name value, ...} as a dict with upper case component names; a leading
+    type name ({E6POS: X 1, ...}) is skipped
+    """
+    kind, text = cursor.peek()
+    if kind == 'aggregate':
+        cursor.index += 1
+        pairs = _COMPONENT.findall(text)
+        components = {name.upper(): float(value) for name, value in pairs}
+        if len(components) < len(pairs):
+            names = [name.upper() for name, _ in pairs]
+            raise _ParseError(f"component {next(n for n in names if names.count(n) > 1)} given twice")
+        return components
+    cursor.expect('{')
+    if cursor.peek()[0] == 'name' and cursor.peek(1)[1] == ':':
+        cursor.index += 2
+    components = {}
+    if cursor.accept('}'):
+        return components
+    while True:
+        kind, name = cursor.next()
+        if kind != 'name':
+            raise _ParseError(f"expected a component name before '{name}'")
+        name = name.upper()
+        if name in components:
+            raise _ParseError(f"component {name} given twice")
+        components[name] = _parse_value(cursor)
+        if cursor.accept('}'):
+            return components
+        cursor.expect(',')
+
+
+def _parse_reference(cursor, name):
+    """
+    A variable name with an optional [index], returned as (name, index or None)
+    """
+    index = None
+    if cursor.accept('['):
+        tokens = []
+        while not cursor.accept(']'):
+            tokens.append(cursor.next())
+        if len(tokens) == 1 and tokens[0][0] == 'number':
+            index = int(float(tokens[0][1]))
+        else:
+            # Index expressions (I+1) are only known at run time
+            index = ''.join(text for _, text in tokens).upper()
+    return name.upper(), index
+
+
+def _parse_target(cursor):
+    kind, text = cursor.peek()
+    if text == '{' or kind == 'aggregate':
+        return _parse_aggregate(cursor)
+    kind, text = cursor.next()
+    if kind != 'name':
+        raise _ParseError(f"expected a position before '{text}'")
+    return _parse_reference(cursor, text)
+
+
+def _skip_with(cursor):
+    """
+    WITH SysVar = Value, ... : the assignments are not checked beyond being well formed
+    """
+    if cursor.peek()[1] is None or cursor.peek()[1].upper() != 'WITH':
+        return
+    cursor.next()
+    while True:
+        kind, text = cursor.next()
+        if kind != 'name':
+            raise _ParseError(f"expected a system variable after WITH, not '{text}'")
+        while cursor.accept('.') or cursor.accept('['):
+            cursor.next()
+            cursor.accept(']')
+        cursor.expect('=')
+        _parse_value(cursor)
+        if not cursor.accept(','):
+            return
+
+
+class KRLValidator:
+    def __init__(self, bounds=WORKSPACE_BOUNDS, max_reach=None, min_spacing=MIN_SPACING):
+        """
+        Offline check of KRL programs: structure (DEF/END, DECL, SPLINE blocks), motion
+        syntax (PTP/LIN/CIRC, SPL/SLIN/SCIRC and their approximation parameters), Cartesian
+        targets inside bounds and within max_reach mm of the robot base, and spacing of
+        consecutive targets. Issues are dicts with the 1-based line, the severity ('error'
+        or 'warning') and a message; programs with errors would be rejected by the
+        controller or move outside the workspace.
+        """
+        self.bounds = bounds
+        self.max_reach = max_reach
+        self.min_spacing = min_spacing
+
+    def validate_file(self, path, dat_path=None):
+        """
+        Validate a .src file, with the declarations of its .dat file (found next to it
+        by default) available to the program
+        """
+        with open(path) as f:
+            text = f.read()
+        if dat_path is None:
+            candidate = os.path.splitext(path)[0] + '.dat'
+            dat_path = candidate if os.path.exists(candidate) else None
+        dat = None
+        if dat_path is not None:
+            with open(dat_path) as f:
+                dat = f.read()
+        return self.validate(text, name=os.path.splitext(os.path.basename(path))[0], dat=dat)
+
+    def validate(self, text, name=None, dat=None):
+        """
+        Validate the text of a .src program; name is the module (file) name the main DEF
+        should carry and dat the text of the matching .dat file, if any
+        """
+        return _ProgramCheck(self, name, dat).run(text)
+
+
+class _ProgramCheck:
+    """
+    State of one validation run
+    """
+
+    def __init__(self, validator, name, dat):
+        self.validator = validator
+        self.name = name
+        self.issues = []
+        self.variables = {}
+        self.line = 0
+        self.in_routine = False
+        self.routines = 0
+        self.statements = 0
+        self.spline = None
+        self.spline_line = 0
+        self.segments = 0
+        self.position = None
+        self.motions = 0
+        # Programs that run INI are started on their own and need an unambiguous first motion;
+        # subprograms continue from wherever their caller left the robot
+        self.initialized = False
+        if dat:
+            self._read_dat(dat)
+
+    def report(self, severity, message, line=None):
+        self.issues.append({'line': self.line if line is None else line, 'severity': severity,
+                            'message': message})
+
+    def _read_dat(self, dat):
+        # Issues in the .dat file are reported with negative line numbers
+        for number, text in enumerate(dat.splitlines(), 1):
+            tokens = tokenize(text)
+            if not tokens or tokens[0][1].startswith('&'):
+                continue
+            self.line = -number
+            keyword = tokens[0][1].upper()
+            try:
+                if keyword == 'DECL' or (keyword == 'GLOBAL' and len(tokens) > 1):
+                    self._declare(_Cursor(tokens, 1))
+                elif keyword not in ('DEFDAT', 'ENDDAT'):
+                    self._assign(_Cursor(tokens))
+            except _ParseError as e:
+                self.report(ERROR, f".dat: {e}")
+        self.line = 0
+
+    def run(self, text):
+        for self.line, line in enumerate(text.splitlines(), 1):
+            # Fast path: blank lines and comments
+            stripped = line.strip()
+            if not stripped or stripped[0] == ';' or stripped[0] == '&':
+                continue
+            tokens = tokenize(stripped)
+            if not tokens:
+                continue
+            try:
+                self._statement(tokens)
+            except _ParseError as e:
+                self.report(ERROR, str(e))
+
+        if self.spline is not None:
+            self.report(ERROR, f"{self.spline} block opened here is never closed", self.spline_line)
+        if not self.routines:
+            self.report(ERROR, "no DEF line: a program starts with DEF name()", 1)
+        elif self.in_routine:
+            self.report(ERROR, "missing END at the end of the program")
+        self.issues.sort(key=lambda issue: abs(issue['line']))
+        return self.issues
+
+    def _statement(self, tokens):
+        keyword = tokens[0][1].upper()
+        if keyword == 'GLOBAL' and len(tokens) > 1:
+            tokens = tokens[1:]
+            keyword = tokens[0][1].upper()
+
+        if keyword in ('DEF', 'DEFFCT'):
+            return self._def(tokens)
+        if not self.in_routine:
+            raise _ParseError(f"'{tokens[0][1]}' outside DEF ... END")
+        if keyword in ('END', 'ENDFCT'):
+            if len(tokens) > 1:
+                raise _ParseError(f"unexpected '{tokens[1][1]}' after END")
+            if self.spline is not None:
+                self.report(ERROR, f"{self.spline} block opened here is never closed", self.spline_line)
+                self.spline = None
+            self.in_routine = False
+            return
+
+        cursor = _Cursor(tokens, 1)
+        if keyword == 'DECL':
+            if self.statements:
+                self.report(WARNING, "declaration after the first statement; KRL expects declarations "
+                                     "before INI")
+            return self._declare(cursor)
+
+        self.statements += 1
+        if self.spline is not None:
+            return self._spline_statement(keyword, cursor)
+        if keyword in ('PTP', 'LIN', 'CIRC', 'PTP_REL', 'LIN_REL', 'CIRC_REL', 'SLIN', 'SCIRC', 'SPTP'):
+            return self._motion(keyword, cursor)
+        if keyword in ('SPLINE', 'PTP_SPLINE'):
+            self.spline = keyword
+            self.spline_line = self.line
+            self.segments = 0
+            _skip_with(cursor)
+            return self._finish(cursor)
+        if keyword in ('SPL', 'ENDSPLINE'):
+            raise _ParseError(f"{keyword} outside a SPLINE block")
+        if keyword in CONTROL_KEYWORDS:
+            self.initialized = self.initialized or keyword == 'INI'
+            return
+        # Anything else must be an assignment or a subprogram call
+        if tokens[0][0] == 'name':
+            reference = _Cursor(tokens, 0)
+            reference.next()
+            while reference.accept('.') or reference.accept('['):
+                reference.next()
+                reference.accept(']')
+            if reference.peek()[1] == '(':
+                # The robot is wherever the called subprogram left it
+                self.position = None
+                return
+            if reference.peek()[1] == '=':
+                return
+        raise _ParseError(f"unknown statement '{tokens[0][1]}'")
+
+    def _def(self, tokens):
+        if self.in_routine:
+            raise _ParseError("DEF inside another DEF ... END (missing END?)")
+        cursor = _Cursor(tokens, 1)
+        kind, name = cursor.next()
+        if tokens[0][1].upper() == 'DEFFCT':
+            kind, name = cursor.next()
+        if kind != 'name':
+            raise _ParseError(f"expected a program name after DEF, not '{name}'")
+        if len(name) > MAX_NAME_LENGTH:
+            self.report(ERROR, f"name '{name}' is longer than {MAX_NAME_LENGTH} characters")
+        cursor.expect('(')
+        while not cursor.accept(')'):
+            cursor.next()
+        self._finish(cursor)
+        # The main program is named after its module
+        if not self.routines and self.name and name.upper() != self.name.upper():
+            self.report(WARNING, f"program '{name}' is stored as '{self.name}'; the controller "
+                                 f"expects the DEF name to match the file name")
+        self.routines += 1
+        self.in_routine = True
+        self.statements = 0
+
+    def _declare(self, cursor):
+        kind, type_name = cursor.next()
+        if kind != 'name':
+            raise _ParseError(f"expected a type after DECL, not '{type_name}'")
+        while True:
+            kind, name = cursor.next()
+            if kind != 'name':
+                raise _ParseError(f"expected a variable name, not '{name}'")
+            if len(name) > MAX_NAME_LENGTH:
+                self.report(ERROR, f"name '{name}' is longer than {MAX_NAME_LENGTH} characters")
+            size = None
+            if cursor.accept('['):
+                size = int(float(cursor.next()[1]))
+                cursor.expect(']')
+            value = None
+            if cursor.accept('='):
+                value = _parse_value(cursor)
+            self.variables[name.upper()] = {} if size is not None else value
+            if not cursor.accept(','):
+                break
+        self._finish(cursor)
+
+    def _assign(self, cursor):
+        kind, name = cursor.next()
+        name, index = _parse_reference(cursor, name)
+        cursor.expect('=')
+        value = _parse_value(cursor)
+        self._finish(cursor)
+        if index is None:
+            self.variables[name] = value
+        elif isinstance(self.variables.get(name), dict):
+            self.variables[name][index] = value
+        # Point tables in the .dat file are checked once here rather than per motion
+        if isinstance(value, dict) and not value.keys() & (AXES - CARTESIAN):
+            point = [value.get(axis) for axis in 'XYZ']
+            if all(isinstance(coordinate, float) for coordinate in point):
+                self._check_point(point)
+
+    def _resolve(self, target):
+        """
+        The components of a target, or None when they are not known before run time
+        """
+        if isinstance(target, dict):
+            return target
+        name, index = target
+        if name in SYSTEM_POSITIONS or name.startswith('$'):
+            return None
+        if name not in self.variables:
+            self.report(WARNING, f"'{name}' is not declared in this program (declared in $config.dat?)")
+            return None
+        value = self.variables[name]
+        if index is not None:
+            value = value.get(index) if isinstance(value, dict) and not isinstance(index, str) else None
+        return value if isinstance(value, dict) else None
+
+    def _finish(self, cursor):
+        if not cursor.done():
+            raise _ParseError(f"unexpected '{cursor.peek()[1]}'")
+
+    def _approximation(self, cursor, allowed):
+        rest = [text.upper() for text in cursor.rest()]
+        cursor.index = len(cursor.tokens)
+        if len(rest) > 2 or (rest and rest[0] not in allowed[0]) or (len(rest) == 2 and rest[1] not in allowed[1]):
+            raise _ParseError(f"invalid approximation '{' '.join(rest)}'")
+
+    def _motion(self, keyword, cursor):
+        relative = keyword.endswith('_REL')
+        circular = keyword in ('CIRC', 'CIRC_REL', 'SCIRC')
+        auxiliary = None
+        if circular:
+            auxiliary = _parse_target(cursor)
+            cursor.expect(',')
+        target = _parse_target(cursor)
+        if circular and cursor.accept(','):
+            if cursor.next()[1].upper() != 'CA':
+                raise _ParseError("expected CA <angle> after the CIRC end point")
+            _parse_value(cursor)
+        if keyword in ('SLIN', 'SCIRC', 'SPTP'):
+            _skip_with(cursor)
+            approximation = ({'C_SPL', 'C_DIS'}, set())
+        else:
+            approximation = PTP_APPROXIMATION if keyword.startswith('PTP') else CP_APPROXIMATION
+            if relative and cursor.peek()[1] and cursor.peek()[1].upper() in ('#BASE', '#TOOL'):
+                cursor.next()
+        self._approximation(cursor, approximation)
+
+        if self.motions == 0 and self.initialized and (keyword != 'PTP' or not self._complete(target)):
+            self.report(WARNING, "the first motion should be a PTP to HOME or to a complete position, "
+                                 "so the start position is unambiguous")
+        self.motions += 1
+        if relative:
+            self.position = None
+            return
+        if auxiliary is not None:
+            self._check_circle(auxiliary, target)
+        else:
+            self._move(target)
+
+    def _complete(self, target):
+        if not isinstance(target, dict):
+            name = target[0]
+            if name in SYSTEM_POSITIONS:
+                return True
+            target = self._resolve(target)
+            if target is None:
+                return False
+        return COMPLETE_POS <= target.keys() or AXES - {'E1', 'E2', 'E3', 'E4', 'E5', 'E6'} <= target.keys()
+
+    def _spline_statement(self, keyword, cursor):
+        if keyword == 'ENDSPLINE':
+            if not self.segments:
+                self.report(WARNING, f"empty {self.spline} block")
+            if cursor.peek()[1] and cursor.peek()[1].upper() == 'C_SPL':
+                cursor.next()
+            self._finish(cursor)
+            self.spline = None
+            return
+        allowed = ('SPTP',) if self.spline == 'PTP_SPLINE' else ('SPL', 'SLIN', 'SCIRC')
+        if keyword in allowed:
+            self.segments += 1
+            circular = keyword == 'SCIRC'
+            auxiliary = None
+            if circular:
+                auxiliary = _parse_target(cursor)
+                cursor.expect(',')
+            target = _parse_target(cursor)
+            if circular and cursor.accept(','):
+                if cursor.next()[1].upper() != 'CA':
+                    raise _ParseError("expected CA <angle> after the SCIRC end point")
+                _parse_value(cursor)
+            _skip_with(cursor)
+            if cursor.peek()[1] and cursor.peek()[1].upper() in ('C_SPL', 'C_DIS'):
+                raise _ParseError(f"{cursor.peek()[1]} is only allowed on individual motions, not on segments")
+            self._finish(cursor)
+            if self.motions == 0 and self.initialized:
+                self.report(WARNING, "the first motion should be a PTP to HOME or to a complete position, "
+                                     "so the start position is unambiguous")
+            self.motions += 1
+            if auxiliary is not None:
+                self._check_circle(auxiliary, target)
+            else:
+                self._move(target, keyword)
+            return
+        if keyword in SPLINE_BLOCK_KEYWORDS:
+            return
+        raise _ParseError(f"{keyword} is not allowed inside a {self.spline} block")
+
+    def _point(self, target):
+        """
+        Cartesian X/Y/Z of a target, completed from the previous position, or None
+        """
+        components = self._resolve(target)
+        if components is None or components.keys() & (AXES - CARTESIAN):
+            return None
+        previous = self.position or {}
+        point = []
+        for axis in ('X', 'Y', 'Z'):
+            value = components.get(axis, previous.get(axis))
+            if not isinstance(value, float):
+                return None
+            point.append(value)
+        return point
+
+    def _check_point(self, point):
+        validator = self.validator
+        if validator.bounds is not None:
+            low, high = validator.bounds
+            for axis, value, lo, hi in zip('XYZ', point, low, high):
+                if not lo <= value <= hi:
+                    self.report(ERROR, f"{axis} {value:g} is outside the workspace ({lo:g} to {hi:g} mm)")
+        if validator.max_reach is not None:
+            reach = math.sqrt(point[0] ** 2 + point[1] ** 2 + point[2] ** 2)
+            if reach > validator.max_reach:
+                self.report(ERROR, f"target is {reach:.1f} mm from the robot base, beyond its "
+                                   f"{validator.max_reach:g} mm reach")
+
+    def _move(self, target, keyword=None):
+        point = self._point(target)
+        if point is None:
+            self.position = None
+            return
+        self._check_point(point)
+        if self.position is not None and self.validator.min_spacing:
+            previous = self.position
+            step = math.dist(point, (previous['X'], previous['Y'], previous['Z']))
+            if step < self.validator.min_spacing:
+                self.report(WARNING, f"target repeats the previous point ({step:.3f} mm apart)")
+        self.position = dict(zip('XYZ', point))
+
+    def _check_circle(self, auxiliary, target):
+        start = self.position
+        aux_point = self._point(auxiliary)
+        end_point = self._point(target)
+        if start is None or aux_point is None or end_point is None:
+            self.position = dict(zip('XYZ', end_point)) if end_point is not None else None
+            return
+        self._check_point(aux_point)
+        self._check_point(end_point)
+        start_point = (start['X'], start['Y'], start['Z'])
+        spacing = self.validator.min_spacing or 1e-9
+        # Start, auxiliary and end point must be distinct and not on one line
+        u = [a - s for a, s in zip(aux_point, start_point)]
+        v = [e - s for e, s in zip(end_point, start_point)]
+        cross = (u[1] * v[2] - u[2] * v[1], u[2] * v[0] - u[0] * v[2], u[0] * v[1] - u[1] * v[0])
+        if min(math.dist(start_point, aux_point), math.dist(aux_point, end_point)) < spacing:
+            self.report(ERROR, "circle auxiliary point coincides with its start or end point")
+        elif math.hypot(*cross) < spacing * max(math.hypot(*u), math.hypot(*v)):
+            self.report(ERROR, "circle start, auxiliary and end point lie on one line")
+        self.position = dict(zip('XYZ', end_point))
+
+
+def summarize_issues(issues):
+    """
+    Count the errors and warnings in a list of issues
+    """
+    errors = sum(1 for issue in issues if issue['severity'] == ERROR)
+    return {'errors': errors, 'warnings': len(issues) - errors}
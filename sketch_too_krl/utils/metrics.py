@@ -0,0 +1,92 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PipelineMetrics:
+    def __init__(self, profile=False):
+        """
+        Stage timings and counters collected while processing a single sketch
+        """
+        self.stages = {}
+        self.counts = {}
+        self.profile = profile
+        self.profile_stats = None
+        self._profiler = cProfile.Profile() if profile else None
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, value):
+        self.counts[name] = value
+
+    def start_profile(self):
+        if self._profiler is not None:
+            self._profiler.enable()
+
+    def stop_profile(self, limit=25):
+        if self._profiler is None:
+            return
+        self._profiler.disable()
+        # Keep the report as text so the metrics stay picklable and JSON serializable
+        out = io.StringIO()
+        pstats.Stats(self._profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+        self.profile_stats = out.getvalue()
+        self._profiler = None
+
+    @property
+    def total(self):
+        return sum(self.stages.values())
+
+    def to_dict(self):
+        return {
+            'stages': dict(self.stages),
+            'total': self.total,
+            'counts': dict(self.counts),
+            'profile': self.profile_stats,
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """
+        Aggregates PipelineMetrics from all processed sketches for the /metrics endpoint
+        """
+        self._lock = threading.Lock()
+        self.runs = 0
+        self._stages = {}
+        self._counts = {}
+        self.last = None
+
+    def record(self, metrics):
+        with self._lock:
+            self.runs += 1
+            for name, seconds in metrics.stages.items():
+                stage = self._stages.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+                stage['count'] += 1
+                stage['total'] += seconds
+                stage['max'] = max(stage['max'], seconds)
+            for name, value in metrics.counts.items():
+                if isinstance(value, (int, float)):
+                    self._counts[name] = self._counts.get(name, 0) + value
+            self.last = metrics.to_dict()
+
+    def snapshot(self):
+        with self._lock:
+            stages = {}
+            for name, stage in self._stages.items():
+                stages[name] = dict(stage, mean=stage['total'] / stage['count'])
+            return {
+                'runs': self.runs,
+                'stages': stages,
+                'counts': dict(self._counts),
+                'last': self.last,
+            }
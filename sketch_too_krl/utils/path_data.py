@@ -0,0 +1,140 @@
+import numpy as np
+
+from utils.calibration import WorkspaceCalibration
+
+# Canvas size assumed when the size of the source image is unknown
+DEFAULT_CANVAS_SIZE = (400, 300)
+
+# Robot workspace the canvas is mapped onto (mm), with all points on one Z plane
+WORKSPACE_MIN = 100
+WORKSPACE_MAX = 900
+WORKSPACE_Z = 300
+
+
+class SketchPath:
+    """
+    A single extracted path stored as a contiguous (N, 2) int32 point array. Closed paths
+    (contour outlines) end back at their first point, which is not repeated in points.
+    dense optionally holds the traced points before simplification (points are a subset of
+    them), used where the shape matters more than the vertex count, e.g. fitting arcs.
+    """
+    __slots__ = ('id', 'points', 'closed', 'dense')
+
+    def __init__(self, path_id, points, closed=True, dense=None):
+        self.id = path_id
+        self.points = np.ascontiguousarray(points, dtype=np.int32).reshape(-1, 2)
+        self.closed = closed
+        self.dense = None if dense is None else np.ascontiguousarray(dense, dtype=np.int32).reshape(-1, 2)
+
+    def __setstate__(self, state):
+        # Paths pickled before dense points were kept (e.g. in an on-disk result cache)
+        _, slots = state
+        self.dense = None
+        for name, value in slots.items():
+            setattr(self, name, value)
+
+    @property
+    def detail(self):
+        """
+        The dense points if kept, else the simplified points
+        """
+        return self.points if self.dense is None else self.dense
+
+    def rotated(self, index):
+        """
+        The closed path starting at points[index] (its dense points rotated to match)
+        """
+        dense = self.dense
+        if dense is not None and len(dense):
+            offset = dense - self.points[index]
+            start = int(np.argmin(np.einsum('ij,ij->i', offset, offset)))
+            dense = np.roll(dense, -start, axis=0)
+        return SketchPath(self.id, np.roll(self.points, -index, axis=0), self.closed, dense)
+
+    def reversed(self):
+        dense = None if self.dense is None else self.dense[::-1]
+        return SketchPath(self.id, self.points[::-1], self.closed, dense)
+
+    @property
+    def length(self):
+        return len(self.points)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __getitem__(self, key):
+        # Dict-compatible view so existing path['points'] / path['id'] access keeps working
+        if key == 'id':
+            return self.id
+        if key == 'length':
+            return self.length
+        if key == 'points':
+            return [{'x': x, 'y': y} for x, y in self.points.tolist()]
+        raise KeyError(key)
+
+    def __repr__(self):
+        return f"SketchPath(id={self.id}, length={self.length})"
+
+    def to_dict(self):
+        """
+        Plain dict representation (JSON serializable, used for the session)
+        """
+        return {
+            'id': self.id,
+            'points': self['points'],
+            'length': self.length,
+            'closed': self.closed
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        points = np.array([(p['x'], p['y']) for p in data['points']], dtype=np.int32)
+        return cls(data['id'], points, data.get('closed', True))
+
+    @classmethod
+    def coerce(cls, path):
+        """
+        Accept either a SketchPath or its dict representation
+        """
+        if isinstance(path, cls):
+            return path
+        return cls.from_dict(path)
+
+
+class SketchPaths(list):
+    """
+    List of SketchPath objects that also remembers the full-resolution (width, height)
+    of the image they were extracted from, and the travel report when they were reordered
+    """
+
+    def __init__(self, paths=(), image_size=None, travel=None):
+        super().__init__(paths)
+        self.image_size = image_size
+        self.travel = travel
+
+
+def canvas_size_of(paths, canvas_size=None):
+    """
+    Canvas size for coordinate conversion: explicit value, else the source image size
+    """
+    if canvas_size is not None:
+        return canvas_size
+    return getattr(paths, 'image_size', None) or DEFAULT_CANVAS_SIZE
+
+
+def canvas_calibration(canvas_size):
+    """
+    Default calibration: the canvas scaled onto the workspace range at the default Z height
+    """
+    # Assuming the robot workspace is 1000mm x 1000mm x 1000mm
+    return WorkspaceCalibration.from_canvas(canvas_size, WORKSPACE_MIN, WORKSPACE_MAX, z=WORKSPACE_Z)
+
+
+def paths_to_coordinates(paths, canvas_size=None, calibration=None):
+    """
+    Convert path points to KRL coordinates: one (N, 3) X/Y/Z array per path, using the
+    given WorkspaceCalibration or else the canvas scaled onto the default workspace
+    """
+    if calibration is None:
+        calibration = canvas_calibration(canvas_size_of(paths, canvas_size))
+    return [calibration.apply(SketchPath.coerce(path).points) for path in paths]
@@ -0,0 +1,306 @@
+import math
+
+import numpy as np
+
+from utils.path_data import SketchPath, SketchPaths, canvas_calibration, canvas_size_of
+from utils.spatial_index import PointGrid
+
+# Candidate paths considered per path by the 2-opt / Or-opt moves
+NEIGHBOURS = 8
+MAX_PASSES = 10
+# Stop improving once a pass shortens the travel by less than this fraction
+MIN_PASS_GAIN = 0.005
+OR_OPT_LENGTHS = (1, 2, 3)
+
+
+class _Tour:
+    """
+    Visiting order of the paths with the entry and exit point (in mm) of each one
+    """
+
+    def __init__(self, points, closed, start):
+        self.points = points
+        # Plain lists: the moves evaluate millions of distances between single points
+        self.vertices = [path_points.tolist() for path_points in points]
+        self.closed = closed
+        self.start = start.tolist()
+        self.order = []
+        self.entry = {}
+        self.exit = {}
+
+    def set_entry(self, k, vertex):
+        points = self.points[k]
+        if self.closed[k]:
+            self.entry[k] = self.exit[k] = vertex
+        else:
+            self.entry[k] = vertex
+            self.exit[k] = len(points) - 1 if vertex == 0 else 0
+
+    def flip(self, k):
+        # Closed paths leave where they entered, so only open paths change direction
+        if not self.closed[k]:
+            self.entry[k], self.exit[k] = self.exit[k], self.entry[k]
+
+    def entry_point(self, k):
+        return self.vertices[k][self.entry[k]]
+
+    def exit_point(self, k):
+        return self.vertices[k][self.exit[k]]
+
+    def exit_before(self, i):
+        return self.start if i == 0 else self.exit_point(self.order[i - 1])
+
+    def travel(self):
+        total = 0.0
+        position = self.start
+        for k in self.order:
+            total += _distance(position, self.entry_point(k))
+            position = self.exit_point(k)
+        return total
+
+
+def _distance(a, b):
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def travel_distance(paths, canvas_size=None, start=(0, 0), calibration=None):
+    """
+    Estimated pen-up travel (mm) when the paths are drawn in the given order, each from its
+    first point, starting at pixel start
+    """
+    if calibration is None:
+        calibration = canvas_calibration(canvas_size_of(paths, canvas_size))
+    position = calibration.apply(start)[0, :2]
+    total = 0.0
+    for path in paths:
+        path = SketchPath.coerce(path)
+        if not len(path):
+            continue
+        ends = calibration.apply(path.points[[0, -1]])[:, :2]
+        total += _distance(position, ends[0])
+        position = ends[0] if path.closed else ends[1]
+    return total
+
+
+def _nearest_neighbour(tour, grid, owners, ranges):
+    position = tour.start
+    for _ in range(len(tour.points)):
+        found = grid.nearest(position, 1)
+        if not found:
+            break
+        k = int(owners[found[0]])
+        offset = int(found[0] - ranges[k][0])
+        # Open paths only offer their two ends as candidates
+        if not tour.closed[k] and offset:
+            offset = len(tour.points[k]) - 1
+        tour.set_entry(k, offset)
+        tour.order.append(k)
+        grid.deactivate(np.arange(*ranges[k]))
+        position = tour.exit_point(k)
+
+
+def _neighbour_lists(tour):
+    """
+    The NEIGHBOURS closest other paths to the endpoints each path currently uses
+    """
+    endpoints = []
+    endpoint_owners = []
+    for k in range(len(tour.points)):
+        for vertex in {tour.entry[k], tour.exit[k]}:
+            endpoints.append(tour.points[k][vertex])
+            endpoint_owners.append(k)
+    grid = PointGrid(np.array(endpoints))
+    endpoint_owners = np.array(endpoint_owners)
+
+    neighbours = {}
+    for index, k in enumerate(endpoint_owners.tolist()):
+        found = grid.nearest(endpoints[index], 2 * NEIGHBOURS + 2)
+        near = neighbours.setdefault(k, [])
+        for other in endpoint_owners[found].tolist():
+            if other != k and other not in near and len(near) < NEIGHBOURS:
+                near.append(other)
+    return neighbours
+
+
+def _two_opt(tour, neighbours):
+    """
+    Reverse a run of paths when its reversed version connects more cheaply. Only runs that
+    end at a neighbour of the path before them are tried.
+    """
+    improved = False
+    order = tour.order
+    position = {k: i for i, k in enumerate(order)}
+    n = len(order)
+    for i in range(n):
+        prev = tour.exit_before(i)
+        candidates = neighbours.get(order[i - 1], ()) if i > 0 else ()
+        for c in candidates:
+            j = position[c]
+            if j <= i:
+                continue
+            first, last = order[i], order[j]
+            old = _distance(prev, tour.entry_point(first))
+            new = _distance(prev, tour.exit_point(last))
+            if j + 1 < n:
+                following = tour.entry_point(order[j + 1])
+                old += _distance(tour.exit_point(last), following)
+                new += _distance(tour.entry_point(first), following)
+            if new < old - 1e-9:
+                order[i:j + 1] = order[i:j + 1][::-1]
+                for index in range(i, j + 1):
+                    tour.flip(order[index])
+                    position[order[index]] = index
+                improved = True
+                prev = tour.exit_before(i)
+    return improved
+
+
+def _or_opt(tour, neighbours):
+    """
+    Move a run of 1-3 paths (optionally reversed) next to one of its neighbours
+    """
+    improved = False
+    order = tour.order
+    position = {k: index for index, k in enumerate(order)}
+    i = 0
+    while i < len(order):
+        moved = False
+        for length in OR_OPT_LENGTHS:
+            j = i + length - 1
+            if j >= len(order):
+                break
+            segment = order[i:j + 1]
+            prev = tour.exit_before(i)
+            following = tour.entry_point(order[j + 1]) if j + 1 < len(order) else None
+            gain = _distance(prev, tour.entry_point(segment[0]))
+            if following is not None:
+                gain += _distance(tour.exit_point(segment[-1]), following) - _distance(prev, following)
+            if gain <= 1e-9:
+                # Inserting elsewhere never costs less than nothing
+                continue
+
+            best = None
+            for c in set(neighbours.get(segment[0], ())) | set(neighbours.get(segment[-1], ())):
+                if i <= position[c] <= j:
+                    continue
+                # Insert after c (position counted without the segment), in the current or
+                # reversed direction
+                after = position[c] if position[c] < i else position[c] - length
+                successor = position[c] + 1
+                if successor == i:
+                    successor = j + 1
+                anchor = tour.exit_point(c)
+                succ = tour.entry_point(order[successor]) if successor < len(order) else None
+                for reverse in (False, True):
+                    head = tour.exit_point(segment[-1]) if reverse else tour.entry_point(segment[0])
+                    tail = tour.entry_point(segment[0]) if reverse else tour.exit_point(segment[-1])
+                    cost = _distance(anchor, head)
+                    if succ is not None:
+                        cost += _distance(tail, succ) - _distance(anchor, succ)
+                    if cost < gain - 1e-9 and (best is None or cost < best[0]):
+                        best = (cost, after, reverse)
+            if best is not None:
+                _, after, reverse = best
+                if reverse:
+                    segment = segment[::-1]
+                    for k in segment:
+                        tour.flip(k)
+                rest = order[:i] + order[j + 1:]
+                order[:] = rest[:after + 1] + segment + rest[after + 1:]
+                position = {k: index for index, k in enumerate(order)}
+                improved = moved = True
+                break
+        if not moved:
+            i += 1
+    return improved
+
+
+def _choose_entries(tour):
+    """
+    Pick the best start vertex of every closed path and direction of every open path for
+    the neighbours it ended up between
+    """
+    order = tour.order
+    for i, k in enumerate(order):
+        prev = tour.exit_before(i)
+        following = tour.entry_point(order[i + 1]) if i + 1 < len(order) else None
+        points = tour.points[k]
+        if tour.closed[k]:
+            cost = np.hypot(*(points - prev).T)
+            if following is not None:
+                cost += np.hypot(*(points - following).T)
+            tour.set_entry(k, int(np.argmin(cost)))
+        else:
+            first, last = tour.vertices[k][0], tour.vertices[k][-1]
+            forward = _distance(prev, first)
+            backward = _distance(prev, last)
+            if following is not None:
+                forward += _distance(last, following)
+                backward += _distance(first, following)
+            tour.set_entry(k, 0 if forward <= backward else len(points) - 1)
+
+
+def order_paths(paths, canvas_size=None, start=(0, 0), improve=True, calibration=None):
+    """
+    Reorder paths to reduce pen-up travel between them: nearest-neighbour tour from the
+    pixel start, improved by 2-opt and Or-opt moves over spatial neighbour lists. Closed
+    paths are rotated to start at their best vertex and open paths may be reversed.
+    Returns (ordered SketchPaths, report) where report holds the estimated travel in mm
+    before and after ordering (also kept as the travel attribute of the result); the
+    paths are returned as given when no shorter order is found, so travel never grows.
+    """
+    image_size = getattr(paths, 'image_size', None)
+    if calibration is None:
+        calibration = canvas_calibration(canvas_size_of(paths, canvas_size))
+    paths = [SketchPath.coerce(path) for path in paths]
+    before = travel_distance(paths, start=start, calibration=calibration)
+    drawable = [k for k, path in enumerate(paths) if len(path)]
+    if len(drawable) < 2:
+        report = {'paths': len(paths), 'before': before, 'after': before}
+        return SketchPaths(paths, image_size, report), report
+
+    points = [calibration.apply(paths[k].points)[:, :2] for k in drawable]
+    closed = [paths[k].closed for k in drawable]
+    tour = _Tour(points, closed, calibration.apply(start)[0, :2])
+
+    # Candidate entry points: every vertex of closed paths, both ends of open ones
+    candidates, owners, ranges = [], [], []
+    for k, (path_points, is_closed) in enumerate(zip(points, closed)):
+        entries = path_points if is_closed else path_points[[0, -1]]
+        ranges.append((len(owners), len(owners) + len(entries)))
+        candidates.append(entries)
+        owners.extend([k] * len(entries))
+    owners = np.array(owners)
+    grid = PointGrid(np.concatenate(candidates))
+    _nearest_neighbour(tour, grid, owners, ranges)
+
+    if improve:
+        neighbours = _neighbour_lists(tour)
+        travel = tour.travel()
+        for _ in range(MAX_PASSES):
+            improved = _two_opt(tour, neighbours)
+            improved = _or_opt(tour, neighbours) or improved
+            _choose_entries(tour)
+            previous, travel = travel, tour.travel()
+            if not improved or previous - travel < MIN_PASS_GAIN * previous:
+                break
+    else:
+        _choose_entries(tour)
+    if tour.travel() >= before:
+        # Nothing better than the given order was found (e.g. it was ordered already)
+        report = {'paths': len(paths), 'before': before, 'after': before}
+        return SketchPaths(paths, image_size, report), report
+
+    ordered = SketchPaths(image_size=image_size)
+    for k in tour.order:
+        path = paths[drawable[k]]
+        if path.closed:
+            ordered.append(path.rotated(tour.entry[k]))
+        elif tour.entry[k] != 0:
+            ordered.append(path.reversed())
+        else:
+            ordered.append(path)
+    # Empty paths have nothing to draw; keep them at the end so no path is lost
+    ordered.extend(path for path in paths if not len(path))
+    ordered.travel = {'paths': len(paths), 'before': before, 'after': tour.travel()}
+    return ordered, ordered.travel
@@ -0,0 +1,92 @@
+from utils.image_processor import SketchProcessor
+from utils.krl_generator import DEFAULT_TOLERANCE, KRLGenerator
+from utils.krl_modules import DEFAULT_CHUNK_SIZE
+from utils.metrics import PipelineMetrics
+
+
+class SketchPipeline:
+    def __init__(self, processor=None, generator=None, tolerance=DEFAULT_TOLERANCE, decimation='rdp',
+                 calibration=None, **processor_options):
+        """
+        The sketch -> KRL pipeline shared by the Flask app, the Streamlit app and the batch CLI.
+        Stages are configured through the SketchProcessor options (threshold, blur_kernel,
+        morph_kernel, epsilon_factor, simplify_tolerance, reduce_factor, tile_size, cache, ...);
+        a blur_kernel or morph_kernel of 0 disables that stage. tolerance (mm) and decimation
+        configure the "trajectory" interpretation of the generator; calibration (a
+        WorkspaceCalibration) maps image pixels onto the robot base frame.
+        """
+        self.processor = processor or SketchProcessor(**processor_options)
+        self.generator = generator or KRLGenerator(tolerance=tolerance, decimation=decimation,
+                                                    calibration=calibration)
+
+    def process_bytes(self, image_bytes, filename='sketch.png', metrics=None):
+        """
+        Extract paths from encoded image bytes; returns (preview filename, paths, preview bytes)
+        """
+        return self.processor.process_sketch_bytes(image_bytes, filename, metrics)
+
+    def process_file(self, filepath, metrics=None):
+        """
+        Extract paths from an image file, writing the preview to the processor's output_dir
+        """
+        return self.processor.process_sketch(filepath, metrics)
+
+    def warm_up(self, metrics=None):
+        """
+        Run a synthetic sketch through image processing and every motion type and
+        interpretation of the generator once, e.g. at server startup so the first request
+        does not pay for imports and first calls; returns the PipelineMetrics of the run
+        """
+        if metrics is None:
+            metrics = PipelineMetrics()
+        paths = self.processor.warm_up(metrics)
+        with metrics.stage('generate'):
+            for interpretation in ('coordinates', 'trajectory'):
+                for motion_type in ('PTP', 'LIN', 'CIRC', 'SPLINE', 'AUTO'):
+                    self.generator.generate_program('HOME', [motion_type] * len(paths), interpretation, 'no',
+                                                    paths)
+        metrics.count('paths', len(paths))
+        return metrics
+
+    def process_strokes(self, strokes, canvas_size, metrics=None):
+        """
+        Paths straight from strokes drawn on a canvas, without rendering or tracing an image
+        """
+        return self.processor.process_strokes(strokes, canvas_size, metrics)
+
+    def index_paths(self, paths):
+        return self.processor.index_paths(paths)
+
+    def to_coordinates(self, paths, canvas_size=None):
+        return self.generator.paths_to_coordinates(paths, canvas_size)
+
+    def iter_program(self, start_position, motion_types, interpretation, clarifications, paths, canvas_size=None):
+        return self.generator.iter_program(start_position, motion_types, interpretation, clarifications,
+                                           paths, canvas_size)
+
+    def generate(self, start_position, motion_types, interpretation, clarifications, paths, canvas_size=None):
+        return self.generator.generate_program(start_position, motion_types, interpretation, clarifications,
+                                               paths, canvas_size)
+
+    def build_program(self, start_position, motion_types, interpretation, clarifications, paths,
+                      canvas_size=None, previous=None):
+        """
+        Incrementally (re)build a KRLProgram; use program.diff(previous) for the changed lines
+        """
+        return self.generator.build_program(start_position, motion_types, interpretation, clarifications,
+                                            paths, canvas_size, previous)
+
+    def build_modules(self, name, start_position, motion_types, interpretation, clarifications, paths,
+                      canvas_size=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        return self.generator.build_modules(name, start_position, motion_types, interpretation, clarifications,
+                                            paths, canvas_size, chunk_size)
+
+    def write_modules(self, directory, name, start_position, motion_types, interpretation, clarifications,
+                      paths, canvas_size=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        return self.generator.write_modules(directory, name, start_position, motion_types, interpretation,
+                                            clarifications, paths, canvas_size, chunk_size)
+
+    def write_program(self, f, start_position, motion_types, interpretation, clarifications, paths,
+                      canvas_size=None):
+        self.generator.write_program(f, start_position, motion_types, interpretation, clarifications,
+                                     paths, canvas_size)
@@ -0,0 +1,184 @@
+import numpy as np
+
+LINE = 'LIN'
+ARC = 'CIRC'
+SPLINE = 'SPL'
+
+# Arcs are kept to at most half a circle (one CIRC cannot close a full circle) and must
+# turn gradually between consecutive points, so polygon corners are not mistaken for arcs
+MAX_ARC_SWEEP = np.pi
+MAX_ARC_STEP = np.radians(60)
+MIN_ARC_POINTS = 4
+# An arc must reach this many times further than a straight line from the same point, or
+# a line running into a rounded corner is bent into a flat arc to cover the corner too
+MIN_ARC_ADVANTAGE = 2
+
+# Runs of short straight segments that only bend slightly are smoothed into one spline
+SPLINE_MAX_TURN = np.radians(30)
+SPLINE_MIN_SEGMENTS = 3
+
+
+def resample(points, closed=False, step=1.0):
+    """
+    Insert evenly spaced points into segments longer than step (contour tracing only keeps
+    the ends of straight runs)
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) < 2:
+        return points
+    ring = np.concatenate((points, points[:1])) if closed else points
+    delta = np.diff(ring, axis=0)
+    counts = np.maximum(np.ceil(np.linalg.norm(delta, axis=1) / step).astype(int), 1)
+    segment = np.repeat(np.arange(len(counts)), counts)
+    t = (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)) / counts[segment]
+    resampled = ring[segment] + t[:, None] * delta[segment]
+    return resampled if closed else np.concatenate((resampled, points[-1:]))
+
+
+def smooth_polyline(points, closed=False, passes=2):
+    """
+    Smooth traced pixel points, resampled to one pixel steps, with a [1, 2, 1] / 4 kernel so
+    the stair-steps of the pixel grid do not break up lines and arcs; open polylines keep
+    their end points
+    """
+    points = resample(points, closed)
+    if len(points) < 3:
+        return points
+    for _ in range(passes):
+        if closed:
+            points = (np.roll(points, 1, axis=0) + 2 * points + np.roll(points, -1, axis=0)) / 4
+        else:
+            smoothed = points.copy()
+            smoothed[1:-1] = (points[:-2] + 2 * points[1:-1] + points[2:]) / 4
+            points = smoothed
+    return points
+
+
+def line_deviation(points):
+    """
+    Largest distance of the points to the chord between the first and last point
+    """
+    start, end = points[0], points[-1]
+    chord = end - start
+    length = np.hypot(chord[0], chord[1])
+    offset = points - start
+    if length == 0:
+        return np.hypot(offset[:, 0], offset[:, 1]).max()
+    return np.abs(chord[0] * offset[:, 1] - chord[1] * offset[:, 0]).max() / length
+
+
+def fit_circle(points):
+    """
+    Least-squares (Kasa) circle through the points: returns (center, radius, max residual)
+    """
+    x, y = points[:, 0], points[:, 1]
+    A = np.column_stack((x, y, np.ones(len(points))))
+    (a, b, c), *_ = np.linalg.lstsq(A, x * x + y * y, rcond=None)
+    center = np.array([a / 2, b / 2])
+    radius = np.sqrt(max(c + center @ center, 0.0))
+    residual = np.abs(np.hypot(x - center[0], y - center[1]) - radius).max()
+    return center, radius, residual
+
+
+def arc_fits(points, tolerance):
+    if len(points) < MIN_ARC_POINTS:
+        return False
+    center, radius, residual = fit_circle(points)
+    if residual > tolerance or not np.isfinite(radius):
+        return False
+    # Angular steps between consecutive points must all turn the same way and stay small
+    angles = np.arctan2(points[:, 1] - center[1], points[:, 0] - center[0])
+    steps = (np.diff(angles) + np.pi) % (2 * np.pi) - np.pi
+    if not (np.all(steps > 0) or np.all(steps < 0)):
+        return False
+    return np.abs(steps).max() <= MAX_ARC_STEP and abs(steps.sum()) <= MAX_ARC_SWEEP
+
+
+def _grow(points, start, first_end, fits):
+    """
+    Largest end index such that points[start:end + 1] still fits: exponential search for an
+    upper bound followed by a binary search, so each primitive costs O(log n) fits
+    """
+    last = len(points) - 1
+    if first_end > last or not fits(points[start:first_end + 1]):
+        return start
+    good, step = first_end, 1
+    while good + step <= last and fits(points[start:good + step + 1]):
+        good += step
+        step *= 2
+    bad = min(good + step, last + 1)
+    while bad - good > 1:
+        mid = (good + bad) // 2
+        if fits(points[start:mid + 1]):
+            good = mid
+        else:
+            bad = mid
+    return good
+
+
+def spline_bulge(points):
+    """
+    How far a spline through the points strays from the straight segment between each pair
+    of neighbours, estimated at the middle of a Catmull-Rom segment (end points repeated)
+    """
+    padded = np.concatenate((points[:1], points, points[-1:]))
+    return np.linalg.norm(padded[:-3] - padded[1:-2] - padded[2:-1] + padded[3:], axis=1) / 16
+
+
+def _merge_splines(segments, points, tolerance):
+    """
+    Replace runs of single-step lines with small turns between them by spline segments;
+    steps the spline would bulge away from by more than tolerance stay lines
+    """
+    bulge = spline_bulge(points)
+    merged = []
+    run = []
+
+    def flush():
+        if len(run) >= SPLINE_MIN_SEGMENTS:
+            merged.append((SPLINE, run[0][1], run[-1][2]))
+        else:
+            merged.extend(run)
+        run.clear()
+
+    for segment in segments:
+        kind, start, end = segment
+        if kind != LINE or end - start != 1 or bulge[start] > tolerance:
+            flush()
+            merged.append(segment)
+            continue
+        if run:
+            before = points[start] - points[run[-1][1]]
+            after = points[end] - points[start]
+            turn = abs(np.arctan2(before[0] * after[1] - before[1] * after[0], before @ after))
+            if turn > SPLINE_MAX_TURN:
+                flush()
+        run.append(segment)
+    flush()
+    return merged
+
+
+def fit_primitives(points, tolerance, closed=False):
+    """
+    Segment an (N, 2+) polyline into straight lines, circular arcs and smooth spline runs,
+    each within tolerance of the points it replaces. Returns (kind, start, end) index
+    triples over the points (closed paths get their first point appended as the last one)
+    together with those points.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if closed and len(points) > 1:
+        points = np.concatenate((points, points[:1]))
+    xy = points[:, :2]
+
+    segments = []
+    start = 0
+    while start < len(points) - 1:
+        line_end = _grow(xy, start, start + 1, lambda p: line_deviation(p) <= tolerance)
+        arc_end = _grow(xy, start, start + MIN_ARC_POINTS - 1, lambda p: arc_fits(p, tolerance))
+        if arc_end - start > MIN_ARC_ADVANTAGE * (line_end - start):
+            segments.append((ARC, start, arc_end))
+            start = arc_end
+        else:
+            segments.append((LINE, start, line_end))
+            start = line_end
+    return _merge_splines(segments, xy, tolerance), points
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    def __init__(self, max_entries=128, cache_dir=None):
+        """
+        LRU cache for processed sketch results with an optional on-disk tier. Entries are
+        kept pickled in both tiers, so every get returns a fresh copy that the caller may
+        modify without changing the cached result.
+        """
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(image_bytes, params):
+        """
+        Build a cache key from the raw image bytes and the pipeline parameters
+        """
+        digest = hashlib.sha256(image_bytes)
+        digest.update(repr(sorted(params.items())).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if data is not None:
+            return pickle.loads(data)
+
+        data = self._load_from_disk(key)
+        try:
+            value = None if data is None else pickle.loads(data)
+        except (pickle.UnpicklingError, EOFError):
+            value = None
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, data)
+        return value
+
+    def put(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._store(key, data)
+        self._save_to_disk(key, data)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def _store(self, key, data):
+        # Caller must hold the lock
+        self._entries[key] = data
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def _load_from_disk(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _save_to_disk(self, key, data):
+        if not self.cache_dir:
+            return
+        # Write to a temporary file first so readers never see a partial entry
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
@@ -0,0 +1,162 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+class MemorySessionStore:
+    def __init__(self, ttl=3600):
+        """
+        In-process session data store; entries expire ttl seconds after they were last read
+        or written
+        """
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def new_key(self):
+        return uuid.uuid4().hex
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            now = time.time()
+            expires, value = entry
+            if expires < now:
+                del self._data[key]
+                return None
+            self._data[key] = (now + self.ttl, value)
+            return value
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._data[key] = (now + self.ttl, value)
+            self._evict_expired(now)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def _evict_expired(self, now):
+        # Caller must hold the lock
+        expired = [key for key, (expires, _) in self._data.items() if expires < now]
+        for key in expired:
+            del self._data[key]
+
+
+class SQLiteSessionStore:
+    def __init__(self, path, ttl=3600):
+        """
+        Session data store kept in a local SQLite file, so sessions survive restarts;
+        entries expire ttl seconds after they were last read or written
+        """
+        self.path = path
+        self.ttl = ttl
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions ("
+                         "key TEXT PRIMARY KEY, expires REAL NOT NULL, value BLOB NOT NULL)")
+
+    def _connect(self):
+        # One short-lived connection per call keeps the store safe across threads
+        return sqlite3.connect(self.path, timeout=10)
+
+    def new_key(self):
+        return uuid.uuid4().hex
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            # Refresh the expiry first, so the read and the refresh are one transaction
+            refreshed = conn.execute("UPDATE sessions SET expires = ? WHERE key = ? AND expires >= ?",
+                                     (now + self.ttl, key, now)).rowcount
+            row = conn.execute("SELECT value FROM sessions WHERE key = ?",
+                               (key,)).fetchone() if refreshed else None
+        if row is None:
+            return None
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO sessions (key, expires, value) VALUES (?, ?, ?)",
+                         (key, now + self.ttl, blob))
+            conn.execute("DELETE FROM sessions WHERE expires < ?", (now,))
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE key = ?", (key,))
+
+
+def create_session_store(kind='memory', path=None, ttl=3600):
+    """
+    Build the session store selected by configuration ('memory' or 'sqlite')
+    """
+    if kind == 'memory':
+        return MemorySessionStore(ttl=ttl)
+    if kind == 'sqlite':
+        return SQLiteSessionStore(path or 'sessions.db', ttl=ttl)
+    raise ValueError(f"Unknown session store: {kind}")
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, key=None, new=False):
+        def on_update(session):
+            session.modified = True
+
+        super().__init__(initial, on_update)
+        self.key = key
+        self.new = new
+        self.modified = False
+
+
+class ServerSideSessionInterface(SessionInterface):
+    def __init__(self, store):
+        """
+        Flask session interface keeping session data in a store; the cookie only holds its key
+        """
+        self.store = store
+
+    def open_session(self, app, request):
+        key = request.cookies.get(self.get_cookie_name(app))
+        if key:
+            data = self.store.get(key)
+            if data is not None:
+                return ServerSideSession(data, key=key)
+        return ServerSideSession(key=self.store.new_key(), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                self.store.delete(session.key)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not session.modified and not session.new:
+            return
+
+        self.store.set(session.key, dict(session))
+        response.set_cookie(name, session.key,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain,
+                            path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
@@ -0,0 +1,298 @@
+import cv2
+import numpy as np
+
+from utils.spatial_index import join_chains
+
+# Neighbour offsets (dy, dx) P2..P9, clockwise from north
+OFFSETS = np.array([(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)])
+
+# Branches shorter than this (pixels) with a free end are thinning artifacts at stroke ends
+SPUR_LENGTH = 10
+# Branches meeting at a junction are joined when they continue in roughly opposite directions
+MAX_JOIN_COS = -0.5
+# How far (pixels) into a branch its direction at a junction is measured
+DIRECTION_SPAN = 8
+
+
+def _transitions(neighbours):
+    """
+    Number of 0 -> 1 transitions walking once around the 8-neighbourhood (neighbours
+    holds the values of P2..P9 along its first axis)
+    """
+    return ((neighbours == 0) & (np.roll(neighbours, -1, axis=0) == 1)).sum(axis=0)
+
+
+def _removal_tables():
+    """
+    Zhang-Suen removal decision of both sub-iterations for each of the 256 neighbourhood
+    codes (bit k set when neighbour P(k+2) is foreground)
+    """
+    bits = (np.arange(256)[:, None] >> np.arange(8)) & 1
+    p2, p3, p4, p5, p6, p7, p8, p9 = bits.T
+    count = bits.sum(axis=1)
+    removable = (count >= 2) & (count <= 6) & (_transitions(bits.T) == 1)
+    return (removable & (p2 * p4 * p6 == 0) & (p4 * p6 * p8 == 0),
+            removable & (p2 * p4 * p8 == 0) & (p2 * p6 * p8 == 0))
+
+
+REMOVAL_TABLES = _removal_tables()
+# Correlation kernel giving every pixel the code of its neighbourhood
+CODE_KERNEL = np.zeros((3, 3), dtype=np.float32)
+CODE_KERNEL[OFFSETS[:, 0] + 1, OFFSETS[:, 1] + 1] = 1 << np.arange(8)
+
+
+def _unique(flat):
+    """
+    Sorted unique values; sorting beats the hash-based np.unique on large index arrays
+    """
+    flat = np.sort(flat)
+    keep = np.empty(len(flat), dtype=bool)
+    keep[:1] = True
+    np.not_equal(flat[1:], flat[:-1], out=keep[1:])
+    return flat[keep]
+
+
+def thin(binary):
+    """
+    One pixel wide skeleton of a binary image (Zhang-Suen thinning). Uses OpenCV's contrib
+    implementation when available. Otherwise the neighbourhood code of every pixel is
+    computed once and updated as pixels are removed, and each sub-iteration only looks up
+    the pixels next to the previous removals in REMOVAL_TABLES, so the cost follows the
+    number of removed pixels rather than image area times stroke width. Pixels that both
+    sub-iterations kept are not looked at again until one of their neighbours goes, so
+    finished parts of the skeleton cost nothing while thicker strokes are still thinned.
+    """
+    if hasattr(cv2, 'ximgproc'):
+        return cv2.ximgproc.thinning(binary, thinningType=cv2.ximgproc.THINNING_ZHANGSUEN)
+
+    image = np.pad(binary > 0, 1).view(np.uint8)
+    codes = cv2.filter2D(image, -1, CODE_KERNEL, borderType=cv2.BORDER_CONSTANT)
+    # Flat views and neighbour offsets; int32 indices (with room for the "checked" bit
+    # below) halve the memory traffic of large scans
+    index_type = np.int32 if image.size < 2 ** 30 else np.int64
+    flat_image, flat_codes = image.ravel(), codes.ravel()
+    offsets = (OFFSETS[:, 0] * image.shape[1] + OFFSETS[:, 1]).astype(index_type)
+    # Only foreground pixels touching the background can be removed at first
+    pixels = np.flatnonzero(image & (codes != 255)).astype(index_type)
+    checked = np.zeros(len(pixels), dtype=bool)
+
+    step = 0
+    # Stop once every pixel left has been kept by both sub-iterations
+    while len(pixels):
+        remove = REMOVAL_TABLES[step][flat_codes[pixels]]
+        removed = pixels[remove]
+        flat_image[removed] = 0
+        # A removed pixel is neighbour (k + 4) % 8 of its neighbour k
+        for k, offset in enumerate(offsets):
+            flat_codes[removed + offset] &= ~np.uint8(1 << ((k + 4) % 8))
+
+        # The next sub-iteration looks at the neighbours of the removed pixels (pixels only
+        # become removable when a neighbour goes) and at the survivors of this one that the
+        # other sub-iteration has not checked yet. Sorting index * 2 + checked puts the
+        # unchecked copy of a pixel first.
+        around = (removed + offsets[:, None]).ravel()
+        keys = np.sort(np.concatenate((around[flat_image[around] == 1] * 2,
+                                       pixels[~remove & ~checked] * 2 + 1)))
+        first = np.empty(len(keys), dtype=bool)
+        first[:1] = True
+        np.not_equal(keys[1:] >> 1, keys[:-1] >> 1, out=first[1:])
+        pixels, checked = keys[first] >> 1, (keys[first] & 1).astype(bool)
+        step = 1 - step
+
+    return image[1:-1, 1:-1] * 255
+
+
+def _ordered_chain(outline, is_end):
+    """
+    Pixels of a one pixel wide chain in drawing order, as (x, y) rows, and whether it loops.
+    The outline OpenCV traces around a thin chain runs along it and back, so an open chain
+    is the stretch of the outline between its two endpoints (flagged by is_end).
+    """
+    ends = np.flatnonzero(is_end)
+    if not len(ends):
+        return outline, True
+
+    outline = np.roll(outline, -ends[0], axis=0)
+    stop = ends[1] - ends[0] if len(ends) > 1 else len(outline) // 2
+    return outline[:stop + 1], False
+
+
+def _clusters(flat, width):
+    """
+    8-connected clusters of a few pixels given by their sorted flat indices into an image
+    width pixels wide: labels from 1 in raster order of each cluster's first pixel, found
+    by spreading the smallest index through each cluster
+    """
+    neighbours = flat + (OFFSETS[:, 0] * width + OFFSETS[:, 1])[:, None]
+    position = np.minimum(np.searchsorted(flat, neighbours), len(flat) - 1)
+    linked = flat[position] == neighbours
+    pixel, other = np.nonzero(linked)[1], position[linked]
+    roots = np.arange(len(flat))
+    while True:
+        spread = roots.copy()
+        np.minimum.at(spread, pixel, roots[other])
+        if np.array_equal(spread, roots):
+            break
+        roots = spread
+    return np.unique(roots, return_inverse=True)[1] + 1
+
+
+def _branches(padded, junction, ys, xs):
+    """
+    Outlines of the branches left once the junction pixels (flat indices) are taken out of
+    the padded skeleton with pixels ys, xs, in raster order of their first pixel, and a
+    mask of the branch pixels with at most one neighbour
+    """
+    branches = padded.copy()
+    branches.ravel()[junction] = 0
+    branch = branches[ys, xs] == 1
+    ys, xs = ys[branch], xs[branch]
+    free = branches[ys + OFFSETS[:, :1], xs + OFFSETS[:, 1:]].sum(axis=0) <= 1
+    is_end = np.zeros_like(branches)
+    is_end[ys[free], xs[free]] = 1
+
+    # One outline per branch (the outer boundaries; holes are the inside of loops)
+    contours, hierarchy = cv2.findContours(branches, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_NONE)
+    outlines = [contour.reshape(-1, 2) for contour, links in zip(contours, hierarchy[0] if contours else ())
+                if links[3] < 0]
+    outlines.sort(key=lambda outline: (outline[0, 1], outline[0, 0]))
+    return outlines, is_end
+
+
+def _pair_branches(polylines, cluster_ends):
+    """
+    Link the branches meeting at each junction that continue each other most straightly
+    """
+    partner = {}
+    for centre, ends in cluster_ends.items():
+        if len(ends) < 2:
+            continue
+        directions = []
+        for index, end in ends:
+            points = polylines[index]
+            span = min(DIRECTION_SPAN, len(points) - 1)
+            inner = points[span] if end == 0 else points[-1 - span]
+            vector = (inner - np.asarray(centre)).astype(np.float64)
+            directions.append(vector / (np.hypot(*vector) or 1.0))
+        directions = np.array(directions)
+        cosines = directions @ directions.T
+        # Two branches form one stroke through the junction whatever the angle
+        limit = 1.0 if len(ends) == 2 else MAX_JOIN_COS
+        pairs = sorted((cosines[i, j], i, j) for i in range(len(ends)) for j in range(i + 1, len(ends)))
+        for cosine, i, j in pairs:
+            a = 2 * ends[i][0] + ends[i][1]
+            b = 2 * ends[j][0] + ends[j][1]
+            if cosine <= limit and a not in partner and b not in partner:
+                partner[a], partner[b] = b, a
+    return partner
+
+
+def trace_skeleton(skeleton, min_length=2):
+    """
+    Trace a skeleton into polylines. The skeleton is split at its junctions, short spurs
+    are pruned, and branches are rejoined through junctions where they continue each other
+    (both branches of a bend, the straight parts of a crossing). Returns (points, closed)
+    pairs with (N, 2) int32 x/y points.
+    """
+    # Padded so every skeleton pixel has eight neighbours; the skeleton is sparse, so
+    # everything works on its pixel list and traced outlines instead of whole-image labels
+    padded = np.pad(skeleton > 0, 1).view(np.uint8)
+    width = padded.shape[1]
+    ys, xs = np.nonzero(padded)
+    neighbours = padded[ys + OFFSETS[:, :1], xs + OFFSETS[:, 1:]]
+    # Junctions branch in three or more directions; staircase corners only count once.
+    # Their neighbours go with them, since those can still touch two branches diagonally.
+    branching = _transitions(neighbours) >= 3
+    junction_y = np.concatenate((ys[branching], (ys[branching] + OFFSETS[:, :1]).ravel()))
+    junction_x = np.concatenate((xs[branching], (xs[branching] + OFFSETS[:, 1:]).ravel()))
+    on_skeleton = padded[junction_y, junction_x] == 1
+    junction = _unique(junction_y[on_skeleton] * width + junction_x[on_skeleton])
+
+    # Thick strokes crossing at a shallow angle thin to a small blob in which no pixel
+    # branches three ways. A branch with more than two ends runs through such a blob, so
+    # the crowded pixels (three or more neighbours) along it are tried as junctions too,
+    # keeping the groups of them that three or more branches end at.
+    flat = ys * width + xs
+    crowded = flat[neighbours.sum(axis=0) >= 3]
+    window = np.append(OFFSETS[:, 0] * width + OFFSETS[:, 1], 0)
+
+    def touching(pixels, targets):
+        # Which of targets (sorted flat indices) each of the pixels is on or next to
+        near = (pixels + window[:, None]).ravel()
+        position = np.minimum(np.searchsorted(targets, near), len(targets) - 1)
+        hit = targets[position] == near
+        return np.tile(np.arange(len(pixels)), len(window))[hit], position[hit]
+
+    def branch_ends(junction):
+        # Flat indices of the branch pixels _branches would mark as ends, without drawing
+        # the branches
+        around = flat + window[:, None]
+        position = np.minimum(np.searchsorted(junction, around), len(junction) - 1)
+        taken = junction[position] == around
+        free = (neighbours * ~taken[:-1]).sum(axis=0) <= 1
+        return flat[free & ~taken[-1]]
+
+    while True:
+        outlines, is_end = _branches(padded, junction, ys, xs)
+        forked = [outline[:, 1] * width + outline[:, 0] for outline in outlines
+                  if is_end[outline[:, 1], outline[:, 0]].sum() > 2]
+        if not forked:
+            break
+        pixel, _ = touching(crowded, _unique(np.concatenate(forked)))
+        extra = np.setdiff1d(crowded[np.unique(pixel)], junction, assume_unique=True)
+        if not len(extra):
+            break
+        trial = _unique(np.concatenate((junction, extra)))
+        labels = _clusters(trial, width)
+        end, position = touching(branch_ends(trial), trial)
+        ends = np.bincount(np.unique(np.column_stack((labels[position], end)), axis=0)[:, 0],
+                           minlength=labels.max() + 1)
+        trusted = np.zeros(len(ends), dtype=bool)
+        trusted[labels[np.searchsorted(trial, junction)]] = True
+        accepted = trial[trusted[labels] | (ends[labels] >= 3)]
+        if len(accepted) == len(junction):
+            break
+        junction = accepted
+
+    # Junction clusters, their centres, and a one pixel margin around them for looking up
+    # branch ends
+    cluster_labels = _clusters(junction, width) if len(junction) else junction
+    junction_y, junction_x = np.divmod(junction, width)
+    sizes = np.maximum(np.bincount(cluster_labels), 1)
+    centroids = np.column_stack((np.bincount(cluster_labels, junction_x - 1) / sizes,
+                                 np.bincount(cluster_labels, junction_y - 1) / sizes))
+
+    def near_junction(point):
+        if not len(junction):
+            return 0
+        around = (point[1] + 1) * width + point[0] + 1 + window
+        position = np.minimum(np.searchsorted(junction, around), len(junction) - 1)
+        return cluster_labels[position][junction[position] == around].max(initial=0)
+
+    traced = []
+    polylines = []
+    cluster_ends = {}
+    for outline in outlines:
+        points, closed = _ordered_chain(outline, is_end[outline[:, 1], outline[:, 0]] == 1)
+        points = (points - 1).astype(np.int32)
+        if closed:
+            traced.append((points, True))
+            continue
+
+        clusters = (near_junction(points[0]), near_junction(points[-1]))
+        # Spurs and specks: short branches with a free end, or looping back into the junction
+        # they leave
+        if not all(clusters) or clusters[0] == clusters[1]:
+            if len(points) < (SPUR_LENGTH if any(clusters) else min_length):
+                continue
+        # Extend the ends to the centre of the junction they stop at
+        for end, cluster in enumerate(clusters):
+            if cluster:
+                centre = tuple(np.round(centroids[cluster]).astype(np.int32).tolist())
+                cluster_ends.setdefault(centre, []).append((len(polylines), end))
+                points = np.vstack((centre, points)) if end == 0 else np.vstack((points, centre))
+        polylines.append(points)
+
+    partner = _pair_branches(polylines, cluster_ends)
+    traced.extend((points.astype(np.int32), closed) for _, points, closed in join_chains(polylines, partner))
+    return traced
@@ -0,0 +1,301 @@
+import heapq
+import itertools
+
+import numpy as np
+
+from utils.path_data import SketchPath, SketchPaths
+
+
+class PointGrid:
+    def __init__(self, points, cell_size=None):
+        """
+        Uniform grid over (N, 2) points answering k-nearest-neighbour queries by searching
+        rings of cells outwards from the query, so a query only touches nearby points.
+        Points can be deactivated (e.g. once visited) and are then skipped by queries.
+        """
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.active = np.ones(len(self.points), dtype=bool)
+        if not len(self.points):
+            self.origin = np.zeros(2)
+            self.cell_size = 1.0
+            self.shape = (1, 1)
+            self._cells = {}
+            return
+
+        self.origin = self.points.min(axis=0)
+        extent = self.points.max(axis=0) - self.origin
+        if cell_size is None:
+            # About two points per cell on average
+            area = max(extent[0], 1e-9) * max(extent[1], 1e-9)
+            cell_size = max(np.sqrt(2 * area / len(self.points)), 1e-9)
+        self.cell_size = float(cell_size)
+        self.shape = tuple((extent // self.cell_size).astype(int) + 1)
+
+        # Group point indices by cell with one sort instead of a Python loop
+        cells = self._cell_of(self.points)
+        keys = cells[:, 0] * self.shape[1] + cells[:, 1]
+        order = np.argsort(keys, kind='stable')
+        unique, starts = np.unique(keys[order], return_index=True)
+        self._cells = {int(key): members for key, members in zip(unique, np.split(order, starts[1:]))}
+
+    def __len__(self):
+        return int(self.active.sum())
+
+    def _cell_of(self, points):
+        cells = ((points - self.origin) // self.cell_size).astype(np.int64)
+        return np.clip(cells, 0, np.array(self.shape) - 1)
+
+    def deactivate(self, indices):
+        self.active[indices] = False
+
+    def activate(self, indices):
+        self.active[indices] = True
+
+    def _ring(self, cx, cy, r):
+        """
+        Point indices in the cells at Chebyshev distance r from cell (cx, cy)
+        """
+        width, height = self.shape
+        if r == 0:
+            cells = [(cx, cy)]
+        else:
+            cells = [(x, y) for x in range(cx - r, cx + r + 1) for y in (cy - r, cy + r)]
+            cells += [(x, y) for x in (cx - r, cx + r) for y in range(cy - r + 1, cy + r)]
+        found = [self._cells[x * height + y] for x, y in cells
+                 if 0 <= x < width and 0 <= y < height and x * height + y in self._cells]
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    def nearest(self, point, k=1, accept=None):
+        """
+        Indices of the k nearest active points to point, closest first. accept optionally
+        filters candidates (an array of indices in, boolean mask out).
+        """
+        point = np.asarray(point, dtype=np.float64)
+        cx, cy = self._cell_of(point[None])[0]
+        max_ring = max(self.shape[0], self.shape[1])
+        best = []  # max-heap of (-distance, index)
+        for r in range(max_ring + 1):
+            candidates = self._ring(cx, cy, r)
+            if len(candidates):
+                candidates = candidates[self.active[candidates]]
+            if len(candidates) and accept is not None:
+                candidates = candidates[accept(candidates)]
+            if len(candidates):
+                distances = np.hypot(*(self.points[candidates] - point).T)
+                for distance, index in zip(distances.tolist(), candidates.tolist()):
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, index))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, index))
+            # Points beyond ring r are at least r cells away from the query
+            if len(best) == k and -best[0][0] <= r * self.cell_size:
+                break
+        return [index for _, index in sorted(best, reverse=True)]
+
+    def within(self, point, radius):
+        """
+        Indices of the active points within radius of point
+        """
+        point = np.asarray(point, dtype=np.float64)
+        low = self._cell_of((point - radius)[None])[0]
+        high = self._cell_of((point + radius)[None])[0]
+        found = [self._cells[x * self.shape[1] + y]
+                 for x in range(low[0], high[0] + 1) for y in range(low[1], high[1] + 1)
+                 if x * self.shape[1] + y in self._cells]
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.concatenate(found)
+        candidates = candidates[self.active[candidates]]
+        return candidates[np.hypot(*(self.points[candidates] - point).T) <= radius]
+
+
+def _segment_distances(point, points):
+    """
+    Distance of point to every segment of the (N, 2) polyline points
+    """
+    if len(points) == 1:
+        return np.hypot(*(points - point).T)
+    start, end = points[:-1], points[1:]
+    direction = end - start
+    length_sq = np.einsum('ij,ij->i', direction, direction)
+    t = np.divide(np.einsum('ij,ij->i', point - start, direction), length_sq,
+                  out=np.zeros(len(start)), where=length_sq > 0)
+    nearest = start + np.clip(t, 0.0, 1.0)[:, None] * direction
+    return np.hypot(*(nearest - point).T)
+
+
+class PathIndex:
+    def __init__(self, paths, cell_size=None):
+        """
+        Spatial index over extracted paths: a PointGrid over the path endpoints for
+        nearest-endpoint queries and gap bridging, and a grid of bounding boxes for
+        rectangle selection and "which path is under this pixel" lookups
+        """
+        self.paths = SketchPaths([SketchPath.coerce(path) for path in paths],
+                                 getattr(paths, 'image_size', None))
+        count = len(self.paths)
+        self.bboxes = np.zeros((count, 4), dtype=np.float64)
+        endpoints = np.zeros((2 * count, 2), dtype=np.float64)
+        for k, path in enumerate(self.paths):
+            if len(path):
+                self.bboxes[k, :2] = path.points.min(axis=0)
+                self.bboxes[k, 2:] = path.points.max(axis=0)
+                endpoints[2 * k] = path.points[0]
+                endpoints[2 * k + 1] = path.points[-1]
+        self.endpoints = PointGrid(endpoints)
+
+        # Bounding boxes are registered in every cell they overlap
+        if cell_size is None:
+            sizes = self.bboxes[:, 2:] - self.bboxes[:, :2]
+            cell_size = max(float(np.median(sizes.max(axis=1))) if count else 1.0, 1.0) * 2
+        self.cell_size = cell_size
+        self._cells = {}
+        low = (self.bboxes[:, :2] // cell_size).astype(np.int64)
+        high = (self.bboxes[:, 2:] // cell_size).astype(np.int64)
+        for k in range(count):
+            for x in range(low[k, 0], high[k, 0] + 1):
+                for y in range(low[k, 1], high[k, 1] + 1):
+                    self._cells.setdefault((x, y), []).append(k)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def nearest_endpoint(self, point, k=1, exclude=None):
+        """
+        The k path ends closest to point as (path index, end) pairs, end 0 being the first
+        point and 1 the last; paths in exclude are skipped
+        """
+        accept = None
+        if exclude is not None:
+            excluded = np.zeros(len(self.paths), dtype=bool)
+            excluded[list(exclude)] = True
+            accept = lambda candidates: ~excluded[candidates // 2]
+        return [(index // 2, index % 2) for index in self.endpoints.nearest(point, k, accept)]
+
+    def _candidates(self, x0, y0, x1, y1):
+        found = set()
+        for x in range(int(x0 // self.cell_size), int(x1 // self.cell_size) + 1):
+            for y in range(int(y0 // self.cell_size), int(y1 // self.cell_size) + 1):
+                found.update(self._cells.get((x, y), ()))
+        return np.array(sorted(found), dtype=np.int64)
+
+    def select(self, rect, contained=False):
+        """
+        Indices of the paths whose bounding box intersects the (x0, y0, x1, y1) rectangle,
+        or lies entirely inside it when contained is set
+        """
+        x0, y0, x1, y1 = min(rect[0], rect[2]), min(rect[1], rect[3]), max(rect[0], rect[2]), max(rect[1], rect[3])
+        candidates = self._candidates(x0, y0, x1, y1)
+        if not len(candidates):
+            return []
+        boxes = self.bboxes[candidates]
+        if contained:
+            hit = (boxes[:, 0] >= x0) & (boxes[:, 1] >= y0) & (boxes[:, 2] <= x1) & (boxes[:, 3] <= y1)
+        else:
+            hit = (boxes[:, 0] <= x1) & (boxes[:, 1] <= y1) & (boxes[:, 2] >= x0) & (boxes[:, 3] >= y0)
+        return candidates[hit].tolist()
+
+    def path_at(self, point, radius=3):
+        """
+        Index of the path drawn closest to point, if one passes within radius, else None
+        """
+        x, y = point
+        best, best_distance = None, radius
+        for k in self.select((x - radius, y - radius, x + radius, y + radius)):
+            path = self.paths[k]
+            points = path.points.astype(np.float64)
+            if path.closed and len(points) > 1:
+                points = np.concatenate((points, points[:1]))
+            distance = _segment_distances(np.array(point, dtype=np.float64), points).min()
+            if distance <= best_distance:
+                best, best_distance = k, distance
+        return best
+
+    def merge_gaps(self, tolerance):
+        """
+        Join open paths whose ends lie within tolerance of each other into single strokes,
+        closest gaps first; a stroke whose two ends meet becomes a closed path. Closed paths
+        are returned unchanged.
+        """
+        open_paths = [k for k, path in enumerate(self.paths) if not path.closed and len(path)]
+        if not open_paths:
+            return self.paths
+
+        # Candidate links between the ends of different paths (or the two ends of one path)
+        is_open = np.zeros(len(self.paths), dtype=bool)
+        is_open[open_paths] = True
+        links = []
+        for k in open_paths:
+            for end in (0, 1):
+                point = self.endpoints.points[2 * k + end]
+                for other in self.endpoints.within(point, tolerance).tolist():
+                    if other > 2 * k + end and is_open[other // 2]:
+                        distance = float(np.hypot(*(self.endpoints.points[other] - point)))
+                        links.append((distance, 2 * k + end, other))
+        links.sort()
+
+        # Greedy matching of free ends: every end is linked at most once, so the linked
+        # paths form chains, and linking the two free ends of a chain closes it into a loop
+        partner = {}
+        for _, a, b in links:
+            if a not in partner and b not in partner:
+                partner[a] = b
+                partner[b] = a
+
+        merged = SketchPaths(image_size=self.paths.image_size)
+        chains = join_chains([path.points for path in self.paths], partner)
+        if any(path.dense is not None for path in self.paths):
+            # Open paths keep their end points when simplified, so the dense points of
+            # linked paths join up the same way
+            dense = (points for _, points, _ in join_chains([path.detail for path in self.paths], partner))
+        else:
+            dense = itertools.repeat(None)
+        for (k, points, closed), dense_points in zip(chains, dense):
+            path = self.paths[k]
+            merged.append(SketchPath(path.id, points, closed, dense_points) if is_open[k] else path)
+        return merged
+
+
+def join_chains(polylines, partner):
+    """
+    Concatenate polylines linked end to end. partner maps 2 * index + end (0 for the first
+    point, 1 for the last) to the end it is linked to, in both directions. Yields
+    (index of the first polyline, points, closed) per chain in order of the polylines; a
+    chain whose last end links back to its first is closed. Points shared by consecutive
+    polylines are not repeated.
+    """
+    visited = set()
+    for k in range(len(polylines)):
+        if k in visited:
+            continue
+        # Walk to one end of the chain (loops have none, so start anywhere)
+        start, end = k, 0
+        seen = {k}
+        while 2 * start + end in partner:
+            other = partner[2 * start + end]
+            if other // 2 in seen:
+                break
+            start, end = other // 2, 1 - other % 2
+            seen.add(start)
+        # Then collect the chain from there, entering each polyline at the linked end
+        pieces = []
+        current, entry = start, end
+        closed = False
+        while True:
+            visited.add(current)
+            points = polylines[current] if entry == 0 else polylines[current][::-1]
+            if pieces and len(points) and np.array_equal(pieces[-1][-1], points[0]):
+                points = points[1:]
+            pieces.append(points)
+            exit_end = 2 * current + (1 - entry)
+            if exit_end not in partner:
+                break
+            other = partner[exit_end]
+            if other // 2 in visited:
+                closed = True
+                break
+            current, entry = other // 2, other % 2
+        points = np.concatenate(pieces)
+        if closed and len(points) > 1 and np.array_equal(points[0], points[-1]):
+            points = points[:-1]
+        yield k, points, closed
@@ -0,0 +1,66 @@
+import numpy as np
+
+from utils.decimation import decimate
+from utils.path_data import SketchPath, SketchPaths
+
+# Drawn strokes are simplified to within this many pixels unless the processor sets a
+# simplify_tolerance; pointer events are dense and jittery, so most points go
+STROKE_TOLERANCE = 1.0
+# A stroke ending within this many pixels of its start is taken as a closed path
+CLOSE_TOLERANCE = 3.0
+
+
+def stroke_points(stroke):
+    """
+    (N, 3) float array of x, y and timestamp (ms) of a stroke given as a list of [x, y] or
+    [x, y, t] points, or as a dict with such a 'points' list; timestamps default to NaN
+    """
+    if isinstance(stroke, dict):
+        stroke = stroke.get('points', ())
+    points = np.asarray(stroke, dtype=np.float64)
+    if points.size == 0:
+        return np.empty((0, 3))
+    if points.ndim != 2 or points.shape[1] not in (2, 3):
+        raise ValueError(f"Stroke points must be [x, y] or [x, y, t] pairs, got shape {points.shape}")
+    if points.shape[1] == 2:
+        points = np.column_stack((points, np.full(len(points), np.nan)))
+    if not np.isfinite(points[:, :2]).all():
+        raise ValueError("Stroke points must be finite numbers")
+    return points
+
+
+def strokes_to_paths(strokes, canvas_size, tolerance=STROKE_TOLERANCE, close_tolerance=CLOSE_TOLERANCE):
+    """
+    Turn strokes captured on a drawing canvas of canvas_size (width, height) into
+    SketchPaths in the order they were drawn, without rasterizing them: points are clamped
+    to the canvas, snapped to whole pixels, stripped of repeats and simplified to within
+    tolerance pixels. A stroke ending within close_tolerance pixels of its start becomes a
+    closed path. Taps (strokes of a single distinct point) are dropped.
+    """
+    width, height = canvas_size
+    strokes = [stroke_points(stroke) for stroke in strokes]
+    strokes = [points for points in strokes if len(points)]
+    # Timed strokes are put in order of their first timestamp among the places they take;
+    # strokes without timestamps keep their place
+    starts = np.array([points[0, 2] for points in strokes])
+    timed = np.flatnonzero(np.isfinite(starts))
+    order = np.arange(len(strokes))
+    order[timed] = timed[np.argsort(starts[timed], kind='stable')]
+    strokes = [strokes[i] for i in order]
+
+    paths = SketchPaths(image_size=(width, height))
+    for points in strokes:
+        xy = np.rint(points[:, :2])
+        np.clip(xy, 0, (width - 1, height - 1), out=xy)
+        moved = np.ones(len(xy), dtype=bool)
+        moved[1:] = np.any(xy[1:] != xy[:-1], axis=1)
+        xy = xy[moved]
+        if len(xy) < 2:
+            continue
+
+        closed = len(xy) > 3 and np.hypot(*(xy[-1] - xy[0])) <= close_tolerance
+        if closed:
+            xy = xy[:-1]
+        points = decimate(xy, tolerance, closed=closed)
+        paths.append(SketchPath(len(paths), points, closed, dense=xy if len(xy) > len(points) else None))
+    return paths
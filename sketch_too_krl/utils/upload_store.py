@@ -0,0 +1,55 @@
+import os
+import threading
+import time
+import uuid
+
+
+class UploadStore:
+    def __init__(self, folder, max_files=500, max_age=24 * 3600):
+        """
+        Persists uploads and previews to a folder, evicting files older than max_age
+        seconds and the oldest files beyond max_files after every write
+        """
+        self.folder = folder
+        self.max_files = max_files
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def save(self, filename, data):
+        """
+        Write data under a unique name derived from filename and return its path
+        """
+        path = os.path.join(self.folder, f"{uuid.uuid4().hex[:8]}_{filename}")
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.cleanup()
+        return path
+
+    def cleanup(self):
+        with self._lock:
+            now = time.time()
+            entries = []
+            for entry in os.scandir(self.folder):
+                if not entry.is_file():
+                    continue
+                try:
+                    mtime = entry.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                if now - mtime > self.max_age:
+                    self._remove(entry.path)
+                else:
+                    entries.append((mtime, entry.path))
+
+            # Oldest first, drop whatever exceeds the file limit
+            entries.sort()
+            for _, path in entries[:max(0, len(entries) - self.max_files)]:
+                self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass